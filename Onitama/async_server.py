@@ -0,0 +1,397 @@
+import argparse
+import asyncio
+import collections
+import dataclasses
+import itertools
+import os
+import time
+
+from Onitama.bitboard import CARD_NAMES
+from Onitama.game_records import RECORD, RECORD_SIZE, RESULT_DRAW, RESULT_P1_WIN, RESULT_P2_WIN, RecordReader, \
+    RecordWriter, decode_position
+from Onitama.game_tools import BoardState, to_sen, apply_move, is_victory, LOGICAL_TO_MAILBOX
+from Onitama.metrics import Metrics
+
+HOST = 'localhost'
+PORT = 65432
+SPECTATOR_PORT = 65433
+
+# Live lines a spectator may fall behind by before it is disconnected
+SPECTATOR_QUEUE_SIZE = 1024
+
+RESULT_REASONS = {RESULT_P1_WIN: "Player 1 wins", RESULT_P2_WIN: "Player 2 wins", RESULT_DRAW: "Draw"}
+
+
+@dataclasses.dataclass(eq=False)
+class Player:
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+    address: tuple = None
+    role: str = None
+    game: "Game" = None
+    # Resolved by the lobby once an opponent has been found
+    paired: asyncio.Future = None
+
+    def send(self, msg: str):
+        # Writes are buffered by the transport, so sending never blocks the event loop
+        if not self.writer.is_closing():
+            self.writer.write(f"{msg}\n".encode())
+
+
+@dataclasses.dataclass(eq=False)
+class Spectator:
+    """
+    A read-only connection following one game. The game loop only ever queues lines without waiting; pump() writes
+    them out at the spectator's pace, and a spectator that falls SPECTATOR_QUEUE_SIZE lines behind is dropped
+    """
+    writer: asyncio.StreamWriter
+    queue: asyncio.Queue = dataclasses.field(default_factory=lambda: asyncio.Queue(SPECTATOR_QUEUE_SIZE))
+    dropped: bool = False
+
+    def publish(self, line: str | None):
+        # None ends the stream
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(line)
+        except asyncio.QueueFull:
+            self.dropped = True
+            self.writer.transport.abort()
+
+    async def pump(self):
+        while True:
+            line = await self.queue.get()
+            if line is None or self.dropped:
+                break
+            self.writer.write(line.encode())
+            await self.writer.drain()
+
+
+@dataclasses.dataclass(eq=False)
+class Game:
+    game_id: int
+    players: dict[str, Player]
+    board: BoardState = dataclasses.field(default_factory=BoardState)
+    start_board: BoardState = None
+    moves: list[tuple[int, int, str]] = dataclasses.field(default_factory=list)
+    finished: bool = False
+    verbose: bool = False
+    # Finished games are appended here when set
+    recorder: RecordWriter = None
+    # Called with the game and (first record, record count) once it is recorded
+    on_recorded: object = None
+    # Spectator lines so far ("START", "MOVE" and "END"), replayed to spectators who join late
+    stream: list[str] = dataclasses.field(default_factory=list)
+    spectators: set[Spectator] = dataclasses.field(default_factory=set)
+    # Stage timings and counters (disabled unless the server exports them)
+    metrics: Metrics = dataclasses.field(default_factory=Metrics)
+    started_at: float = None
+    # metrics.start() when the last GAME_UPDATE was sent, to time the bot's turn
+    update_sent_at: int = 0
+
+    def start(self):
+        self.start_board = self.board
+        self.started_at = time.perf_counter()
+        for role, player in self.players.items():
+            player.send(f"GAME_START {role}")
+        if self.verbose:
+            print(f"[GAME {self.game_id}]\n{self.board}")
+        sen = to_sen(self.board)
+        self.stream.append(f"START {self.game_id} {sen}\n")
+        self.players[self.turn_role()].send(f"GAME_UPDATE {sen}")
+        self.update_sent_at = self.metrics.start()
+        self.metrics.count("games_started")
+
+    def watch(self, spectator: Spectator):
+        # The backlog goes straight to the transport; later lines go through the spectator's queue
+        spectator.writer.write("".join(self.stream).encode())
+        if self.finished:
+            spectator.publish(None)
+        else:
+            self.spectators.add(spectator)
+
+    def publish(self, line: str):
+        self.stream.append(line)
+        for spectator in self.spectators:
+            spectator.publish(line)
+
+    def turn_role(self) -> str:
+        return "P1" if self.board.is_p1_turn else "P2"
+
+    def process_bot_move(self, player: Player, msg: str):
+        metrics = self.metrics
+        move_start = timer = metrics.start()
+        if self.finished:
+            return
+        if player.role != self.turn_role():
+            player.send("INVALID_MOVE Not your turn.")
+            metrics.count("invalid_moves", self.game_id)
+            return
+        try:
+            parts = msg.strip().split()
+            assert len(parts) == 3, f"Bad move format: '{msg}'"
+
+            logical_from = int(parts[0])
+            logical_to = int(parts[1])
+            card = parts[2]
+
+            from_idx = LOGICAL_TO_MAILBOX[logical_from]
+            to_idx = LOGICAL_TO_MAILBOX[logical_to]
+            timer = metrics.observe("parse", timer)
+            self.board = apply_move(self.board, (from_idx, to_idx, card))
+        except Exception as e:
+            player.send(f"INVALID_MOVE {str(e)}")
+            print(f"[INVALID] Game {self.game_id} {player.role} sent: {msg} — {e}")
+            metrics.count("invalid_moves", self.game_id)
+            return
+        timer = metrics.observe("validate", timer)
+        # From the GAME_UPDATE to the move that answered it; rejected moves and their retries don't count
+        if self.update_sent_at:
+            metrics.record("bot_turn", (move_start - self.update_sent_at) / 1e9)
+
+        self.moves.append((from_idx, to_idx, card))
+        if self.verbose:
+            print(f"[GAME {self.game_id}]\n{self.board}")
+        sen = to_sen(self.board)
+        timer = metrics.observe("to_sen", timer)
+        self.publish(f"MOVE {len(self.moves)} {logical_from} {logical_to} {card} {sen}\n")
+        timer = metrics.observe("publish", timer)
+
+        # Check win condition
+        won, reason = is_victory(self.board)
+        timer = metrics.observe("victory_check", timer)
+        metrics.count("moves", self.game_id)
+        if won:
+            self.finish(reason)
+            metrics.observe("move", move_start)
+            return
+
+        # Notify the next player to move
+        self.players[self.turn_role()].send(f"GAME_UPDATE {sen}")
+        self.update_sent_at = metrics.observe("send", timer)
+        metrics.observe("move", move_start)
+
+    def finish(self, reason: str):
+        if self.finished:
+            return
+        self.finished = True
+        for player in self.players.values():
+            player.send(f"GAME_OVER {reason}")
+        print(f"[GAME OVER] Game {self.game_id} after {len(self.moves)} moves: {reason}")
+        self.metrics.count("games_finished")
+        self.metrics.finish_game(self.game_id, plies=len(self.moves), reason=reason,
+                                 duration_s=time.perf_counter() - self.started_at if self.started_at else 0.0)
+        self.publish(f"END {reason}\n")
+        for spectator in self.spectators:
+            spectator.publish(None)
+        self.spectators.clear()
+        if self.recorder is not None:
+            # Disconnects are recorded without a result
+            p1_score = 1.0 if reason.startswith("Player 1") else 0.0 if reason.startswith("Player 2") else None
+            first_record = self.recorder.file.tell() // RECORD_SIZE
+            self.recorder.write_game(self.start_board, self.moves, p1_score, self.game_id)
+            if self.on_recorded is not None:
+                self.on_recorded(self, (first_record, len(self.moves) + 1))
+
+
+def build_replay_index(path: str) -> dict[int, tuple[int, int]]:
+    # {game id: (first record, record count)} for every game in a record file
+    index = {}
+    if os.path.exists(path) and os.path.getsize(path):
+        with RecordReader(path) as reader:
+            position = 0
+            for game_id, records in reader.games():
+                index[game_id] = (position, len(records))
+                position += len(records)
+    return index
+
+
+def read_replay_lines(path: str, game_id: int, first_record: int, count: int) -> list[str]:
+    # A recorded game in the spectator stream format
+    with open(path, "rb") as record_file:
+        record_file.seek(first_record * RECORD_SIZE)
+        data = record_file.read(count * RECORD_SIZE)
+    records = [decode_position(fields) for fields in RECORD.iter_unpack(data)]
+    lines = [f"START {game_id} {records[0].to_sen()}\n"]
+    for ply, (record, next_record) in enumerate(zip(records, records[1:]), 1):
+        logical_from, logical_to, card_id = record.move
+        lines.append(f"MOVE {ply} {logical_from} {logical_to} {CARD_NAMES[card_id]} {next_record.to_sen()}\n")
+    lines.append(f"END {RESULT_REASONS.get(records[-1].result, 'No result')}\n")
+    return lines
+
+
+class GameServer:
+    """
+    Bots connect on port and are paired from the lobby. Spectators connect on spectator_port and send one command:
+    "LIST" (live game ids), "WATCH <id>" (a live game from its start, then each move as it is played) or
+    "REPLAY <id>" (a finished game from the record file). Games are streamed as a "START <id> <sen>" line,
+    one "MOVE <ply> <from> <to> <card> <sen>" line per move and an "END <reason>" line
+    """
+
+    def __init__(self, host: str = HOST, port: int = PORT, verbose: bool = False, record_path: str = None,
+                 spectator_port: int = SPECTATOR_PORT, metrics_path: str = None, metrics_port: int = None):
+        self.host = host
+        self.port = port
+        self.spectator_port = spectator_port
+        self.verbose = verbose
+        self.record_path = record_path
+        # Recorded games are numbered by their server game id, so ids carry on from the games already in the file
+        self.replay_index = build_replay_index(record_path) if record_path else {}
+        self.recorder = RecordWriter(record_path) if record_path else None
+        # Waiting players in arrival order; the matchmaker is woken whenever one joins
+        self.lobby: collections.deque[Player] = collections.deque()
+        self.lobby_joined = asyncio.Event()
+        self.games: dict[int, Game] = {}
+        self.game_ids = itertools.count(max(self.replay_index, default=0) + 1)
+        self.games_finished = 0
+        self.server: asyncio.Server | None = None
+        self.spectator_server: asyncio.Server | None = None
+        # Metrics are only collected when something exports them
+        self.metrics_path = metrics_path
+        self.metrics_port = metrics_port
+        self.metrics = Metrics(enabled=metrics_path is not None or metrics_port is not None)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        player = Player(reader, writer, writer.get_extra_info("peername"))
+        player.paired = asyncio.get_running_loop().create_future()
+        self.lobby.append(player)
+        self.lobby_joined.set()
+        # The first read runs while the player waits, so a bot that disconnects from the lobby is noticed at once
+        first_read = asyncio.ensure_future(reader.readline())
+
+        try:
+            await asyncio.wait((player.paired, first_read), return_when=asyncio.FIRST_COMPLETED)
+            if not player.paired.done() and not first_read.result():
+                return
+            await player.paired
+            line = await first_read
+            while line:
+                msg = line.decode().strip()
+                if msg:
+                    player.game.process_bot_move(player, msg)
+                    timer = self.metrics.start()
+                    await writer.drain()
+                    self.metrics.observe("drain", timer)
+                line = await reader.readline()
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            print(f"[ERROR] {player.role} - {e}")
+        finally:
+            first_read.cancel()
+            if not player.paired.done() and player in self.lobby:
+                self.lobby.remove(player)
+            game = player.game
+            if game is not None and not game.finished:
+                game.finish(f"{player.role} disconnected")
+            if game is not None and game.game_id in self.games and game.finished:
+                del self.games[game.game_id]
+                self.games_finished += 1
+            writer.close()
+
+    async def matchmaker(self):
+        # Pair lobby players in arrival order; the first to arrive plays P1
+        while True:
+            if len(self.lobby) < 2:
+                self.lobby_joined.clear()
+                await self.lobby_joined.wait()
+                continue
+            first = self.lobby.popleft()
+            second = self.lobby.popleft()
+            # Survivors go back to the front, so they keep their place ahead of later arrivals
+            if first.writer.is_closing():
+                self.lobby.appendleft(second)
+                continue
+            if second.writer.is_closing():
+                self.lobby.appendleft(first)
+                continue
+
+            game = Game(next(self.game_ids), {"P1": first, "P2": second}, verbose=self.verbose,
+                        recorder=self.recorder, on_recorded=self.index_game, metrics=self.metrics)
+            self.games[game.game_id] = game
+            for role, player in game.players.items():
+                player.role = role
+                player.game = game
+            print(f"[MATCHED] Game {game.game_id}: P1 {first.address} vs P2 {second.address}")
+            game.start()
+            first.paired.set_result(game)
+            second.paired.set_result(game)
+
+    def index_game(self, game: Game, records: tuple[int, int]):
+        self.replay_index[game.game_id] = records
+
+    async def handle_spectator(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        game = None
+        spectator = None
+        try:
+            command, _, argument = (await reader.readline()).decode().strip().partition(" ")
+            if command == "LIST":
+                writer.write(f"GAMES {' '.join(str(game_id) for game_id in self.games)}\n".encode())
+            elif command == "WATCH":
+                game = self.games.get(int(argument))
+                if game is None:
+                    writer.write(f"ERROR No live game {argument}\n".encode())
+                else:
+                    spectator = Spectator(writer)
+                    game.watch(spectator)
+                    self.metrics.count("spectators")
+                    await spectator.pump()
+            elif command == "REPLAY":
+                records = self.replay_index.get(int(argument))
+                if records is None:
+                    writer.write(f"ERROR No recorded game {argument}\n".encode())
+                else:
+                    # File reads happen off the event loop
+                    lines = await asyncio.to_thread(read_replay_lines, self.record_path, int(argument), *records)
+                    self.metrics.count("replays")
+                    for line in lines:
+                        writer.write(line.encode())
+                        await writer.drain()
+            else:
+                writer.write(f"ERROR Unknown command '{command}'\n".encode())
+            await writer.drain()
+        except ValueError:
+            writer.write(b"ERROR Game ids are integers\n")
+        except ConnectionError:
+            pass
+        finally:
+            if spectator is not None:
+                game.spectators.discard(spectator)
+            writer.close()
+
+    async def serve(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port, backlog=1024)
+        self.spectator_server = await asyncio.start_server(self.handle_spectator, self.host, self.spectator_port,
+                                                           backlog=1024)
+        print(f"[SERVER] Starting on {self.host}:{self.port}, spectators on {self.spectator_port}")
+        matchmaker = asyncio.create_task(self.matchmaker())
+        exporter = None
+        if self.metrics.enabled:
+            exporter = asyncio.create_task(self.metrics.export(self.metrics_path, self.metrics_port, self.host))
+        try:
+            async with self.server, self.spectator_server:
+                await self.server.serve_forever()
+        finally:
+            matchmaker.cancel()
+            if exporter is not None:
+                # Cancelling the exporter writes the final metrics file
+                exporter.cancel()
+                await asyncio.gather(exporter, return_exceptions=True)
+            if self.recorder is not None:
+                self.recorder.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-game Onitama server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--verbose", action="store_true", help="Print the board after every move")
+    parser.add_argument("--record-file", default=None,
+                        help="Append finished games to this binary record file (needed for REPLAY)")
+    parser.add_argument("--spectator-port", type=int, default=SPECTATOR_PORT)
+    parser.add_argument("--metrics-file", default=None, help="Write stage timings and counters here every few seconds")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve metrics over HTTP (Prometheus text)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(GameServer(args.host, args.port, args.verbose, args.record_file, args.spectator_port,
+                               args.metrics_file, args.metrics_port).serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,154 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+from Onitama.bitboard import BOARD_SQUARES, CARD_INDEX, CARD_NAMES, CARD_TARGET_MASKS
+from Onitama.bot_tools import EVAL_WEIGHT_NAMES, EVAL_WEIGHTS, MOBILITY_CAP, STUDENT_ROWS, TEMPLE_STEPS, \
+    evaluate_heuristic, get_all_valid_moves
+from Onitama.game_tools import BoardState, LOGICAL_TO_MAILBOX, apply_move, is_victory, to_sen
+
+# Piece plane codes, one int8 per logical square
+EMPTY = 0
+P1_STUDENT = 1
+P1_MASTER = 2
+P2_STUDENT = 3
+P2_MASTER = 4
+PIECE_CODES = {".": EMPTY, "s": P1_STUDENT, "m": P1_MASTER, "S": P2_STUDENT, "M": P2_MASTER}
+
+# Evaluation terms, in the order of the columns returned by batch_features. evaluate_heuristic is the dot product of
+# a position's features with the loaded evaluation weights
+FEATURE_NAMES = EVAL_WEIGHT_NAMES
+DEFAULT_WEIGHTS = np.array([EVAL_WEIGHTS[name] for name in FEATURE_NAMES], dtype=np.int64)
+
+# Per side (0 = P1, 1 = P2) and logical square: temple steps for the master and rows advanced for a student
+TEMPLE_STEP_TABLE = np.array(TEMPLE_STEPS, dtype=np.int64)
+STUDENT_ROW_TABLE = np.array(STUDENT_ROWS, dtype=np.int64)
+
+# ATTACKS[card, side] is a 25x25 matrix with a 1 where a piece on the row square can move to the column square
+ATTACKS = np.array([[[[mask >> target & 1 for target in range(BOARD_SQUARES)] for mask in per_side]
+                     for per_side in per_card] for per_card in CARD_TARGET_MASKS], dtype=np.float32)
+
+# Numpy view of a game_records.RECORD
+RECORD_DTYPE = np.dtype({"names": ["masks", "cards", "is_p1_turn", "move", "result", "game_id"],
+                         "formats": [("<u4", 4), ("u1", 5), "u1", ("u1", 3), "u1", "<u4"],
+                         "offsets": [0, 16, 21, 22, 25, 26], "itemsize": 32})
+
+
+def encode_positions(states: list[BoardState]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Encode positions as (planes, cards, is_p1_turn): an N x 25 int8 array of piece codes in logical square order, an
+    N x 5 uint8 array of card ids (P1 hand, P2 hand, center) and an N bool array
+    """
+    planes = np.array([[PIECE_CODES[state.mailbox_board[i]] for i in LOGICAL_TO_MAILBOX] for state in states],
+                      dtype=np.int8).reshape(len(states), BOARD_SQUARES)
+    cards = np.array([[CARD_INDEX[card] for card in (*state.p1_cards, *state.p2_cards, state.center_card)]
+                      for state in states], dtype=np.uint8).reshape(len(states), 5)
+    is_p1_turn = np.array([state.is_p1_turn for state in states], dtype=bool)
+    return planes, cards, is_p1_turn
+
+
+def encode_records(buffer) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # The same encoding straight from game_records data (bytes, or the mmap of a RecordReader), without decoding
+    records = np.frombuffer(buffer, dtype=RECORD_DTYPE)
+    bits = (records["masks"][:, :, None] >> np.arange(BOARD_SQUARES, dtype=np.uint32)) & 1
+    codes = np.array([P1_STUDENT, P1_MASTER, P2_STUDENT, P2_MASTER], dtype=np.int8)
+    planes = (bits.astype(np.int8) * codes[None, :, None]).sum(axis=1, dtype=np.int8)
+    return planes, records["cards"].copy(), records["is_p1_turn"].astype(bool)
+
+
+def batch_features(planes: np.ndarray, cards: np.ndarray, is_p1_turn: np.ndarray) -> np.ndarray:
+    """
+    The evaluate_heuristic terms for every position, from the side to move's point of view, as an N x 7 int64
+    array with columns FEATURE_NAMES: student and master balance, temple steps of the own master, rows advanced by
+    own students, moves (capped at MOBILITY_CAP) and moves onto enemy students and masters
+    """
+    side = (~is_p1_turn).astype(np.intp)
+    own_student_code = np.where(is_p1_turn, P1_STUDENT, P2_STUDENT)[:, None]
+    own_master_code = own_student_code + 1
+    enemy_student_code = np.where(is_p1_turn, P2_STUDENT, P1_STUDENT)[:, None]
+    enemy_master_code = enemy_student_code + 1
+
+    own_students = planes == own_student_code
+    own_master = planes == own_master_code
+    enemy_students = planes == enemy_student_code
+    enemy_master = planes == enemy_master_code
+    own = own_students | own_master
+
+    features = np.empty((len(planes), len(FEATURE_NAMES)), dtype=np.int64)
+    features[:, 0] = own_students.sum(axis=1) - enemy_students.sum(axis=1)
+    features[:, 1] = own_master.sum(axis=1) - enemy_master.sum(axis=1)
+    features[:, 2] = (own_master * TEMPLE_STEP_TABLE[side]).sum(axis=1)
+    features[:, 3] = (own_students * STUDENT_ROW_TABLE[side]).sum(axis=1)
+
+    # reach[n, square]: how many (own piece, hand card) pairs can move onto the square. Positions are grouped by
+    # (card, side) so each group is one matrix product
+    hands = np.where(is_p1_turn[:, None], cards[:, 0:2], cards[:, 2:4]).astype(np.intp)
+    own_float = own.astype(np.float32)
+    reach = np.zeros((len(planes), BOARD_SQUARES), dtype=np.float32)
+    for slot in (0, 1):
+        groups = hands[:, slot] * 2 + side
+        for group in np.unique(groups):
+            rows = np.flatnonzero(groups == group)
+            reach[rows] += own_float[rows] @ ATTACKS[group // 2, group % 2]
+    reach = reach.astype(np.int64)
+
+    features[:, 4] = np.minimum(MOBILITY_CAP, (reach * ~own).sum(axis=1))
+    features[:, 5] = (reach * enemy_students).sum(axis=1)
+    features[:, 6] = (reach * enemy_master).sum(axis=1)
+    return features
+
+
+def evaluate_batch(planes: np.ndarray, cards: np.ndarray, is_p1_turn: np.ndarray,
+                   weights: np.ndarray = DEFAULT_WEIGHTS) -> np.ndarray:
+    # evaluate_heuristic for every position
+    return batch_features(planes, cards, is_p1_turn) @ weights
+
+
+def random_positions(count: int, seed: int = 0) -> list[BoardState]:
+    # Positions from random games, for checks and benchmarks
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        state = BoardState(None, rng.choice((True, False)), *_deal(rng))
+        while len(positions) < count and not is_victory(state)[0]:
+            positions.append(state)
+            legal_moves = get_all_valid_moves(state)
+            if not legal_moves:
+                break
+            state = apply_move(state, rng.choice(legal_moves))
+    return positions
+
+
+def _deal(rng: random.Random) -> tuple[list[str], list[str], str]:
+    cards = rng.sample(CARD_NAMES, 5)
+    return cards[0:2], cards[2:4], cards[4]
+
+
+def check_batch_evaluation(count: int = 20000, seed: int = 0) -> int:
+    # Compare evaluate_batch with evaluate_heuristic on positions from random games
+    positions = random_positions(count, seed)
+    scores = evaluate_batch(*encode_positions(positions))
+    for state, score in zip(positions, scores):
+        expected = evaluate_heuristic(state)
+        assert score == expected, f"Batch evaluation {score} != {expected} for {to_sen(state)}"
+    return len(positions)
+
+
+def benchmark_batch_evaluation(count: int = 100000, seed: int = 0):
+    planes, cards, is_p1_turn = encode_positions(random_positions(count, seed))
+    start_time = time.perf_counter()
+    evaluate_batch(planes, cards, is_p1_turn)
+    elapsed = time.perf_counter() - start_time
+    print(f"evaluate_batch: {count} positions in {elapsed:.3f}s ({count / elapsed:.0f} positions/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and benchmark the batch evaluator")
+    parser.add_argument("--check", type=int, default=20000, help="Positions to compare with evaluate_heuristic")
+    parser.add_argument("--benchmark", type=int, default=100000, help="Positions to time")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(f"check: {check_batch_evaluation(args.check, args.seed)} positions ok")
+    benchmark_batch_evaluation(args.benchmark, args.seed)
@@ -0,0 +1,282 @@
+import argparse
+import random
+import time
+
+from Onitama import bitboard
+from Onitama.bot_tools import SearchContext, get_all_valid_moves, timed_alpha_beta_id_minimax, \
+    depth_limited_alpha_beta_id_minimax
+from Onitama.game_tools import BoardState, CARD_MOVES, LOGICAL_TO_MAILBOX, MAILBOX_SIZE, MAILBOX_TO_LOGICAL, \
+    apply_move, decode_sen, is_victory, make_move, parse_sen, parse_sen_cache_clear, to_sen, unmake_move
+
+# Fixed corpus of positions for search benchmarks (opening, quiet and tactical middlegames)
+BENCHMARK_POSITIONS = [
+    "SSMSS/5/5/5/ssmss/OXCOCBMOBO1",
+    "S1MS1/S3S/5/5/ssmss/GOROCOTIHO0",
+    "1SMSS/1S3/5/5/m1sss/CROXFRRAEE0",
+    "S1MSS/3S1/2s2/5/s1mss/GORAMOHORO1",
+    "SSM1S/3S1/5/1s3/1smss/FRGOMAEERO1",
+    "1SM1S/5/1S2S/4s/1sms1/MOELMABOOX0",
+    "1SMSS/S4/s4/5/s1mss/TIOXCRBOMA1",
+    "S3S/M1S1S/s4/5/1sm1s/GOELOXTIEE1",
+    "1SMS1/4S/5/2ss1/2mss/GOTICODROX0",
+    "S1S2/4S/2M1S/sms2/2s2/CRHOCBEEBO1",
+    "1S2S/1S1MS/5/m1s2/s2ss/FREEDRRAMA0",
+]
+
+# Reference leaf counts from get_all_valid_moves/apply_move, for validating other board representations
+REFERENCE_PERFT = {
+    "SSMSS/5/5/5/ssmss/OXCOCBMOBO1": (1, 13, 117, 1665, 20389, 299839),
+    "SSMSS/5/5/5/ssmss/TIDRCBFRRA0": (1, 11, 99, 1125, 11947, 152682),
+    "S1S2/4S/2M1S/sms2/2s2/CRHOCBEEBO1": (1, 15, 193, 3158, 36557, 584720),
+    "1S2S/1S1MS/5/m1s2/s2ss/FREEDRRAMA0": (1, 11, 165, 2092, 29692, 406553),
+}
+
+
+def format_move(move: tuple[int, int, str]) -> str:
+    # Same notation the bots send to the server: "<logical_from> <logical_to> <card>"
+    from_idx, to_idx, card = move
+    return f"{MAILBOX_TO_LOGICAL[from_idx]} {MAILBOX_TO_LOGICAL[to_idx]} {card}"
+
+
+def perft(state: BoardState, depth: int) -> int:
+    # Count leaf positions depth plies ahead; finished games have no moves
+    if depth == 0:
+        return 1
+    if is_victory(state)[0]:
+        return 0
+    return sum(perft(apply_move(state, move), depth - 1) for move in get_all_valid_moves(state))
+
+
+def perft_make_unmake(state: BoardState, depth: int) -> int:
+    if depth == 0:
+        return 1
+    if is_victory(state)[0]:
+        return 0
+    nodes = 0
+    for move in get_all_valid_moves(state):
+        undo = make_move(state, move)
+        nodes += perft_make_unmake(state, depth - 1)
+        unmake_move(state, move, undo)
+    return nodes
+
+
+def perft_bitboard(state: bitboard.BitBoardState, depth: int) -> int:
+    if depth == 0:
+        return 1
+    if bitboard.is_victory(state)[0]:
+        return 0
+    if depth == 1:
+        return len(bitboard.get_all_valid_moves(state))
+    return sum(perft_bitboard(bitboard.apply_move(state, move), depth - 1)
+               for move in bitboard.get_all_valid_moves(state))
+
+
+PERFT_FUNCTIONS = {
+    "mailbox": (parse_sen, perft),
+    "make_unmake": (parse_sen, perft_make_unmake),
+    "bitboard": (bitboard.parse_bitboard_sen, perft_bitboard),
+}
+
+
+def run_perft(sen: str, depth: int, board: str = "mailbox", divide: bool = False) -> int:
+    parse, count = PERFT_FUNCTIONS[board]
+    state = parse(sen)
+    start_time = time.perf_counter()
+
+    if divide:
+        # Leaf counts under each root move
+        total = 0
+        if board == "bitboard":
+            root_moves = [(bitboard.to_mailbox_move(move), bitboard.apply_move(state, move))
+                          for move in bitboard.get_all_valid_moves(state)]
+        else:
+            root_moves = [(move, apply_move(state, move)) for move in get_all_valid_moves(state)]
+        for move, child in sorted(root_moves, key=lambda root_move: format_move(root_move[0])):
+            nodes = count(child, depth - 1)
+            total += nodes
+            print(f"{format_move(move)}: {nodes}")
+    else:
+        total = count(state, depth)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"perft({depth}) = {total}  [{board}, {elapsed:.3f}s, {total / max(elapsed, 1e-9):.0f} leaves/s]")
+    return total
+
+
+def validate_perft(board: str = "mailbox", max_depth: int = 4) -> bool:
+    # Compare a board representation against the reference leaf counts
+    parse, count = PERFT_FUNCTIONS[board]
+    valid = True
+    for sen, expected in REFERENCE_PERFT.items():
+        for depth in range(min(max_depth, len(expected) - 1) + 1):
+            nodes = count(parse(sen), depth)
+            if nodes != expected[depth]:
+                print(f"[MISMATCH] {sen} perft({depth}) = {nodes}, expected {expected[depth]}")
+                valid = False
+    print(f"{board}: {'ok' if valid else 'FAILED'}")
+    return valid
+
+
+def run_search_benchmark(positions: list[str], depth: int = 5, time_budget: float = None,
+                         use_quiescence: bool = True) -> dict[str, float]:
+    # Search every position with a fresh context and report nodes, NPS, time to depth and best moves
+    total_nodes = 0
+    total_quiescence_nodes = 0
+    total_time = 0.0
+    time_to_depth = {}
+    for sen in positions:
+        state = parse_sen(sen)
+        context = SearchContext(use_quiescence=use_quiescence)
+        start_time = time.perf_counter()
+        if time_budget is not None:
+            move = timed_alpha_beta_id_minimax(state, time_budget, context=context)
+        else:
+            move = depth_limited_alpha_beta_id_minimax(state, context, depth)
+        elapsed = time.perf_counter() - start_time
+
+        nodes = context.nodes + context.quiescence_nodes
+        total_nodes += context.nodes
+        total_quiescence_nodes += context.quiescence_nodes
+        total_time += elapsed
+        for completed, seconds in context.time_by_depth.items():
+            time_to_depth[completed] = time_to_depth.get(completed, 0.0) + seconds
+        print(f"{sen:<40} depth {context.completed_depth:>2}  best {format_move(move):<10} "
+              f"score {context.best_score:>7}  nodes {context.nodes:>8}  qnodes {context.quiescence_nodes:>8}  "
+              f"{nodes / elapsed:>7.0f} nps  {elapsed:.3f}s")
+
+    all_nodes = total_nodes + total_quiescence_nodes
+    depths = " ".join(f"d{completed}={seconds / len(positions):.3f}s" for completed, seconds in time_to_depth.items())
+    print(f"Total: {total_nodes} nodes + {total_quiescence_nodes} quiescence nodes in {total_time:.3f}s "
+          f"({all_nodes / total_time:.0f} nps)")
+    print(f"Average time to depth: {depths}")
+    return {"nodes": total_nodes, "quiescence_nodes": total_quiescence_nodes, "seconds": total_time,
+            "nps": all_nodes / total_time}
+
+
+def reference_parse_sen(sen: str) -> BoardState:
+    # The string-building parser game_tools.parse_sen replaced, kept to check and time the table-driven one against
+    sections = sen.split("/")
+    card_section = sections[-1][:-1]
+    cards = [card_section[i] + card_section[i + 1] for i in range(0, len(card_section), 2)]
+    board_list = []
+    for row in sections[:-1]:
+        row_string = ""
+        for space in row:
+            row_string += "." * int(space) if space.isdigit() else space
+        board_list += row_string
+    mailbox = [None] * MAILBOX_SIZE
+    for i, space in enumerate(board_list):
+        mailbox[LOGICAL_TO_MAILBOX[i]] = space
+    return BoardState(mailbox, sections[-1][-1] == "0", cards[0:2], cards[2:4], cards[4])
+
+
+def reference_to_sen(board_state: BoardState) -> str:
+    # The string-building serializer game_tools.to_sen replaced
+    board_rows = []
+    for row in range(5):
+        row_data = ""
+        for col in range(5):
+            val = board_state.mailbox_board[LOGICAL_TO_MAILBOX[row * 5 + col]]
+            row_data += val if val and val != "." else "1"
+        compressed = ""
+        count = 0
+        for char in row_data:
+            if char == "1":
+                count += 1
+            else:
+                if count > 0:
+                    compressed += str(count)
+                    count = 0
+                compressed += char
+        if count > 0:
+            compressed += str(count)
+        board_rows.append(compressed)
+    card_string = "".join(board_state.p1_cards + board_state.p2_cards + [board_state.center_card])
+    return "/".join(board_rows) + "/" + card_string + ("0" if board_state.is_p1_turn else "1")
+
+
+def game_positions(count: int, seed: int = 0) -> list[str]:
+    # SENs from random games, as a server would see them
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        deck = rng.sample(sorted(CARD_MOVES), 5)
+        state = BoardState(None, rng.choice((True, False)), deck[:2], deck[2:4], deck[4])
+        while not is_victory(state)[0] and len(positions) < count:
+            positions.append(to_sen(state))
+            state = apply_move(state, rng.choice(get_all_valid_moves(state)))
+    return positions
+
+
+def run_sen_benchmark(count: int = 10000, repeats: int = 5) -> dict[str, float]:
+    """
+    Time the SEN codec against the string-building reference functions on positions from random games, after
+    checking they agree. Each position is parsed repeats times in a row, as a GAME_UPDATE is by both players and
+    any spectators, so parse_sen shows the cache and decode_sen the decoding alone
+    """
+    positions = game_positions(count)
+    states = [reference_parse_sen(sen) for sen in positions]
+    for sen, state in zip(positions, states):
+        assert to_sen(state) == reference_to_sen(state) == sen, sen
+        assert decode_sen(sen) == state and parse_sen(sen) == state, sen
+    # The checks filled the parse cache, which would make every timed parse_sen call a hit
+    parse_sen_cache_clear()
+    repeated = [sen for sen in positions for _ in range(repeats)]
+    squares = LOGICAL_TO_MAILBOX * (count // len(LOGICAL_TO_MAILBOX) + 1)
+
+    def logical_index_scan(mailbox_index):
+        return LOGICAL_TO_MAILBOX.index(mailbox_index)
+
+    cases = {
+        "parse (reference)": (reference_parse_sen, repeated),
+        "parse (decode_sen)": (decode_sen, repeated),
+        "parse (parse_sen)": (parse_sen, repeated),
+        "to_sen (reference)": (reference_to_sen, states * repeats),
+        "to_sen": (to_sen, states * repeats),
+        "logical index (scan)": (logical_index_scan, squares * repeats),
+        "logical index (table)": (MAILBOX_TO_LOGICAL.__getitem__, squares * repeats),
+    }
+    results = {}
+    for name, (function, inputs) in cases.items():
+        start_time = time.perf_counter()
+        for value in inputs:
+            function(value)
+        elapsed = time.perf_counter() - start_time
+        results[name] = elapsed / len(inputs) * 1e9
+        print(f"{name:<24} {results[name]:>8.0f} ns/call")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Onitama perft and search benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    perft_parser = subparsers.add_parser("perft", help="Count leaf positions to a depth")
+    perft_parser.add_argument("sen", nargs="?", default=BENCHMARK_POSITIONS[0])
+    perft_parser.add_argument("--depth", type=int, default=4)
+    perft_parser.add_argument("--divide", action="store_true", help="Print leaf counts per root move")
+    perft_parser.add_argument("--board", choices=PERFT_FUNCTIONS, default="mailbox")
+
+    validate_parser = subparsers.add_parser("validate", help="Check perft against the reference counts")
+    validate_parser.add_argument("--board", choices=PERFT_FUNCTIONS, nargs="+", default=list(PERFT_FUNCTIONS))
+    validate_parser.add_argument("--depth", type=int, default=4)
+
+    search_parser = subparsers.add_parser("search", help="Search the benchmark corpus")
+    search_parser.add_argument("--depth", type=int, default=5)
+    search_parser.add_argument("--time", type=float, default=None, help="Seconds per position instead of a depth")
+    search_parser.add_argument("--no-quiescence", action="store_true", help="Evaluate the horizon statically")
+
+    sen_parser = subparsers.add_parser("sen", help="Time SEN parsing and serialization")
+    sen_parser.add_argument("--positions", type=int, default=10000)
+    sen_parser.add_argument("--repeats", type=int, default=5, help="Times each position is parsed")
+
+    args = parser.parse_args()
+    if args.command == "perft":
+        run_perft(args.sen, args.depth, args.board, args.divide)
+    elif args.command == "validate":
+        for board_name in args.board:
+            validate_perft(board_name, args.depth)
+    elif args.command == "sen":
+        run_sen_benchmark(args.positions, args.repeats)
+    else:
+        run_search_benchmark(BENCHMARK_POSITIONS, args.depth, args.time, not args.no_quiescence)
@@ -0,0 +1,204 @@
+import dataclasses
+
+from Onitama.game_tools import BoardState, CARD_MOVES, LOGICAL_TO_MAILBOX, MAILBOX_SIZE, MAILBOX_TO_LOGICAL, \
+    parse_sen, to_sen
+
+# Bit i of every mask is logical square i (row * 5 + col), so a full board fits in 25 bits
+BOARD_WIDTH = 5
+BOARD_SQUARES = BOARD_WIDTH * BOARD_WIDTH
+FULL_MASK = (1 << BOARD_SQUARES) - 1
+
+# Side indices used to address the per-side tuples
+P1 = 0
+P2 = 1
+
+# Cards are stored as indices into CARD_NAMES rather than strings
+CARD_NAMES = tuple(CARD_MOVES.keys())
+CARD_INDEX = {card: i for i, card in enumerate(CARD_NAMES)}
+
+# Temple squares, named after the player who starts on them
+P1_TEMPLE = 22
+P2_TEMPLE = 2
+P1_TEMPLE_MASK = 1 << P1_TEMPLE
+P2_TEMPLE_MASK = 1 << P2_TEMPLE
+
+
+def _build_target_masks() -> tuple[tuple[tuple[int, ...], ...], ...]:
+    # CARD_TARGET_MASKS[card][side][square] -> mask of on-board destinations
+    tables = []
+    for card in CARD_NAMES:
+        per_side = []
+        for side in (P1, P2):
+            per_square = []
+            for square in range(BOARD_SQUARES):
+                row, col = divmod(square, BOARD_WIDTH)
+                mask = 0
+                for dx, dy in CARD_MOVES[card]:
+                    # Flip for P2 (rotated board)
+                    if side == P2:
+                        dx, dy = -dx, -dy
+                    to_row, to_col = row - dy, col + dx
+                    if 0 <= to_row < BOARD_WIDTH and 0 <= to_col < BOARD_WIDTH:
+                        mask |= 1 << (to_row * BOARD_WIDTH + to_col)
+                per_square.append(mask)
+            per_side.append(tuple(per_square))
+        tables.append(tuple(per_side))
+    return tuple(tables)
+
+
+CARD_TARGET_MASKS = _build_target_masks()
+
+
+@dataclasses.dataclass(slots=True)
+class BitBoardState:
+    # Masks are indexed by side (P1, P2); cards are indices into CARD_NAMES
+    students: tuple[int, int]
+    masters: tuple[int, int]
+    is_p1_turn: bool
+    p1_cards: tuple[int, int]
+    p2_cards: tuple[int, int]
+    center_card: int
+
+    def __str__(self) -> str:
+        return str(to_board_state(self))
+
+
+def from_board_state(board_state: BoardState) -> BitBoardState:
+    students = [0, 0]
+    masters = [0, 0]
+    for square, mailbox_index in enumerate(LOGICAL_TO_MAILBOX):
+        piece = board_state.mailbox_board[mailbox_index]
+        if not piece or piece == ".":
+            continue
+        side = P1 if piece.islower() else P2
+        if piece in "sS":
+            students[side] |= 1 << square
+        else:
+            masters[side] |= 1 << square
+
+    return BitBoardState(
+        (students[P1], students[P2]),
+        (masters[P1], masters[P2]),
+        board_state.is_p1_turn,
+        (CARD_INDEX[board_state.p1_cards[0]], CARD_INDEX[board_state.p1_cards[1]]),
+        (CARD_INDEX[board_state.p2_cards[0]], CARD_INDEX[board_state.p2_cards[1]]),
+        CARD_INDEX[board_state.center_card],
+    )
+
+
+def to_board_state(state: BitBoardState) -> BoardState:
+    mailbox = [None] * MAILBOX_SIZE
+    pieces = (("s", state.students[P1]), ("m", state.masters[P1]), ("S", state.students[P2]),
+              ("M", state.masters[P2]))
+    for square, mailbox_index in enumerate(LOGICAL_TO_MAILBOX):
+        bit = 1 << square
+        mailbox[mailbox_index] = "."
+        for char, mask in pieces:
+            if mask & bit:
+                mailbox[mailbox_index] = char
+                break
+
+    return BoardState(
+        mailbox,
+        state.is_p1_turn,
+        [CARD_NAMES[card] for card in state.p1_cards],
+        [CARD_NAMES[card] for card in state.p2_cards],
+        CARD_NAMES[state.center_card],
+    )
+
+
+def parse_bitboard_sen(sen: str) -> BitBoardState:
+    return from_board_state(parse_sen(sen))
+
+
+def bitboard_to_sen(state: BitBoardState) -> str:
+    return to_sen(to_board_state(state))
+
+
+def to_mailbox_move(move: tuple[int, int, int]) -> tuple[int, int, str]:
+    from_square, to_square, card = move
+    return LOGICAL_TO_MAILBOX[from_square], LOGICAL_TO_MAILBOX[to_square], CARD_NAMES[card]
+
+
+def from_mailbox_move(move: tuple[int, int, str]) -> tuple[int, int, int]:
+    from_idx, to_idx, card = move
+    return MAILBOX_TO_LOGICAL[from_idx], MAILBOX_TO_LOGICAL[to_idx], CARD_INDEX[card]
+
+
+def get_all_valid_moves(state: BitBoardState) -> list[tuple[int, int, int]]:
+    side = P1 if state.is_p1_turn else P2
+    own = state.students[side] | state.masters[side]
+    hand = state.p1_cards if state.is_p1_turn else state.p2_cards
+    tables = [(card, CARD_TARGET_MASKS[card][side]) for card in hand]
+
+    moves = []
+    pieces = own
+    while pieces:
+        piece_bit = pieces & -pieces
+        pieces ^= piece_bit
+        square = piece_bit.bit_length() - 1
+        for card, table in tables:
+            # Everything not occupied by an ally is a legal destination
+            targets = table[square] & ~own
+            while targets:
+                target_bit = targets & -targets
+                targets ^= target_bit
+                moves.append((square, target_bit.bit_length() - 1, card))
+    return moves
+
+
+def apply_move(state: BitBoardState, move: tuple[int, int, int]) -> BitBoardState:
+    # Unchecked: the move is assumed to come from get_all_valid_moves
+    from_square, to_square, card = move
+    from_bit = 1 << from_square
+    to_bit = 1 << to_square
+    keep = ~to_bit
+
+    p1_students, p2_students = state.students
+    p1_master, p2_master = state.masters
+    if state.is_p1_turn:
+        if p1_students & from_bit:
+            p1_students ^= from_bit | to_bit
+        else:
+            p1_master ^= from_bit | to_bit
+        p2_students &= keep
+        p2_master &= keep
+    else:
+        if p2_students & from_bit:
+            p2_students ^= from_bit | to_bit
+        else:
+            p2_master ^= from_bit | to_bit
+        p1_students &= keep
+        p1_master &= keep
+
+    # The played card goes to the center, the old center card joins the end of the hand
+    hand = state.p1_cards if state.is_p1_turn else state.p2_cards
+    new_hand = (hand[1], state.center_card) if hand[0] == card else (hand[0], state.center_card)
+
+    if state.is_p1_turn:
+        return BitBoardState((p1_students, p2_students), (p1_master, p2_master), False,
+                             new_hand, state.p2_cards, card)
+    else:
+        return BitBoardState((p1_students, p2_students), (p1_master, p2_master), True,
+                             state.p1_cards, new_hand, card)
+
+
+def is_victory(state: BitBoardState) -> tuple[bool, str]:
+    # Capture wins
+    if not state.masters[P1]:
+        return True, "Player 2 wins by capture!"
+    if not state.masters[P2]:
+        return True, "Player 1 wins by capture!"
+    # Temple wins
+    if state.masters[P2] & P1_TEMPLE_MASK:
+        return True, "Player 2 wins by occupation!"
+    if state.masters[P1] & P2_TEMPLE_MASK:
+        return True, "Player 1 wins by occupation!"
+    # No win
+    return False, ""
+
+
+if __name__ == '__main__':
+    board = from_board_state(BoardState())
+    print(board)
+    print(bitboard_to_sen(board))
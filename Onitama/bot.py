@@ -1,65 +1,177 @@
+import argparse
 import random
 import socket
+import threading
 
-from Onitama.bot_tools import get_all_valid_moves, depth_limited_alpha_beta_id_minimax
-from Onitama.game_tools import parse_sen, LOGICAL_TO_MAILBOX
+from Onitama.bot_tools import get_all_valid_moves, depth_limited_alpha_beta_id_minimax, timed_alpha_beta_id_minimax, \
+    MAX_PLY, SearchContext, ponder, predict_reply
+from Onitama.game_tools import apply_move, parse_sen, to_sen, MAILBOX_SIZE, MAILBOX_TO_LOGICAL
+from Onitama.mcts import MCTSSearcher
+from Onitama.metrics import Metrics
+from Onitama.opening_book import OpeningBook
+from Onitama.parallel_search import ParallelSearcher
+from Onitama.tablebase import Tablebase
 
 HOST = 'localhost'
 PORT = 65432
 
 
-def choose_move(board_state, role):
+def choose_move(board_state, role, time_budget=None, node_budget=None, searcher=None, book=None, tablebase=None,
+                context=None):
     """
     Choose and return a move as a tuple: (from_idx, to_idx, card)
     This will be converted and sent to the server as: "<logical_from> <logical_to> <card>"
+    With a time_budget (seconds per move), the search deepens until the budget runs out
+    A ParallelSearcher can be passed to spread the search over several processes, or an MCTSSearcher to use
+    Monte Carlo tree search instead (node_budget is then a playout budget)
+    Positions found in the OpeningBook are played without searching
+    A Tablebase gives the (single process) search exact scores for endgames
+    Passing the same SearchContext for every move keeps the transposition table (and any pondering) between moves
     """
-    move = depth_limited_alpha_beta_id_minimax(board_state)
+    if book is not None:
+        move = book.probe(board_state)
+        if move is not None:
+            return move
+    if isinstance(searcher, MCTSSearcher):
+        return searcher.search(board_state, time_budget, node_budget)
+    if searcher is not None:
+        target_depth = 4 if time_budget is None else MAX_PLY - 1
+        return searcher.search(board_state, target_depth, time_budget, node_budget)
+    if context is None:
+        context = SearchContext(tablebase=tablebase)
+    if time_budget is not None:
+        return timed_alpha_beta_id_minimax(board_state, time_budget, node_budget, context)
+    move = depth_limited_alpha_beta_id_minimax(board_state, context)
     return move
 
 
 def logical_index(mailbox_index):
+    return MAILBOX_TO_LOGICAL[mailbox_index] if 0 <= mailbox_index < MAILBOX_SIZE else -1
+
+
+class Ponderer:
+    """
+    Runs bot_tools.ponder in a background thread while the opponent thinks. The thread shares the bot's
+    SearchContext, so it must be stopped before the next search; the socket loop keeps reading meanwhile
+    """
+
+    def __init__(self, context, metrics=None):
+        self.context = context
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.expected_sen = None
+
+    def start(self, board_state):
+        self.stop()
+        predicted = predict_reply(board_state, self.context)
+        self.expected_sen = to_sen(apply_move(board_state, predicted)) if predicted is not None else None
+        self.context.stop_event = self.stop_event
+        self.thread = threading.Thread(target=ponder, args=(board_state, self.context), daemon=True)
+        self.thread.start()
+
+    def stop(self, sen=None):
+        # Stop and wait for the thread; with the SEN that arrived, report whether the predicted reply was played
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self.stop_event.clear()
+        self.context.stop_event = None
+        if sen is not None:
+            outcome = "hit" if sen == self.expected_sen else "miss"
+            self.metrics.count("ponder_hits" if outcome == "hit" else "ponder_misses")
+            print(f"[PONDER] {outcome}: {self.context.nodes + self.context.quiescence_nodes} nodes, "
+                  f"depth {self.context.completed_depth}")
+
+
+def main(time_budget=None, node_budget=None, workers=1, book_path=None, tablebase_path=None, pondering=True,
+         engine="alphabeta", metrics_path=None, mcts_mode="root"):
+    if engine == "mcts":
+        searcher = MCTSSearcher(workers, mcts_mode)
+    else:
+        searcher = ParallelSearcher(workers) if workers > 1 else None
+    book = OpeningBook.load(book_path) if book_path else None
+    tablebase = Tablebase(tablebase_path) if tablebase_path else None
+
+    # Stage timings are only collected when they are written out
+    metrics = Metrics(enabled=metrics_path is not None)
+
     try:
-        return LOGICAL_TO_MAILBOX.index(mailbox_index)
-    except ValueError:
-        return -1
+        play(time_budget, node_budget, searcher, book, tablebase, pondering, metrics)
+    finally:
+        if searcher is not None:
+            searcher.close()
+        if metrics_path is not None:
+            metrics.write(metrics_path)
 
 
-def main():
+def play(time_budget=None, node_budget=None, searcher=None, book=None, tablebase=None, pondering=True,
+         metrics=None):
     role = None
     board = None
     buffer = b""
+    # One context for the whole game, so each search reuses the table from earlier searches and pondering.
+    # Pondering is single process, so it is off with a ParallelSearcher
+    context = SearchContext(tablebase=tablebase)
+    if metrics is None:
+        metrics = Metrics()
+    ponderer = Ponderer(context, metrics) if pondering and searcher is None else None
+    # When our last move was sent, to time the wait for the reply
+    move_sent_at = 0
 
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
         sock.connect((HOST, PORT))
         print("[CONNECTED] Waiting for GAME_START...")
 
-        while True:
-            data = sock.recv(1024)
-            if not data:
-                break
-            buffer += data
-            while b"\n" in buffer:
-                line, buffer = buffer.split(b"\n", 1)
-                msg = line.decode().strip()
-                print("[RECEIVED]", msg)
-
-                if msg.startswith("GAME_START"):
-                    _, role = msg.split(maxsplit=1)
-                    print(f"[GAME STARTED] Role: {role}")
-
-                elif msg.startswith("GAME_UPDATE"):
-                    _, sen = msg.split(maxsplit=1)
-                    board = parse_sen(sen)
-                    if board.is_p1_turn == (role == "P1"):
-                        from_idx, to_idx, card = choose_move(board, role)
-                        send_move(sock, from_idx, to_idx, card)
-
-                elif msg.startswith("INVALID_MOVE"):
-                    print("[WARNING] Invalid move:", msg)
-
-                elif msg.startswith("GAME_OVER"):
-                    print("[GAME OVER]", msg)
-                    return
+        try:
+            while True:
+                data = sock.recv(1024)
+                if not data:
+                    break
+                buffer += data
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    msg = line.decode().strip()
+                    print("[RECEIVED]", msg)
+
+                    if msg.startswith("GAME_START"):
+                        _, role = msg.split(maxsplit=1)
+                        print(f"[GAME STARTED] Role: {role}")
+
+                    elif msg.startswith("GAME_UPDATE"):
+                        received_at = timer = metrics.start()
+                        _, sen = msg.split(maxsplit=1)
+                        if ponderer is not None:
+                            ponderer.stop(sen)
+                            timer = metrics.observe("ponder_stop", timer)
+                        board = parse_sen(sen)
+                        timer = metrics.observe("parse_sen", timer)
+                        if board.is_p1_turn == (role == "P1"):
+                            if move_sent_at:
+                                metrics.record("wait", (received_at - move_sent_at) / 1e9)
+                            move = choose_move(board, role, time_budget, node_budget, searcher, book, tablebase,
+                                               context)
+                            timer = metrics.observe("think", timer)
+                            send_move(sock, *move)
+                            move_sent_at = metrics.observe("send", timer)
+                            metrics.count("moves")
+                            if ponderer is not None:
+                                ponderer.start(apply_move(board, move))
+
+                    elif msg.startswith("INVALID_MOVE"):
+                        print("[WARNING] Invalid move:", msg)
+                        metrics.count("invalid_moves")
+                        if ponderer is not None:
+                            ponderer.stop()
+
+                    elif msg.startswith("GAME_OVER"):
+                        print("[GAME OVER]", msg)
+                        return
+        finally:
+            if ponderer is not None:
+                ponderer.stop()
 
 
 def send_move(sock, from_idx, to_idx, card):
@@ -75,4 +187,19 @@ def send_move(sock, from_idx, to_idx, card):
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Onitama bot client")
+    parser.add_argument("--move-time", type=float, default=None, help="Seconds to think per move")
+    parser.add_argument("--move-nodes", type=int, default=None,
+                        help="Node budget per move (with --move-time), or playouts per move for MCTS")
+    parser.add_argument("--workers", type=int, default=1, help="Search processes (Lazy SMP when more than 1)")
+    parser.add_argument("--engine", choices=("alphabeta", "mcts"), default="alphabeta")
+    parser.add_argument("--mcts-mode", choices=("root", "leaf"), default="root",
+                        help="With --workers: independent trees per process (root), or one tree with virtual loss "
+                             "and parallel playouts (leaf)")
+    parser.add_argument("--book", default=None, help="Opening book file from opening_book.py")
+    parser.add_argument("--tablebase", default=None, help="Directory of endgame tables from tablebase.py")
+    parser.add_argument("--no-ponder", action="store_true", help="Don't search on the opponent's time")
+    parser.add_argument("--metrics-file", default=None, help="Write per-stage move timings here when the game ends")
+    args = parser.parse_args()
+    main(args.move_time, args.move_nodes, args.workers, args.book, args.tablebase, not args.no_ponder, args.engine,
+         args.metrics_file, args.mcts_mode)
@@ -1,8 +1,239 @@
+import dataclasses
+import json
 import math
+import os
 import random
+import time
 
-from Onitama.game_tools import BoardState, get_valid_targets_by_card, mailbox_to_coord, is_victory, \
-    apply_move, PLAYABLE_INDICES
+from Onitama.bitboard import CARD_INDEX, CARD_NAMES, CARD_TARGET_MASKS
+from Onitama.game_tools import BoardState, get_valid_targets_by_card, mailbox_to_coord, is_victory, get_winner, \
+    apply_move, make_move, unmake_move, copy_board_state, parse_sen, to_sen, PLAYABLE_INDICES, LOGICAL_TO_MAILBOX, \
+    P1_TEMPLE_BIT, P2_TEMPLE_BIT, IDENTITY, MIRROR, ROTATE_MIRROR, canonical_key, compute_symmetry_keys, \
+    transform_board_state, transform_move, CARD_DESTINATIONS, SIDE_PIECES
+
+
+# Transposition table bound types
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+# Move ordering
+MAX_PLY = 64
+KILLER_SLOTS = 2
+PIECE_VALUES = {"s": 100, "S": 100, "m": 500, "M": 500}
+PV_MOVE_SCORE = 3_000_000
+CAPTURE_SCORE = 2_000_000
+KILLER_SCORE = 1_000_000
+
+# Aspiration windows are only used once the previous iteration's score is meaningful
+ASPIRATION_MIN_DEPTH = 3
+ASPIRATION_WINDOW = 50
+ASPIRATION_MAX_WINDOW = 800
+
+# Pondering searches replies other than the predicted one this many plies shallower
+PONDER_REDUCTION = 2
+
+# Quiescence search: how many captures/temple moves to follow past the horizon, and the delta pruning margin
+QUIESCENCE_MAX_DEPTH = 4
+DELTA_MARGIN = 200
+# Positions with a student on the enemy temple, where the master can't move onto it, for check_tactical_moves
+TACTICAL_CHECK_POSITIONS = ["2s2/2m2/5/5/M4/BOCBCOCRDR0", "4m/5/5/2M2/2S2/BOCBCOCRDR1"]
+
+# How many nodes to search between clock checks
+LIMIT_CHECK_INTERVAL = 256
+# A win scores WIN_SCORE plus the depth left in the main search, or minus the plies taken in quiescence, so every
+# decided score is at least WIN_BOUND
+WIN_SCORE = 100000
+WIN_BOUND = WIN_SCORE - MAX_PLY
+
+# Evaluation weights: material, master temple step, student row, move (up to MOBILITY_CAP moves) and threats.
+# tuning.py fits them from game records and writes a weight file, which is loaded from ONITAMA_WEIGHTS, or
+# eval_weights.json next to this module, when present
+EVAL_WEIGHT_NAMES = ("student", "master", "temple_step", "student_row", "mobility", "student_threat", "master_threat")
+DEFAULT_EVAL_WEIGHTS = {"student": 100, "master": 500, "temple_step": 25, "student_row": 5, "mobility": 6,
+                        "student_threat": 30, "master_threat": 80}
+EVAL_WEIGHTS_PATH = os.environ.get("ONITAMA_WEIGHTS", os.path.join(os.path.dirname(__file__), "eval_weights.json"))
+MOBILITY_CAP = 5
+
+
+def load_eval_weights(path: str = EVAL_WEIGHTS_PATH) -> dict[str, int]:
+    # Missing file or missing names fall back to the defaults
+    weights = dict(DEFAULT_EVAL_WEIGHTS)
+    if os.path.exists(path):
+        with open(path) as weights_file:
+            loaded = json.load(weights_file)
+        unknown = set(loaded) - set(EVAL_WEIGHT_NAMES)
+        if unknown:
+            raise ValueError(f"Unknown evaluation weights in {path}: {', '.join(sorted(unknown))}")
+        weights.update({name: int(value) for name, value in loaded.items()})
+    return weights
+
+
+EVAL_WEIGHTS = load_eval_weights()
+STUDENT_VALUE, MASTER_VALUE, TEMPLE_STEP_VALUE, STUDENT_ROW_VALUE, MOBILITY_VALUE, STUDENT_THREAT_VALUE, \
+    MASTER_THREAT_VALUE = (EVAL_WEIGHTS[name] for name in EVAL_WEIGHT_NAMES)
+
+
+# Tables for evaluate_incremental, indexed by side (0 = P1, 1 = P2) and logical square
+CARD_TARGETS = {card: CARD_TARGET_MASKS[CARD_INDEX[card]] for card in CARD_NAMES}
+# Row scores for the master and student bonuses: the row index for P1, mirrored for P2
+TEMPLE_STEPS = (
+    tuple(square // 5 for square in range(25)),
+    tuple(4 - square // 5 for square in range(25)),
+)
+STUDENT_ROWS = TEMPLE_STEPS
+MASTER_SQUARE_BONUS = tuple(tuple(steps * TEMPLE_STEP_VALUE for steps in per_side) for per_side in TEMPLE_STEPS)
+ROW_MASKS = tuple(0b11111 << (row * 5) for row in range(5))
+STUDENT_ROW_BONUS = (
+    tuple((ROW_MASKS[row], row * STUDENT_ROW_VALUE) for row in range(1, 5)),
+    tuple((ROW_MASKS[row], (4 - row) * STUDENT_ROW_VALUE) for row in range(4)),
+)
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+@dataclasses.dataclass(slots=True)
+class TranspositionEntry:
+    key: int
+    depth: int
+    score: float
+    bound: int
+    best_move: tuple[int, int, str] | None
+    generation: int
+
+
+class TranspositionTable:
+    def __init__(self, size_bits: int = 18):
+        self.size = 1 << size_bits
+        self.index_mask = self.size - 1
+        self.entries: list[TranspositionEntry | None] = [None] * self.size
+        self.generation = 0
+
+        # Counters for sizing the table
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+        self.replacements = 0
+
+    def probe(self, key: int) -> TranspositionEntry | None:
+        entry = self.entries[key & self.index_mask]
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.key != key:
+            # Slot is held by a different position
+            self.collisions += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def store(self, key: int, depth: int, score: float, bound: int, best_move: tuple[int, int, str] | None):
+        index = key & self.index_mask
+        entry = self.entries[index]
+        if entry is not None:
+            # Depth-preferred replacement, but entries from older searches are always replaceable
+            if entry.key == key:
+                if depth < entry.depth and entry.generation == self.generation:
+                    return
+                if best_move is None:
+                    best_move = entry.best_move
+            elif depth < entry.depth and entry.generation == self.generation:
+                return
+            else:
+                self.replacements += 1
+        self.stores += 1
+        self.entries[index] = TranspositionEntry(key, depth, score, bound, best_move, self.generation)
+
+    def new_search(self):
+        self.generation += 1
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.generation = 0
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.hits = self.misses = self.collisions = self.stores = self.replacements = 0
+
+    def stats(self) -> dict[str, float]:
+        probes = self.hits + self.misses
+        used = sum(1 for entry in self.entries if entry is not None)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "collisions": self.collisions,
+            "stores": self.stores,
+            "replacements": self.replacements,
+            "hit_rate": self.hits / probes if probes else 0.0,
+            "fill_rate": used / self.size,
+        }
+
+
+@dataclasses.dataclass
+class SearchContext:
+    # Values in the table are from the point of view of the player to move, so it can be shared by both sides
+    transposition_table: TranspositionTable = dataclasses.field(default_factory=TranspositionTable)
+
+    # Move ordering state (set order_moves to False to search in generation order for comparison)
+    order_moves: bool = True
+    # Key the transposition table by canonical position, so mirrored and colour-swapped positions share entries.
+    # Off by default: symmetric transpositions are rare within one search, and tracking the keys costs speed
+    canonical_keys: bool = False
+    killers: list[list[tuple[int, int, str] | None]] = dataclasses.field(
+        default_factory=lambda: [[None] * KILLER_SLOTS for _ in range(MAX_PLY)])
+    history: dict[tuple[int, int, str], int] = dataclasses.field(default_factory=dict)
+
+    # Search statistics
+    nodes: int = 0
+    quiescence_nodes: int = 0
+    nodes_by_depth: dict[int, int] = dataclasses.field(default_factory=dict)
+    time_by_depth: dict[int, float] = dataclasses.field(default_factory=dict)
+    completed_depth: int = 0
+    best_score: float | None = None
+
+    # Compare every incremental leaf evaluation against evaluate_heuristic (slow, for debugging)
+    check_evaluation: bool = False
+    # Resolve captures and temple moves past the horizon instead of evaluating mid-exchange
+    use_quiescence: bool = True
+    # Endgame tablebase.Tablebase giving exact scores for positions with few students
+    tablebase: object = None
+
+    # Search limits (deadline is a time.perf_counter() value)
+    deadline: float | None = None
+    node_limit: int | None = None
+    stopped: bool = False
+    # Any object with is_set() (threading or multiprocessing Event) that another searcher uses to stop this one
+    stop_event: object = None
+
+    def new_search(self):
+        self.transposition_table.new_search()
+        self.nodes = 0
+        self.quiescence_nodes = 0
+        self.nodes_by_depth = {}
+        self.time_by_depth = {}
+        self.completed_depth = 0
+        self.best_score = None
+        self.stopped = False
+        for slots in self.killers:
+            slots[:] = [None] * KILLER_SLOTS
+        # Age the history so older searches still guide, but don't dominate, this one
+        for move in self.history:
+            self.history[move] //= 2
+
+    def check_limits(self):
+        # Abort the in-flight iteration once the clock or node budget runs out
+        nodes = self.nodes + self.quiescence_nodes
+        if nodes % LIMIT_CHECK_INTERVAL:
+            return
+        if (self.stopped or (self.stop_event is not None and self.stop_event.is_set())
+                or (self.deadline is not None and time.perf_counter() >= self.deadline)
+                or (self.node_limit is not None and nodes >= self.node_limit)):
+            self.stopped = True
+            raise SearchTimeout()
 
 
 def get_valid_moves_for_piece(board_state: BoardState, start_idx) -> list[tuple[int, int, str]]:
@@ -21,9 +252,19 @@ def get_valid_moves_for_piece(board_state: BoardState, start_idx) -> list[tuple[
 
 
 def get_all_valid_moves(board_state: BoardState) -> list[tuple[int, int, str]]:
+    # Same moves, in the same order, as get_valid_moves_for_piece over every square, with the per-piece calls inlined
+    side = 0 if board_state.is_p1_turn else 1
+    allies = SIDE_PIECES[side]
+    mailbox = board_state.mailbox_board
+    hand = board_state.p1_cards if side == 0 else board_state.p2_cards
+    destinations_by_card = [(card, CARD_DESTINATIONS[card][side]) for card in hand]
     valid_moves = []
     for i in PLAYABLE_INDICES:
-        valid_moves += get_valid_moves_for_piece(board_state, i)
+        if mailbox[i] in allies:
+            for card, destinations in destinations_by_card:
+                for to_idx in destinations[i]:
+                    if mailbox[to_idx] not in allies:
+                        valid_moves.append((i, to_idx, card))
     return valid_moves
 
 
@@ -37,26 +278,26 @@ def evaluate_heuristic(state: BoardState, precomputed_moves: list[tuple[int, int
         is_mine = space.islower() == state.is_p1_turn
 
         # Count material
-        space_value = 100 if space in "sS" else 500
+        space_value = STUDENT_VALUE if space in "sS" else MASTER_VALUE
         evaluation += space_value if is_mine else -space_value
 
         # Reward master proximity to the goal
         if space.lower() == "m" and is_mine:
             row, col = mailbox_to_coord(i)
             temple_dist = abs(row - (0 if not state.is_p1_turn else 4))
-            evaluation += (4 - temple_dist) * 25
+            evaluation += (4 - temple_dist) * TEMPLE_STEP_VALUE
 
         # Reward student advancement
         if space in "sS" and is_mine:
             row, _ = mailbox_to_coord(i)
             forwardness = row if state.is_p1_turn else (4 - row)
-            evaluation += forwardness * 5
+            evaluation += forwardness * STUDENT_ROW_VALUE
 
     # Reward mobility
     if precomputed_moves is None:
         precomputed_moves = get_all_valid_moves(state)
     num_moves = len(precomputed_moves)
-    evaluation += min(5, num_moves) * 6
+    evaluation += min(MOBILITY_CAP, num_moves) * MOBILITY_VALUE
 
     # Reward threats on opponent pieces
     for move in precomputed_moves:
@@ -64,79 +305,485 @@ def evaluate_heuristic(state: BoardState, precomputed_moves: list[tuple[int, int
         target_piece = state.mailbox_board[to_idx]
         if target_piece and target_piece != ".":
             if target_piece.islower() != state.is_p1_turn:
-                evaluation += 30 if target_piece in "sS" else 80
+                evaluation += STUDENT_THREAT_VALUE if target_piece in "sS" else MASTER_THREAT_VALUE
 
     return evaluation
 
 
-def evaluate_terminal(state: BoardState, depth: int, precomputed_moves=None) -> float:
-    win, message = is_victory(state)
-    if not win:
-        return evaluate_heuristic(state, precomputed_moves)
-    score = 100000 + depth
-    # If the player whose turn it was just lost, this is bad for them
-    if ("Player 1 wins" in message and state.is_p1_turn) or ("Player 2 wins" in message and not state.is_p1_turn):
-        return score
+def evaluate_incremental(state: BoardState) -> float:
+    # Same result as evaluate_heuristic, computed from the piece masks that make_move keeps up to date
+    if state.is_p1_turn:
+        side = 0
+        own_students, own_master, enemy_students, enemy_master = state.piece_masks
+        hand = state.p1_cards
     else:
-        return -score
+        side = 1
+        enemy_students, enemy_master, own_students, own_master = state.piece_masks
+        hand = state.p2_cards
 
+    # Material, master proximity to the goal and student advancement
+    evaluation = ((own_students.bit_count() - enemy_students.bit_count()) * STUDENT_VALUE
+                  + (own_master.bit_count() - enemy_master.bit_count()) * MASTER_VALUE)
+    if own_master:
+        evaluation += MASTER_SQUARE_BONUS[side][own_master.bit_length() - 1]
+    for row_mask, bonus in STUDENT_ROW_BONUS[side]:
+        evaluation += (own_students & row_mask).bit_count() * bonus
 
-def is_test_end(state: BoardState, depth: int) -> bool:
-    return is_victory(state)[0] or depth == 0
+    # Mobility and threats from each piece's attack masks
+    own = own_students | own_master
+    first_card = CARD_TARGETS[hand[0]][side]
+    second_card = CARD_TARGETS[hand[1]][side]
+    num_moves = 0
+    threats = 0
+    pieces = own
+    while pieces:
+        piece_bit = pieces & -pieces
+        pieces ^= piece_bit
+        square = piece_bit.bit_length() - 1
+        for targets in (first_card[square] & ~own, second_card[square] & ~own):
+            num_moves += targets.bit_count()
+            threats += ((targets & enemy_students).bit_count() * STUDENT_THREAT_VALUE
+                        + (targets & enemy_master).bit_count() * MASTER_THREAT_VALUE)
 
+    return evaluation + min(MOBILITY_CAP, num_moves) * MOBILITY_VALUE + threats
 
-def max_value(state: BoardState, alpha: float, beta: float, depth: int) -> float:
-    # Get and order legal moves for optimal a-b pruning
-    legal_moves = get_all_valid_moves(state)
-    # legal_moves.sort(key=lambda move: -evaluate_heuristic(apply_move(state, move)), reverse=True)
-    if is_test_end(state, depth):
-        return evaluate_terminal(state, depth, legal_moves)
-    v = -math.inf
-    for move in legal_moves:
-        v = max(v, min_value(apply_move(state, move), alpha, beta, depth - 1))
-        alpha = max(alpha, v)
-        if v >= beta:
-            break
-    return v
+
+def check_evaluation_consistency(games: int = 100, seed: int = 0) -> int:
+    # Play random games and compare evaluate_incremental with evaluate_heuristic at every position
+    rng = random.Random(seed)
+    positions = 0
+    for _ in range(games):
+        state = BoardState()
+        while not is_victory(state)[0]:
+            expected = evaluate_heuristic(state)
+            actual = evaluate_incremental(state)
+            assert actual == expected, f"Incremental evaluation {actual} != {expected} for {to_sen(state)}"
+            positions += 1
+            legal_moves = get_all_valid_moves(state)
+            if not legal_moves or positions % 200 == 0:
+                break
+            state = apply_move(state, rng.choice(legal_moves))
+    return positions
+
+
+def check_canonicalization(games: int = 50, seed: int = 0) -> int:
+    # Play random games and check, at every position, that each symmetric image has the mapped move set, the same
+    # evaluation and the same canonical key, and that the incrementally updated symmetry keys are right
+    rng = random.Random(seed)
+    positions = 0
+    for _ in range(games):
+        state = BoardState()
+        canonical_key(state)
+        while not is_victory(state)[0]:
+            assert state.symmetry_keys == compute_symmetry_keys(state), f"Stale symmetry keys for {to_sen(state)}"
+            legal_moves = get_all_valid_moves(state)
+            for symmetry in range(MIRROR, ROTATE_MIRROR + 1):
+                image = transform_board_state(state, symmetry)
+                assert sorted(transform_move(move, symmetry) for move in legal_moves) == \
+                       sorted(get_all_valid_moves(image)), f"Moves differ under symmetry {symmetry}: {to_sen(state)}"
+                assert evaluate_heuristic(image) == evaluate_heuristic(state), \
+                    f"Evaluation differs under symmetry {symmetry}: {to_sen(state)}"
+                assert canonical_key(image)[0] == canonical_key(state)[0], \
+                    f"Canonical key differs under symmetry {symmetry}: {to_sen(state)}"
+            positions += 1
+            if not legal_moves or positions % 200 == 0:
+                break
+            state = apply_move(state, rng.choice(legal_moves))
+    return positions
+
+
+def check_tactical_moves(games: int = 50, seed: int = 0) -> int:
+    # Play random games, and try positions with a student on the enemy temple, checking at every position that
+    # get_tactical_moves only returns legal moves
+    rng = random.Random(seed)
+    states = [parse_sen(sen) for sen in TACTICAL_CHECK_POSITIONS]
+    for _ in range(games):
+        state = BoardState()
+        while not is_victory(state)[0]:
+            states.append(state)
+            legal_moves = get_all_valid_moves(state)
+            if not legal_moves or len(states) % 200 == 0:
+                break
+            state = apply_move(state, rng.choice(legal_moves))
+    for state in states:
+        legal_moves = set(get_all_valid_moves(state))
+        illegal = [move for move in get_tactical_moves(state) if move not in legal_moves]
+        assert not illegal, f"Illegal tactical moves {illegal} for {to_sen(state)}"
+    return len(states)
+
+
+def transposition_key(state: BoardState, context: SearchContext) -> tuple[int, int]:
+    # (key, symmetry) to look the state up with; stored moves are kept in the canonical position's frame
+    if context.canonical_keys:
+        return canonical_key(state)
+    return state.zobrist_key, IDENTITY
+
+
+def probe_transposition_table(state: BoardState, alpha: float, beta: float, depth: int,
+                              context: SearchContext) -> tuple[float | None, tuple[int, int, str] | None]:
+    # Returns a score if the stored entry settles this node, plus any remembered best move
+    key, symmetry = transposition_key(state, context)
+    entry = context.transposition_table.probe(key)
+    if entry is None:
+        return None, None
+    best_move = entry.best_move
+    if best_move is not None and symmetry != IDENTITY:
+        best_move = transform_move(best_move, symmetry)
+    if entry.depth >= depth:
+        if entry.bound == EXACT:
+            return entry.score, best_move
+        if entry.bound == LOWER_BOUND and entry.score >= beta:
+            return entry.score, best_move
+        if entry.bound == UPPER_BOUND and entry.score <= alpha:
+            return entry.score, best_move
+    return None, best_move
 
 
-def min_value(state: BoardState, alpha: float, beta: float, depth: int) -> float:
+def store_transposition_table(state: BoardState, alpha: float, beta: float, depth: int, score: float,
+                              best_move: tuple[int, int, str] | None, context: SearchContext):
+    if score <= alpha:
+        bound = UPPER_BOUND
+    elif score >= beta:
+        bound = LOWER_BOUND
+    else:
+        bound = EXACT
+    key, symmetry = transposition_key(state, context)
+    if best_move is not None and symmetry != IDENTITY:
+        best_move = transform_move(best_move, symmetry)
+    context.transposition_table.store(key, depth, score, bound, best_move)
+
+
+def order_moves(state: BoardState, legal_moves: list[tuple[int, int, str]], ply: int,
+                pv_move: tuple[int, int, str] | None, context: SearchContext):
+    # PV/TT move, then captures by MVV-LVA (master captures first), then killers, then history
+    if not context.order_moves:
+        return
+    board = state.mailbox_board
+    killers = context.killers[ply] if ply < MAX_PLY else ()
+    history = context.history
+
+    def move_score(move: tuple[int, int, str]) -> int:
+        if move == pv_move:
+            return PV_MOVE_SCORE
+        target = board[move[1]]
+        if target != ".":
+            return CAPTURE_SCORE + PIECE_VALUES[target] * 10 - PIECE_VALUES[board[move[0]]] // 100
+        if move in killers:
+            return KILLER_SCORE - killers.index(move)
+        return history.get(move, 0)
+
+    legal_moves.sort(key=move_score, reverse=True)
+
+
+def record_cutoff(state: BoardState, move: tuple[int, int, str], ply: int, depth: int, context: SearchContext):
+    # Only quiet moves are remembered, captures are already ordered first
+    if state.mailbox_board[move[1]] != ".":
+        return
+    if ply < MAX_PLY:
+        killers = context.killers[ply]
+        if killers[0] != move:
+            killers[1:] = killers[:-1]
+            killers[0] = move
+    context.history[move] = context.history.get(move, 0) + depth * depth
+
+
+def evaluate_leaf(state: BoardState, context: SearchContext) -> float:
+    evaluation = evaluate_incremental(state)
+    if context.check_evaluation:
+        expected = evaluate_heuristic(state)
+        assert evaluation == expected, f"Incremental evaluation {evaluation} != {expected} for {to_sen(state)}"
+    return evaluation
+
+
+def get_tactical_moves(state: BoardState) -> list[tuple[int, int, str]]:
+    # Captures, plus master moves onto the opponent's temple
+    if state.is_p1_turn:
+        side = 0
+        own_students, own_master, enemy_students, enemy_master = state.piece_masks
+        hand = state.p1_cards
+        temple_bit = P2_TEMPLE_BIT
+    else:
+        side = 1
+        enemy_students, enemy_master, own_students, own_master = state.piece_masks
+        hand = state.p2_cards
+        temple_bit = P1_TEMPLE_BIT
+    enemy = enemy_students | enemy_master
+    own = own_students | own_master
+    # One of our students may be standing on the temple
+    master_goals = (enemy | temple_bit) & ~own
+
+    moves = []
+    pieces = own
+    while pieces:
+        piece_bit = pieces & -pieces
+        pieces ^= piece_bit
+        square = piece_bit.bit_length() - 1
+        goals = master_goals if piece_bit == own_master else enemy
+        for card in hand:
+            targets = CARD_TARGETS[card][side][square] & goals
+            while targets:
+                target_bit = targets & -targets
+                targets ^= target_bit
+                moves.append((LOGICAL_TO_MAILBOX[square], LOGICAL_TO_MAILBOX[target_bit.bit_length() - 1], card))
+    return moves
+
+
+def quiescence(state: BoardState, alpha: float, beta: float, context: SearchContext, ply: int,
+               quiescence_depth: int = 0) -> float:
+    # Follow only captures and temple moves from the horizon, letting the player to move stand pat
+    context.quiescence_nodes += 1
+    context.check_limits()
+
+    winner = get_winner(state)
+    if winner is not None:
+        score = WIN_SCORE - quiescence_depth
+        return score if (winner == "P1") == state.is_p1_turn else -score
+    if context.tablebase is not None and quiescence_depth == 0:
+        tablebase_score = context.tablebase.probe(state)
+        if tablebase_score is not None:
+            return tablebase_score
+
+    stand_pat = evaluate_leaf(state, context)
+    if stand_pat >= beta or quiescence_depth >= QUIESCENCE_MAX_DEPTH:
+        return stand_pat
+    if stand_pat > alpha:
+        alpha = stand_pat
+
+    tactical_moves = get_tactical_moves(state)
+    order_moves(state, tactical_moves, ply, None, context)
+    board = state.mailbox_board
+    best_score = stand_pat
+    for move in tactical_moves:
+        # Delta pruning: skip student captures that can't lift the score back up to alpha
+        if board[move[1]] in "sS" and stand_pat + STUDENT_VALUE + DELTA_MARGIN <= alpha:
+            continue
+        undo = make_move(state, move)
+        score = -quiescence(state, -beta, -alpha, context, ply + 1, quiescence_depth + 1)
+        unmake_move(state, move, undo)
+        if score > best_score:
+            best_score = score
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+    return best_score
+
+
+def negamax(state: BoardState, alpha: float, beta: float, depth: int, context: SearchContext = None,
+            ply: int = 0) -> float:
+    # Principal variation search; scores are from the point of view of the player to move.
+    # Moves are made and unmade on state in place, so it is only left unchanged if the search isn't aborted
+    if context is None:
+        context = SearchContext()
+    if depth <= 0 and context.use_quiescence:
+        return quiescence(state, alpha, beta, context, ply)
+    context.nodes += 1
+    context.check_limits()
+
+    # Wins are scored by remaining depth, so faster wins score higher
+    winner = get_winner(state)
+    if winner is not None:
+        return WIN_SCORE + depth if (winner == "P1") == state.is_p1_turn else -(WIN_SCORE + depth)
+    if context.tablebase is not None and ply > 0:
+        tablebase_score = context.tablebase.probe(state)
+        if tablebase_score is not None:
+            return tablebase_score
+    if depth == 0:
+        return evaluate_leaf(state, context)
+
     # Get and order legal moves for optimal a-b pruning
     legal_moves = get_all_valid_moves(state)
-    # legal_moves.sort(key=lambda move: -evaluate_heuristic(apply_move(state, move)), reverse=True)
-
-    if is_test_end(state, depth):
-        return evaluate_terminal(state, depth, legal_moves)
-    v = math.inf
-    for move in legal_moves:
-        v = min(v, max_value(apply_move(state, move), alpha, beta, depth - 1))
-        beta = min(beta, v)
-        if v <= alpha:
-            break
-    return v
+    if not legal_moves:
+        return evaluate_leaf(state, context)
+
+    tt_score, tt_move = probe_transposition_table(state, alpha, beta, depth, context)
+    if tt_score is not None:
+        return tt_score
+    order_moves(state, legal_moves, ply, tt_move, context)
+
+    original_alpha = alpha
+    best_score = -math.inf
+    best_move = None
+    for i, move in enumerate(legal_moves):
+        undo = make_move(state, move)
+        if i == 0:
+            score = -negamax(state, -beta, -alpha, depth - 1, context, ply + 1)
+        else:
+            # Prove the move is no better than alpha with a null window, re-search if it is
+            score = -negamax(state, -alpha - 1, -alpha, depth - 1, context, ply + 1)
+            if alpha < score < beta:
+                score = -negamax(state, -beta, -alpha, depth - 1, context, ply + 1)
+        unmake_move(state, move, undo)
+        if score > best_score:
+            best_score = score
+            best_move = move
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    record_cutoff(state, move, ply, depth, context)
+                    break
+    store_transposition_table(state, original_alpha, beta, depth, best_score, best_move, context)
+    return best_score
+
 
+def search_root(state: BoardState, root_moves: list[tuple[int, int, str]], alpha: float, beta: float, depth: int,
+                context: SearchContext) -> tuple[float, tuple[int, int, str]]:
+    # Same as negamax, but root moves share one alpha and the best move is returned with its score
+    original_alpha = alpha
+    best_score = -math.inf
+    best_move = root_moves[0]
+    for i, move in enumerate(root_moves):
+        undo = make_move(state, move)
+        if i == 0:
+            score = -negamax(state, -beta, -alpha, depth - 1, context, 1)
+        else:
+            score = -negamax(state, -alpha - 1, -alpha, depth - 1, context, 1)
+            if alpha < score < beta:
+                score = -negamax(state, -beta, -alpha, depth - 1, context, 1)
+        unmake_move(state, move, undo)
+        # print("Move:", move, "Score:", score)
+        if score > best_score:
+            best_score = score
+            best_move = move
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+    store_transposition_table(state, original_alpha, beta, depth, best_score, best_move, context)
+    return best_score, best_move
 
-def depth_limited_alpha_beta_id_minimax(state: BoardState) -> tuple[int, int, str]:
+
+def aspiration_search(state: BoardState, root_moves: list[tuple[int, int, str]], depth: int, previous_score: float,
+                      context: SearchContext) -> tuple[float, tuple[int, int, str]]:
+    # Search a narrow window around the previous iteration's score, widening it on a fail low/high
+    if depth < ASPIRATION_MIN_DEPTH or previous_score is None or abs(previous_score) >= WIN_BOUND:
+        return search_root(state, root_moves, -math.inf, math.inf, depth, context)
+
+    delta = ASPIRATION_WINDOW
+    alpha = previous_score - delta
+    beta = previous_score + delta
+    while True:
+        score, move = search_root(state, root_moves, alpha, beta, depth, context)
+        if score <= alpha:
+            alpha = previous_score - delta * 2 if delta < ASPIRATION_MAX_WINDOW else -math.inf
+        elif score >= beta:
+            beta = previous_score + delta * 2 if delta < ASPIRATION_MAX_WINDOW else math.inf
+        else:
+            return score, move
+        delta *= 2
+
+
+def depth_limited_alpha_beta_id_minimax(state: BoardState, context: SearchContext = None,
+                                        target_depth: int = 4) -> tuple[int, int, str]:
+    if context is None:
+        context = SearchContext()
+    context.new_search()
+    # Search a private copy, since moves are made in place and an aborted search leaves it mid-line
+    state = copy_board_state(state)
     depth = 1
-    target_depth = 4
     best_move = None
+    best_score = None
+    root_moves = get_all_valid_moves(state)
+    start_time = time.perf_counter()
     # print("Starting minimax...")
     # Iterative deepening
     while depth <= target_depth:
         # print("Search depth:", depth)
-        best_score = -math.inf
-        best_moves = []
-        # Find the move with the best score
-        for move in get_all_valid_moves(state):
-            score = min_value(apply_move(state, move), -math.inf, math.inf, depth - 1)
-            # print("Move:", move, "Score:", score)
-            if score > best_score:
-                best_score = score
-                best_moves = [move]
-                # print("New best move at depth", depth, "is", move, "with score", score)
-            elif score == best_score:
-                best_moves.append(move)
-        # print("Best moves at depth", depth, "are", best_moves)
-        best_move = random.choice(best_moves)
+        nodes_before = context.nodes
+        # Search the previous iteration's best move first
+        order_moves(state, root_moves, 0, best_move, context)
+        try:
+            score, move = aspiration_search(state, root_moves, depth, best_score, context)
+        except SearchTimeout:
+            # Keep the last completed depth's move
+            if best_move is None:
+                best_move = root_moves[0]
+            break
+        # print("Best move at depth", depth, "is", move, "with score", score)
+        best_move, best_score = move, score
+        context.nodes_by_depth[depth] = context.nodes - nodes_before
+        context.time_by_depth[depth] = time.perf_counter() - start_time
+        context.completed_depth = depth
+        context.best_score = best_score
+        # A forced result won't change with more depth
+        if abs(best_score) >= WIN_BOUND:
+            break
         depth += 1
     return best_move
+
+
+def timed_alpha_beta_id_minimax(state: BoardState, time_budget: float, node_budget: int = None,
+                                context: SearchContext = None, max_depth: int = MAX_PLY - 1) -> tuple[int, int, str]:
+    """
+    Deepen until time_budget seconds (or node_budget nodes) have been used, returning the best move
+    from the last completed depth
+    """
+    if context is None:
+        context = SearchContext()
+    context.deadline = time.perf_counter() + time_budget
+    context.node_limit = node_budget
+    try:
+        return depth_limited_alpha_beta_id_minimax(state, context, max_depth)
+    finally:
+        context.deadline = None
+        context.node_limit = None
+
+
+def predict_reply(state: BoardState, context: SearchContext) -> tuple[int, int, str] | None:
+    # The transposition table's best move for state, if it is legal there
+    _, move = probe_transposition_table(state, -math.inf, math.inf, MAX_PLY, context)
+    return move if move is not None and move in get_all_valid_moves(state) else None
+
+
+def ponder(state: BoardState, context: SearchContext, max_depth: int = MAX_PLY - 1):
+    """
+    Search on the opponent's time, until context.stop_event is set. state is the position after our move, with the
+    opponent to move. Each pass deepens the position after the predicted reply by one ply and every other reply to
+    PONDER_REDUCTION plies less, so whichever reply is played, the next search starts from a table holding its
+    subtree. context.completed_depth is the depth of the last full pass
+    """
+    context.new_search()
+    predicted = predict_reply(state, context)
+    children = []
+    for reply in get_all_valid_moves(state):
+        child = apply_move(state, reply)
+        child_moves = get_all_valid_moves(child)
+        if child_moves and not is_victory(child)[0]:
+            children.append((reply, child, child_moves))
+    children.sort(key=lambda entry: entry[0] != predicted)
+
+    scores = {}
+    for depth in range(1, max_depth + 1):
+        for reply, child, child_moves in children:
+            child_depth = depth if predicted is None or reply == predicted else depth - PONDER_REDUCTION
+            if child_depth < 1:
+                continue
+            order_moves(child, child_moves, 0, predict_reply(child, context), context)
+            try:
+                scores[reply], _ = aspiration_search(child, child_moves, child_depth, scores.get(reply), context)
+            except SearchTimeout:
+                return
+        context.completed_depth = depth
+
+
+def compare_move_ordering(sen_positions: list[str], target_depth: int = 4):
+    # Print nodes searched per depth with and without move ordering
+    for sen in sen_positions:
+        state = parse_sen(sen)
+        print(sen)
+        for ordered in (False, True):
+            context = SearchContext(order_moves=ordered)
+            depth_limited_alpha_beta_id_minimax(state, context, target_depth)
+            per_depth = " ".join(f"d{depth}={nodes}" for depth, nodes in context.nodes_by_depth.items())
+            print(f"  {'ordered' if ordered else 'unordered':>9}: {per_depth} total={context.nodes}")
+
+
+if __name__ == '__main__':
+    print("Incremental evaluation matches on", check_evaluation_consistency(), "positions")
+    print("Symmetric positions agree on", check_canonicalization(), "positions")
+    print("Tactical moves are legal on", check_tactical_moves(), "positions")
+    compare_move_ordering([
+        "SSMSS/5/5/5/ssmss/OXCOCBMOBO1",
+        "S1MSS/2S2/5/1s3/s1mss/TIDRRAEECR0",
+        "1SM1S/S4/2s2/1m3/s2s1/FRGOHOELRO1",
+    ])
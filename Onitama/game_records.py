@@ -0,0 +1,223 @@
+import argparse
+import dataclasses
+import mmap
+import os
+import struct
+
+from Onitama import bitboard
+from Onitama.game_tools import BoardState, LOGICAL_TO_MAILBOX, apply_move, parse_sen
+
+# One position per record, 32 bytes little-endian:
+#   4 x uint32  piece masks over the 25 logical squares (P1 students, P1 master, P2 students, P2 master)
+#   5 x uint8   card ids (P1 hand, P2 hand, center), indices into bitboard.CARD_NAMES
+#   uint8       1 if P1 is to move
+#   3 x uint8   move played from this position (logical from, logical to, card id), NO_MOVE when none
+#   uint8       game result (RESULT_*)
+#   uint32      game id
+#   2 pad bytes
+RECORD = struct.Struct("<4I5BB3BBI2x")
+RECORD_SIZE = RECORD.size
+
+NO_MOVE = 255
+
+RESULT_P2_WIN = 0
+RESULT_DRAW = 1
+RESULT_P1_WIN = 2
+RESULT_UNKNOWN = 255
+
+P1_SCORE_RESULTS = {0.0: RESULT_P2_WIN, 0.5: RESULT_DRAW, 1.0: RESULT_P1_WIN}
+
+
+@dataclasses.dataclass(slots=True)
+class PositionRecord:
+    piece_masks: tuple[int, int, int, int]
+    cards: tuple[int, int, int, int, int]
+    is_p1_turn: bool
+    # Logical from, logical to and card id, or None for the final position of a game
+    move: tuple[int, int, int] | None
+    result: int
+    game_id: int
+
+    def to_bitboard(self) -> bitboard.BitBoardState:
+        p1_students, p1_master, p2_students, p2_master = self.piece_masks
+        return bitboard.BitBoardState((p1_students, p2_students), (p1_master, p2_master), self.is_p1_turn,
+                                      self.cards[0:2], self.cards[2:4], self.cards[4])
+
+    def to_board_state(self) -> BoardState:
+        return bitboard.to_board_state(self.to_bitboard())
+
+    def to_sen(self) -> str:
+        return bitboard.bitboard_to_sen(self.to_bitboard())
+
+    def mailbox_move(self) -> tuple[int, int, str] | None:
+        return None if self.move is None else bitboard.to_mailbox_move(self.move)
+
+
+def encode_position(board_state: BoardState, move: tuple[int, int, str] | None = None,
+                    result: int = RESULT_UNKNOWN, game_id: int = 0) -> bytes:
+    # The BoardState masks are already in logical square order
+    cards = [bitboard.CARD_INDEX[card] for card in (*board_state.p1_cards, *board_state.p2_cards,
+                                                     board_state.center_card)]
+    move_bytes = bitboard.from_mailbox_move(move) if move is not None else (NO_MOVE, NO_MOVE, NO_MOVE)
+    return RECORD.pack(*board_state.piece_masks, *cards, board_state.is_p1_turn, *move_bytes, result, game_id)
+
+
+def decode_position(fields: tuple) -> PositionRecord:
+    move = None if fields[10] == NO_MOVE else fields[10:13]
+    return PositionRecord(fields[0:4], fields[4:9], bool(fields[9]), move, fields[13], fields[14])
+
+
+def sen_to_record(sen: str, move: tuple[int, int, str] | None = None, result: int = RESULT_UNKNOWN,
+                  game_id: int = 0) -> bytes:
+    return encode_position(parse_sen(sen), move, result, game_id)
+
+
+def record_to_sen(data: bytes) -> str:
+    return decode_position(RECORD.unpack(data)).to_sen()
+
+
+class RecordWriter:
+    """
+    Append games to a record file. Each game is written as its positions in order, each with the move played
+    from it, followed by the final position with no move
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Continue numbering after any games already in the file
+        self.next_game_id = self._last_game_id() + 1 if os.path.exists(path) and os.path.getsize(path) else 0
+        self.file = open(path, "ab")
+
+    def _last_game_id(self) -> int:
+        with open(self.path, "rb") as existing:
+            existing.seek(-RECORD_SIZE, 2)
+            return decode_position(RECORD.unpack(existing.read(RECORD_SIZE))).game_id
+
+    def write_game(self, start_state: BoardState, moves: list[tuple[int, int, str]],
+                   p1_score: float | None = None, game_id: int = None) -> int:
+        # game_id defaults to the next free id; callers that number games themselves pass their own
+        if game_id is None:
+            game_id = self.next_game_id
+        self.next_game_id = max(self.next_game_id, game_id + 1)
+        result = P1_SCORE_RESULTS.get(p1_score, RESULT_UNKNOWN)
+        state = start_state
+        chunks = []
+        for move in moves:
+            chunks.append(encode_position(state, move, result, game_id))
+            state = apply_move(state, move)
+        chunks.append(encode_position(state, None, result, game_id))
+        self.file.write(b"".join(chunks))
+        self.file.flush()
+        return game_id
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordReader:
+    # Memory-mapped, so records are only read from disk as they are touched
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        size = self.file.seek(0, 2)
+        if size % RECORD_SIZE:
+            raise ValueError(f"{path} is not a record file ({size} bytes is not a multiple of {RECORD_SIZE})")
+        self.count = size // RECORD_SIZE
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> PositionRecord:
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return decode_position(RECORD.unpack_from(self.buffer, index * RECORD_SIZE))
+
+    def __iter__(self):
+        for fields in RECORD.iter_unpack(self.buffer):
+            yield decode_position(fields)
+
+    def games(self):
+        # Yield (game_id, [records]) for each game, in file order
+        game = []
+        for record in self:
+            if game and record.game_id != game[0].game_id:
+                yield game[0].game_id, game
+                game = []
+            game.append(record)
+        if game:
+            yield game[0].game_id, game
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def parse_logical_move(move: str) -> tuple[int, int, str]:
+    # "<logical_from> <logical_to> <card>", as sent by the bots
+    logical_from, logical_to, card = move.split()
+    return LOGICAL_TO_MAILBOX[int(logical_from)], LOGICAL_TO_MAILBOX[int(logical_to)], card
+
+
+def dump_records(path: str, start: int = 0, count: int = 20):
+    # Print records as SEN for debugging
+    with RecordReader(path) as reader:
+        for index in range(start, min(start + count, len(reader))):
+            record = reader[index]
+            move_text = "-" if record.move is None else \
+                f"{record.move[0]} {record.move[1]} {bitboard.CARD_NAMES[record.move[2]]}"
+            print(f"{index:>8} game {record.game_id:>6} result {record.result:>3}  {record.to_sen():<34} {move_text}")
+
+
+def convert_sen_file(sen_path: str, record_path: str, start_id: int = None) -> int:
+    # Text SEN logs (one position per line, no moves, blank lines between games) to records. Games are numbered
+    # from start_id, or after the last game already in the record file. Returns the number of games written
+    with RecordWriter(record_path) as writer, open(sen_path) as sen_file:
+        first_id = writer.next_game_id if start_id is None else start_id
+        games = 0
+        in_game = False
+        for line in sen_file:
+            if not line.strip():
+                in_game = False
+                continue
+            if not in_game:
+                games += 1
+                in_game = True
+            writer.file.write(sen_to_record(line.strip(), game_id=first_id + games - 1))
+    return games
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Onitama binary game records")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    dump_parser = subparsers.add_parser("dump", help="Print records as SEN")
+    dump_parser.add_argument("path")
+    dump_parser.add_argument("--start", type=int, default=0)
+    dump_parser.add_argument("--count", type=int, default=20)
+
+    convert_parser = subparsers.add_parser("from-sen", help="Append positions from a text file of SENs")
+    convert_parser.add_argument("sen_path")
+    convert_parser.add_argument("record_path")
+    convert_parser.add_argument("--start-id", type=int, help="First game id (default: after the file's last game)")
+
+    args = parser.parse_args()
+    if args.command == "dump":
+        dump_records(args.path, args.start, args.count)
+    else:
+        convert_sen_file(args.sen_path, args.record_path, args.start_id)
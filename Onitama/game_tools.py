@@ -1,5 +1,8 @@
 import dataclasses
+import functools
+import itertools
 import random
+import re
 
 # Map all possible cards to their move offsets
 CARD_MOVES = {
@@ -27,6 +30,22 @@ STARTING_BOARD = "SSMSS...............ssmss"
 MAILBOX_WIDTH = 9  # Using a wide mailbox to catch long jumps (tiger, crab, etc.)
 MAILBOX_SIZE = MAILBOX_WIDTH * MAILBOX_WIDTH
 LOGICAL_TO_MAILBOX = [(r + 2) * MAILBOX_WIDTH + (c + 2) for r in range(5) for c in range(5)]
+# The inverse, with -1 for off-board squares
+MAILBOX_TO_LOGICAL = [-1] * MAILBOX_SIZE
+for _logical_index, _mailbox_index in enumerate(LOGICAL_TO_MAILBOX):
+    MAILBOX_TO_LOGICAL[_mailbox_index] = _logical_index
+
+# SEN rows: every row of five squares ("s..S.") and its run-length encoded form ("s2S1"). Each row is a contiguous
+# slice of the mailbox starting at SEN_ROW_STARTS[row]; decoded rows carry the four off-board squares that follow them,
+# so a whole mailbox is the SEN_MAILBOX_PREFIX, five decoded rows and the SEN_MAILBOX_SUFFIX
+SEN_ENCODE_ROW = {"".join(squares): re.sub(r"\.+", lambda empty: str(len(empty.group())), "".join(squares))
+                  for squares in itertools.product(".smSM", repeat=5)}
+SEN_DECODE_ROW = {encoded: tuple(squares) + (None,) * 4 for squares, encoded in SEN_ENCODE_ROW.items()}
+SEN_ROW_STARTS = LOGICAL_TO_MAILBOX[::5]
+SEN_MAILBOX_PREFIX = (None,) * SEN_ROW_STARTS[0]
+SEN_MAILBOX_SUFFIX = (None,) * (MAILBOX_SIZE - SEN_ROW_STARTS[0] - 5 * MAILBOX_WIDTH)
+# Distinct positions whose parsed states parse_sen keeps
+SEN_CACHE_SIZE = 4096
 
 PLAYABLE_INDICES = [
     row * 9 + col
@@ -34,6 +53,71 @@ PLAYABLE_INDICES = [
     for col in range(2, 7)
 ]
 
+# CARD_DESTINATIONS[card][side][mailbox index] -> on-board destinations, side 0 for P1 and 1 for P2 (whose offsets are
+# flipped, since the board is rotated for them). Off-board squares have no destinations
+CARD_DESTINATIONS = {
+    card: tuple(
+        [tuple(to_idx for to_idx in (i + flip * (dx - dy * MAILBOX_WIDTH) for dx, dy in offsets)
+               if to_idx in PLAYABLE_INDICES) if i in PLAYABLE_INDICES else ()
+         for i in range(MAILBOX_SIZE)]
+        for flip in (1, -1))
+    for card, offsets in CARD_MOVES.items()
+}
+# Pieces belonging to each side, for ally checks
+SIDE_PIECES = ("sm", "SM")
+
+# Piece masks: bit i is logical square i, in the order (P1 students, P1 master, P2 students, P2 master)
+PIECE_MASK_INDEX = {"s": 0, "m": 1, "S": 2, "M": 3}
+MAILBOX_BIT = [0] * MAILBOX_SIZE
+for _logical_index, _mailbox_index in enumerate(LOGICAL_TO_MAILBOX):
+    MAILBOX_BIT[_mailbox_index] = 1 << _logical_index
+P1_TEMPLE_BIT = 1 << 22
+P2_TEMPLE_BIT = 1 << 2
+
+# Zobrist keys for hashing positions (fixed seed so keys are stable between runs and processes)
+_zobrist_random = random.Random(0x0417A3A)
+ZOBRIST_PIECES = {piece: [_zobrist_random.getrandbits(64) for _ in range(MAILBOX_SIZE)] for piece in "sSmM"}
+# Per card: (in P1's hand, in P2's hand, in the center)
+ZOBRIST_CARDS = {card: tuple(_zobrist_random.getrandbits(64) for _ in range(3)) for card in CARD_MOVES}
+ZOBRIST_P1_TURN = _zobrist_random.getrandbits(64)
+
+# Symmetries. Left/right mirror: every card's mirror image (negated dx) is also a card. Rotation: turning the board
+# 180 degrees and swapping colours and hands turns a position with P2 to move into the same game seen by P1.
+# Together with the identity they form a group of 4 whose elements are their own inverses
+IDENTITY, MIRROR, ROTATE, ROTATE_MIRROR = range(4)
+CARD_MIRRORS = {card: next(other for other, other_offsets in CARD_MOVES.items()
+                           if set(other_offsets) == {(-dx, dy) for dx, dy in offsets})
+                for card, offsets in CARD_MOVES.items()}
+MIRROR_SQUARE = list(range(MAILBOX_SIZE))
+ROTATE_SQUARE = list(range(MAILBOX_SIZE))
+for _logical_index, _mailbox_index in enumerate(LOGICAL_TO_MAILBOX):
+    MIRROR_SQUARE[_mailbox_index] = LOGICAL_TO_MAILBOX[_logical_index - _logical_index % 5 + 4 - _logical_index % 5]
+    ROTATE_SQUARE[_mailbox_index] = LOGICAL_TO_MAILBOX[24 - _logical_index]
+SWAP_COLOUR = {"s": "S", "m": "M", "S": "s", "M": "m", ".": ".", None: None}
+
+# Per symmetry: square map, card map, and whether colours (and hands) swap
+SYMMETRY_SQUARES = (list(range(MAILBOX_SIZE)), MIRROR_SQUARE, ROTATE_SQUARE,
+                    [MIRROR_SQUARE[ROTATE_SQUARE[i]] for i in range(MAILBOX_SIZE)])
+SYMMETRY_CARDS = ({card: card for card in CARD_MOVES}, CARD_MIRRORS, {card: card for card in CARD_MOVES}, CARD_MIRRORS)
+SYMMETRY_SWAPS_SIDES = (False, False, True, True)
+
+# Zobrist tables that hash a position the way its image under a symmetry would be hashed, so the keys of the
+# MIRROR, ROTATE and ROTATE_MIRROR images can be kept up to date alongside zobrist_key
+def _symmetry_zobrist_tables(symmetry: int) -> tuple[dict[str, list[int]], dict[str, tuple[int, int, int]]]:
+    squares = SYMMETRY_SQUARES[symmetry]
+    cards = SYMMETRY_CARDS[symmetry]
+    swap = int(SYMMETRY_SWAPS_SIDES[symmetry])
+    pieces = {piece: [ZOBRIST_PIECES[SWAP_COLOUR[piece] if swap else piece][squares[i]] for i in range(MAILBOX_SIZE)]
+              for piece in "sSmM"}
+    # A card in P1's hand lands in P2's hand when sides swap
+    card_keys = {card: (ZOBRIST_CARDS[cards[card]][swap], ZOBRIST_CARDS[cards[card]][1 - swap],
+                        ZOBRIST_CARDS[cards[card]][2]) for card in CARD_MOVES}
+    return pieces, card_keys
+
+
+SYMMETRY_ZOBRIST_PIECES, SYMMETRY_ZOBRIST_CARDS = zip(*(_symmetry_zobrist_tables(symmetry)
+                                                         for symmetry in (MIRROR, ROTATE, ROTATE_MIRROR)))
+
 
 @dataclasses.dataclass
 class BoardState:
@@ -42,6 +126,11 @@ class BoardState:
     p1_cards: list[str] = None
     p2_cards: list[str] = None
     center_card: str = None
+    zobrist_key: int = None
+    piece_masks: list[int] = None
+    # Zobrist keys of the MIRROR, ROTATE and ROTATE_MIRROR images of this position. Only computed once canonical_key
+    # needs them (keeping them up to date slows make_move down), then updated by apply_move and make_move
+    symmetry_keys: list[int] = None
 
     def __post_init__(self):
         # Generate a standard starting board
@@ -61,6 +150,12 @@ class BoardState:
             # Select a random starting player
             self.is_p1_turn = random.choice((True, False))
 
+        # Hash the full position (apply_move passes down an incrementally updated key instead)
+        if self.zobrist_key is None:
+            self.zobrist_key = compute_zobrist_key(self)
+        if self.piece_masks is None:
+            self.piece_masks = compute_piece_masks(self)
+
     def __str__(self) -> str:
         output = []
 
@@ -82,65 +177,93 @@ class BoardState:
         return "\n".join(output)
 
 
+def compute_zobrist_key(board_state: BoardState) -> int:
+    key = ZOBRIST_P1_TURN if board_state.is_p1_turn else 0
+    for i in PLAYABLE_INDICES:
+        piece = board_state.mailbox_board[i]
+        if piece and piece != ".":
+            key ^= ZOBRIST_PIECES[piece][i]
+
+    for card in board_state.p1_cards:
+        key ^= ZOBRIST_CARDS[card][0]
+    for card in board_state.p2_cards:
+        key ^= ZOBRIST_CARDS[card][1]
+    key ^= ZOBRIST_CARDS[board_state.center_card][2]
+    return key
+
+
+def compute_symmetry_keys(board_state: BoardState) -> list[int]:
+    keys = []
+    for symmetry, pieces, cards in zip((MIRROR, ROTATE, ROTATE_MIRROR), SYMMETRY_ZOBRIST_PIECES,
+                                       SYMMETRY_ZOBRIST_CARDS):
+        # P1 is to move in a rotated image when P2 is to move here
+        key = ZOBRIST_P1_TURN if board_state.is_p1_turn != SYMMETRY_SWAPS_SIDES[symmetry] else 0
+        for i in PLAYABLE_INDICES:
+            piece = board_state.mailbox_board[i]
+            if piece and piece != ".":
+                key ^= pieces[piece][i]
+        for card in board_state.p1_cards:
+            key ^= cards[card][0]
+        for card in board_state.p2_cards:
+            key ^= cards[card][1]
+        key ^= cards[board_state.center_card][2]
+        keys.append(key)
+    return keys
+
+
+def update_symmetry_keys(keys: list[int], moving_piece: str, from_idx: int, to_idx: int, captured: str, card: str,
+                         old_center: str, owner: int) -> list[int]:
+    # The same update as zobrist_key gets in apply_move, through each symmetry's tables
+    keys = [key ^ ZOBRIST_P1_TURN ^ pieces[moving_piece][from_idx] ^ pieces[moving_piece][to_idx]
+            ^ cards[card][owner] ^ cards[card][2] ^ cards[old_center][2] ^ cards[old_center][owner]
+            for key, pieces, cards in zip(keys, SYMMETRY_ZOBRIST_PIECES, SYMMETRY_ZOBRIST_CARDS)]
+    if captured != ".":
+        keys = [key ^ pieces[captured][to_idx] for key, pieces in zip(keys, SYMMETRY_ZOBRIST_PIECES)]
+    return keys
+
+
+def compute_piece_masks(board_state: BoardState) -> list[int]:
+    masks = [0, 0, 0, 0]
+    for i in PLAYABLE_INDICES:
+        piece = board_state.mailbox_board[i]
+        if piece and piece != ".":
+            masks[PIECE_MASK_INDEX[piece]] |= MAILBOX_BIT[i]
+    return masks
+
+
+def decode_sen(sen: str) -> BoardState:
+    # Table-driven SEN parsing: each row is looked up whole, and the mailbox is built in one go from the decoded rows
+    try:
+        row0, row1, row2, row3, row4, tail = sen.split("/")
+        mailbox = [*SEN_MAILBOX_PREFIX, *SEN_DECODE_ROW[row0], *SEN_DECODE_ROW[row1], *SEN_DECODE_ROW[row2],
+                   *SEN_DECODE_ROW[row3], *SEN_DECODE_ROW[row4], *SEN_MAILBOX_SUFFIX]
+    except (KeyError, ValueError):
+        raise ValueError(f"Invalid SEN '{sen}'") from None
+    if len(tail) != 11:
+        raise ValueError(f"Invalid SEN '{sen}'")
+    return BoardState(mailbox, tail[10] == "0", [tail[0:2], tail[2:4]], [tail[4:6], tail[6:8]], tail[8:10])
+
+
+_decode_sen_cached = functools.lru_cache(maxsize=SEN_CACHE_SIZE)(decode_sen)
+
+
 def parse_sen(sen: str) -> BoardState:
-    # Parse the SEN string
-    sections = sen.split("/")
-    board = sections[:-1]
-    card_section = sections[-1][:-1]
-    cards = [card_section[i] + card_section[i + 1] for i in range(0, len(card_section), 2)]
-    is_p1_move = sections[-1][-1] == "0"
-
-    # Parse the board
-    board_list = []
-    for row in board:
-        row_string = ""
-        for space in row:
-            if space.isdigit():
-                row_string += "." * int(space)
-            else:
-                row_string += space
-        board_list += row_string
-
-    # Build the board mailbox
-    mailbox = [None] * MAILBOX_SIZE
-    for i, space in enumerate(board_list):
-        mailbox[LOGICAL_TO_MAILBOX[i]] = space
-
-    # Build the board state
-    return BoardState(mailbox, is_p1_move, cards[0:2], cards[2:4], cards[4])
+    # Positions repeat (every GAME_UPDATE, book and test positions), so decoded states are cached. States are mutable
+    # (make_move), so callers get a copy of the cached one
+    return copy_board_state(_decode_sen_cached(sen))
+
+
+def parse_sen_cache_clear():
+    _decode_sen_cached.cache_clear()
 
 
 def to_sen(board_state: BoardState) -> str:
-    # Extract 5x5 board portion from mailbox
-    board_rows = []
-
-    for row in range(5):
-        row_data = ""
-        for col in range(5):
-            mailbox_index = LOGICAL_TO_MAILBOX[row * 5 + col]
-            val = board_state.mailbox_board[mailbox_index]
-            row_data += val if val and val != "." else "1"
-
-        # Compress empty spaces ("111" → "3")
-        compressed = ""
-        count = 0
-        for char in row_data:
-            if char == "1":
-                count += 1
-            else:
-                if count > 0:
-                    compressed += str(count)
-                    count = 0
-                compressed += char
-        if count > 0:
-            compressed += str(count)
-        board_rows.append(compressed)
-
-    # Combine all card data
-    card_string = "".join(board_state.p1_cards + board_state.p2_cards + [board_state.center_card])
+    board = board_state.mailbox_board
+    rows = "/".join([SEN_ENCODE_ROW["".join(board[start:start + 5])] for start in SEN_ROW_STARTS])
+    p1_cards = board_state.p1_cards
+    p2_cards = board_state.p2_cards
     turn = "0" if board_state.is_p1_turn else "1"
-
-    return "/".join(board_rows) + "/" + card_string + turn
+    return f"{rows}/{p1_cards[0]}{p1_cards[1]}{p2_cards[0]}{p2_cards[1]}{board_state.center_card}{turn}"
 
 
 def apply_move(board_state: BoardState, move: tuple[int, int, str]) -> BoardState:
@@ -177,10 +300,163 @@ def apply_move(board_state: BoardState, move: tuple[int, int, str]) -> BoardStat
     new_board[from_idx] = "."
     new_board[to_idx] = moving_piece
 
+    # Update the hash: moved and captured pieces, both swapped cards, and the side to move
+    owner = 0 if board_state.is_p1_turn else 1
+    new_key = board_state.zobrist_key ^ ZOBRIST_P1_TURN
+    new_key ^= ZOBRIST_PIECES[moving_piece][from_idx] ^ ZOBRIST_PIECES[moving_piece][to_idx]
+    if target_space != ".":
+        new_key ^= ZOBRIST_PIECES[target_space][to_idx]
+    new_key ^= ZOBRIST_CARDS[card][owner] ^ ZOBRIST_CARDS[card][2]
+    new_key ^= ZOBRIST_CARDS[board_state.center_card][2] ^ ZOBRIST_CARDS[board_state.center_card][owner]
+
+    new_symmetry_keys = None
+    if board_state.symmetry_keys is not None:
+        new_symmetry_keys = update_symmetry_keys(board_state.symmetry_keys, moving_piece, from_idx, to_idx,
+                                                 target_space, card, board_state.center_card, owner)
+
+    new_masks = board_state.piece_masks.copy()
+    new_masks[PIECE_MASK_INDEX[moving_piece]] ^= MAILBOX_BIT[from_idx] | MAILBOX_BIT[to_idx]
+    if target_space != ".":
+        new_masks[PIECE_MASK_INDEX[target_space]] ^= MAILBOX_BIT[to_idx]
+
     if board_state.is_p1_turn:
-        return BoardState(new_board, False, new_cards, board_state.p2_cards.copy(), new_center_card)
+        return BoardState(new_board, False, new_cards, board_state.p2_cards.copy(), new_center_card, new_key,
+                          new_masks, new_symmetry_keys)
     else:
-        return BoardState(new_board, True, board_state.p1_cards.copy(), new_cards, new_center_card)
+        return BoardState(new_board, True, board_state.p1_cards.copy(), new_cards, new_center_card, new_key,
+                          new_masks, new_symmetry_keys)
+
+
+def make_move(board_state: BoardState, move: tuple[int, int, str]) -> tuple[str, int, int, list[int]]:
+    # Unchecked, in-place version of apply_move for search. Returns the undo record for unmake_move:
+    # (captured piece or ".", index of the played card in the hand, previous zobrist key, previous symmetry keys)
+    from_idx, to_idx, card = move
+    board = board_state.mailbox_board
+    moving_piece = board[from_idx]
+    captured = board[to_idx]
+    is_p1_turn = board_state.is_p1_turn
+    hand = board_state.p1_cards if is_p1_turn else board_state.p2_cards
+    old_center = board_state.center_card
+    old_key = board_state.zobrist_key
+
+    # Same card rotation as apply_move: the played card leaves the hand, the old center joins the end
+    card_slot = hand.index(card)
+    del hand[card_slot]
+    hand.append(old_center)
+    board_state.center_card = card
+
+    board[from_idx] = "."
+    board[to_idx] = moving_piece
+
+    masks = board_state.piece_masks
+    masks[PIECE_MASK_INDEX[moving_piece]] ^= MAILBOX_BIT[from_idx] | MAILBOX_BIT[to_idx]
+    if captured != ".":
+        masks[PIECE_MASK_INDEX[captured]] ^= MAILBOX_BIT[to_idx]
+
+    owner = 0 if is_p1_turn else 1
+    key = old_key ^ ZOBRIST_P1_TURN
+    key ^= ZOBRIST_PIECES[moving_piece][from_idx] ^ ZOBRIST_PIECES[moving_piece][to_idx]
+    if captured != ".":
+        key ^= ZOBRIST_PIECES[captured][to_idx]
+    key ^= ZOBRIST_CARDS[card][owner] ^ ZOBRIST_CARDS[card][2]
+    key ^= ZOBRIST_CARDS[old_center][2] ^ ZOBRIST_CARDS[old_center][owner]
+    board_state.zobrist_key = key
+    old_symmetry_keys = board_state.symmetry_keys
+    if old_symmetry_keys is not None:
+        board_state.symmetry_keys = update_symmetry_keys(old_symmetry_keys, moving_piece, from_idx, to_idx, captured,
+                                                         card, old_center, owner)
+    board_state.is_p1_turn = not is_p1_turn
+
+    return captured, card_slot, old_key, old_symmetry_keys
+
+
+def unmake_move(board_state: BoardState, move: tuple[int, int, str], undo: tuple[str, int, int, list[int]]):
+    from_idx, to_idx, card = move
+    captured, card_slot, old_key, old_symmetry_keys = undo
+    board = board_state.mailbox_board
+
+    is_p1_turn = not board_state.is_p1_turn
+    hand = board_state.p1_cards if is_p1_turn else board_state.p2_cards
+    board_state.center_card = hand.pop()
+    hand.insert(card_slot, card)
+
+    moving_piece = board[to_idx]
+    board[from_idx] = moving_piece
+    board[to_idx] = captured
+
+    masks = board_state.piece_masks
+    masks[PIECE_MASK_INDEX[moving_piece]] ^= MAILBOX_BIT[from_idx] | MAILBOX_BIT[to_idx]
+    if captured != ".":
+        masks[PIECE_MASK_INDEX[captured]] ^= MAILBOX_BIT[to_idx]
+    board_state.zobrist_key = old_key
+    board_state.symmetry_keys = old_symmetry_keys
+    board_state.is_p1_turn = is_p1_turn
+
+
+def copy_board_state(board_state: BoardState) -> BoardState:
+    return BoardState(board_state.mailbox_board.copy(), board_state.is_p1_turn, board_state.p1_cards.copy(),
+                      board_state.p2_cards.copy(), board_state.center_card, board_state.zobrist_key,
+                      board_state.piece_masks.copy(), board_state.symmetry_keys)
+
+
+def transform_board_state(board_state: BoardState, symmetry: int) -> BoardState:
+    # The image of a position under one of the symmetries
+    squares = SYMMETRY_SQUARES[symmetry]
+    cards = SYMMETRY_CARDS[symmetry]
+    mailbox = board_state.mailbox_board
+    p1_cards = [cards[card] for card in board_state.p1_cards]
+    p2_cards = [cards[card] for card in board_state.p2_cards]
+    if SYMMETRY_SWAPS_SIDES[symmetry]:
+        return BoardState([SWAP_COLOUR[mailbox[squares[i]]] for i in range(MAILBOX_SIZE)], not board_state.is_p1_turn,
+                          p2_cards, p1_cards, cards[board_state.center_card])
+    return BoardState([mailbox[squares[i]] for i in range(MAILBOX_SIZE)], board_state.is_p1_turn, p1_cards, p2_cards,
+                      cards[board_state.center_card])
+
+
+def transform_move(move: tuple[int, int, str], symmetry: int) -> tuple[int, int, str]:
+    # Maps a move into a symmetric image of its position, and back again (every symmetry is its own inverse)
+    from_idx, to_idx, card = move
+    squares = SYMMETRY_SQUARES[symmetry]
+    return squares[from_idx], squares[to_idx], SYMMETRY_CARDS[symmetry][card]
+
+
+def canonical_key(board_state: BoardState) -> tuple[int, int]:
+    """
+    Return (key, symmetry): the smallest Zobrist key among the images of the position that have P1 to move, and
+    the symmetry producing that image. Symmetric positions share a key, so it can be used as a cache key as long
+    as cached moves are mapped with transform_move
+    """
+    if board_state.symmetry_keys is None:
+        board_state.symmetry_keys = compute_symmetry_keys(board_state)
+    return _select_canonical_key(board_state, board_state.symmetry_keys)
+
+
+def peek_canonical_key(board_state: BoardState) -> tuple[int, int]:
+    # canonical_key without storing symmetry_keys on the state, for states that are searched afterwards (once
+    # stored, make_move and apply_move keep the keys up to date at every node)
+    symmetry_keys = board_state.symmetry_keys or compute_symmetry_keys(board_state)
+    return _select_canonical_key(board_state, symmetry_keys)
+
+
+def _select_canonical_key(board_state: BoardState, symmetry_keys: list[int]) -> tuple[int, int]:
+    mirror_key, rotated_key, rotated_mirror_key = symmetry_keys
+    if board_state.is_p1_turn:
+        if board_state.zobrist_key <= mirror_key:
+            return board_state.zobrist_key, IDENTITY
+        return mirror_key, MIRROR
+    if rotated_key <= rotated_mirror_key:
+        return rotated_key, ROTATE
+    return rotated_mirror_key, ROTATE_MIRROR
+
+
+def canonicalize(board_state: BoardState) -> tuple[BoardState, int]:
+    # The canonical image of a position (its zobrist_key is the canonical key), with each hand sorted,
+    # and the symmetry that maps moves between the two
+    _, symmetry = peek_canonical_key(board_state)
+    canonical = transform_board_state(board_state, symmetry)
+    canonical.p1_cards.sort()
+    canonical.p2_cards.sort()
+    return canonical, symmetry
 
 
 def is_victory(board_state: BoardState) -> tuple[bool, str]:
@@ -200,29 +476,26 @@ def is_victory(board_state: BoardState) -> tuple[bool, str]:
     return False, ""
 
 
+def get_winner(board_state: BoardState) -> str | None:
+    # Same rules and precedence as is_victory, read from the piece masks ("P1", "P2" or None)
+    p1_students, p1_master, p2_students, p2_master = board_state.piece_masks
+    if not p1_master:
+        return "P2"
+    if not p2_master:
+        return "P1"
+    if p2_master & P1_TEMPLE_BIT:
+        return "P2"
+    if p1_master & P2_TEMPLE_BIT:
+        return "P1"
+    return None
+
+
 def get_valid_targets_by_card(board_state: BoardState, start_idx: int, card: str) -> list[int]:
-    is_p1 = board_state.is_p1_turn
-    offsets = CARD_MOVES[card]
+    # Destinations come from the precomputed table; only allies need filtering out
+    side = 0 if board_state.is_p1_turn else 1
+    allies = SIDE_PIECES[side]
     mailbox = board_state.mailbox_board
-    destinations = []
-
-    for dx, dy in offsets:
-        # Flip for P2 (rotated board)
-        if not is_p1:
-            dx, dy = -dx, -dy
-
-        to_idx = start_idx + dx + (-dy) * MAILBOX_WIDTH
-
-        # Check if resulting index is on the board
-        if 0 < to_idx < MAILBOX_SIZE:
-            target = mailbox[to_idx]
-            if target is None or (target != "." and target.islower() == is_p1):
-                # Move is outside board, or targets an ally
-                continue
-            else:
-                # Valid move
-                destinations.append(to_idx)
-    return destinations
+    return [to_idx for to_idx in CARD_DESTINATIONS[card][side][start_idx] if mailbox[to_idx] not in allies]
 
 
 def mailbox_to_coord(index: int) -> tuple[int, int]:
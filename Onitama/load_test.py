@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import dataclasses
+import random
+import time
+
+from Onitama.async_server import Game, Player, Spectator
+from Onitama.bot_tools import get_all_valid_moves
+from Onitama.game_tools import parse_sen, MAILBOX_TO_LOGICAL
+
+HOST = 'localhost'
+PORT = 65432
+SPECTATOR_PORT = 65433
+
+
+@dataclasses.dataclass
+class LoadStats:
+    games_finished: int = 0
+    moves_sent: int = 0
+    invalid_moves: int = 0
+    disconnects: int = 0
+    # Seconds from sending a move to receiving this client's next GAME_UPDATE
+    round_trips: list[float] = dataclasses.field(default_factory=list)
+    # Seconds from connecting to receiving GAME_START
+    lobby_waits: list[float] = dataclasses.field(default_factory=list)
+    games_watched: int = 0
+    spectator_lines: int = 0
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def play_random_game(host: str, port: int, stats: LoadStats, rng: random.Random, max_plies: int):
+    # Connect as a bot that plays random legal moves instantly, so the server is the only bottleneck
+    connect_time = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    role = None
+    sent_at = None
+    plies = 0
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                stats.disconnects += 1
+                return
+            msg = line.decode().strip()
+
+            if msg.startswith("GAME_START"):
+                _, role = msg.split(maxsplit=1)
+                stats.lobby_waits.append(time.perf_counter() - connect_time)
+
+            elif msg.startswith("GAME_UPDATE"):
+                if sent_at is not None:
+                    stats.round_trips.append(time.perf_counter() - sent_at)
+                _, sen = msg.split(maxsplit=1)
+                board = parse_sen(sen)
+                if board.is_p1_turn != (role == "P1"):
+                    continue
+                legal_moves = get_all_valid_moves(board)
+                plies += 1
+                if not legal_moves or plies > max_plies:
+                    # Give up (the server ends the game for the opponent)
+                    return
+                from_idx, to_idx, card = rng.choice(legal_moves)
+                writer.write(f"{MAILBOX_TO_LOGICAL[from_idx]} {MAILBOX_TO_LOGICAL[to_idx]} {card}\n"
+                             .encode())
+                sent_at = time.perf_counter()
+                stats.moves_sent += 1
+
+            elif msg.startswith("INVALID_MOVE"):
+                stats.invalid_moves += 1
+
+            elif msg.startswith("GAME_OVER"):
+                stats.games_finished += 1
+                return
+    finally:
+        writer.close()
+
+
+async def spectate(host: str, spectator_port: int, stats: LoadStats, rng: random.Random, slow: bool,
+                   stop: asyncio.Event):
+    # Watch random live games until stop is set. Slow spectators never read, to show they can't hold games up
+    while not stop.is_set():
+        reader, writer = await asyncio.open_connection(host, spectator_port)
+        writer.write(b"LIST\n")
+        game_ids = (await reader.readline()).decode().split()[1:]
+        writer.close()
+        if not game_ids:
+            await asyncio.sleep(0.01)
+            continue
+
+        reader, writer = await asyncio.open_connection(host, spectator_port)
+        writer.write(f"WATCH {rng.choice(game_ids)}\n".encode())
+        try:
+            if slow:
+                await stop.wait()
+                return
+            while line := await reader.readline():
+                stats.spectator_lines += 1
+                if line.startswith(b"END"):
+                    stats.games_watched += 1
+                    break
+        finally:
+            writer.close()
+
+
+async def run_load_test(host: str, port: int, games: int, concurrency: int, seed: int, max_plies: int,
+                        spectators: int = 0, slow_spectators: int = 0,
+                        spectator_port: int = SPECTATOR_PORT) -> LoadStats:
+    """
+    Keep `concurrency` games (2 clients each) running until `games` games have been played, optionally with
+    spectators watching them. Compare the move round trips with and without spectators to see their cost
+    """
+    stats = LoadStats()
+    rng = random.Random(seed)
+    remaining = games
+    stop_spectating = asyncio.Event()
+    spectator_tasks = [asyncio.create_task(spectate(host, spectator_port, stats, rng, index < slow_spectators,
+                                                    stop_spectating))
+                       for index in range(spectators + slow_spectators)]
+
+    async def client_slot():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            await asyncio.gather(play_random_game(host, port, stats, rng, max_plies),
+                                 play_random_game(host, port, stats, rng, max_plies))
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(client_slot() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start_time
+    stop_spectating.set()
+    await asyncio.gather(*spectator_tasks, return_exceptions=True)
+
+    # Each finished game is reported by both of its clients
+    print(f"Games: {stats.games_finished // 2} in {elapsed:.2f}s ({stats.games_finished / 2 / elapsed:.1f} games/s), "
+          f"{concurrency} concurrent")
+    print(f"Moves: {stats.moves_sent} ({stats.moves_sent / elapsed:.0f} moves/s), "
+          f"{stats.invalid_moves} invalid, {stats.disconnects} disconnects")
+    print(f"Move round trip: p50 {percentile(stats.round_trips, 0.5) * 1000:.2f}ms  "
+          f"p95 {percentile(stats.round_trips, 0.95) * 1000:.2f}ms  "
+          f"p99 {percentile(stats.round_trips, 0.99) * 1000:.2f}ms")
+    print(f"Lobby wait: p50 {percentile(stats.lobby_waits, 0.5) * 1000:.2f}ms  "
+          f"p99 {percentile(stats.lobby_waits, 0.99) * 1000:.2f}ms")
+    if spectator_tasks:
+        print(f"Spectators: {spectators} reading, {slow_spectators} not reading; {stats.games_watched} games "
+              f"watched to the end, {stats.spectator_lines} lines received")
+    return stats
+
+
+class _NullWriter:
+    # Stands in for a StreamWriter (and its transport) in benchmark_move_path
+
+    def __init__(self):
+        self.transport = self
+
+    def write(self, data: bytes):
+        pass
+
+    def is_closing(self) -> bool:
+        return False
+
+    def abort(self):
+        pass
+
+
+def benchmark_move_path(games: int = 200, spectators: int = 0, seed: int = 0, max_plies: int = 200) -> float:
+    """
+    Time Game.process_bot_move in process, without sockets, with spectators attached to every game. Running it
+    with and without spectators isolates what publishing adds to the move path. Returns microseconds per move
+    """
+    rng = random.Random(seed)
+    elapsed = 0.0
+    moves = 0
+    for game_id in range(games):
+        players = {role: Player(None, _NullWriter(), role=role) for role in ("P1", "P2")}
+        game = Game(game_id, players)
+        game.start()
+        for _ in range(spectators):
+            game.watch(Spectator(_NullWriter()))
+        while not game.finished and len(game.moves) < max_plies:
+            legal_moves = get_all_valid_moves(game.board)
+            if not legal_moves:
+                break
+            from_idx, to_idx, card = rng.choice(legal_moves)
+            msg = f"{MAILBOX_TO_LOGICAL[from_idx]} {MAILBOX_TO_LOGICAL[to_idx]} {card}"
+            start_time = time.perf_counter()
+            game.process_bot_move(players[game.turn_role()], msg)
+            elapsed += time.perf_counter() - start_time
+            moves += 1
+    micros = elapsed / moves * 1e6
+    print(f"Move path: {micros:.1f}us per move with {spectators} spectators per game ({moves} moves)")
+    return micros
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for the asyncio Onitama server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=200, help="Simultaneous games")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-plies", type=int, default=200)
+    parser.add_argument("--spectators", type=int, default=0, help="Spectators watching random live games")
+    parser.add_argument("--slow-spectators", type=int, default=0, help="Spectators that never read their stream")
+    parser.add_argument("--spectator-port", type=int, default=SPECTATOR_PORT)
+    parser.add_argument("--move-path", action="store_true",
+                        help="Time the server's move handling in process, with and without --spectators per game")
+    args = parser.parse_args()
+    if args.move_path:
+        benchmark_move_path(args.games, 0, args.seed, args.max_plies)
+        benchmark_move_path(args.games, args.spectators, args.seed, args.max_plies)
+    else:
+        asyncio.run(run_load_test(args.host, args.port, args.games, args.concurrency, args.seed, args.max_plies,
+                                  args.spectators, args.slow_spectators, args.spectator_port))
@@ -0,0 +1,353 @@
+import argparse
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from Onitama.benchmark import BENCHMARK_POSITIONS
+from Onitama.bot_tools import evaluate_incremental, get_all_valid_moves
+from Onitama.game_tools import BoardState, LOGICAL_TO_MAILBOX, copy_board_state, get_winner, make_move, parse_sen, \
+    to_sen, unmake_move
+
+# UCT exploration constant
+EXPLORATION = 1.4
+# Playouts stop after this many plies and score the position with the heuristic evaluation
+PLAYOUT_DEPTH = 8
+# Evaluation points per logistic unit when turning a heuristic score into a win probability
+EVALUATION_SCALE = 200
+# Each pending playout through a node counts as this many lost visits until its result is backed up, so the
+# leaves selected for one batch spread over the tree
+VIRTUAL_LOSS = 1
+# Playouts per search when neither a time budget nor a playout count is given
+DEFAULT_PLAYOUTS = 5000
+# Leaf-parallel searches select this many leaves per worker before waiting for their playouts
+LEAVES_PER_WORKER = 32
+
+# Squares a master must reach to win, by side to move (P1 heads for P2's temple)
+_GOAL_TEMPLES = {True: LOGICAL_TO_MAILBOX[2], False: LOGICAL_TO_MAILBOX[22]}
+
+
+class Node:
+    # wins are counted for the player who made move, i.e. the player to move at the parent
+    __slots__ = ("move", "parent", "key", "children", "untried_moves", "visits", "wins", "virtual_losses",
+                 "terminal_value")
+
+    def __init__(self, move: tuple[int, int, str] | None, parent: "Node | None", key: int,
+                 terminal_value: float | None = None):
+        self.move = move
+        self.parent = parent
+        self.key = key
+        self.children: list[Node] = []
+        # Filled (shuffled) on the first visit
+        self.untried_moves: list[tuple[int, int, str]] | None = None
+        self.visits = 0
+        self.wins = 0.0
+        self.virtual_losses = 0
+        # 1 if move won the game, 0.5 if the player to move here has no moves
+        self.terminal_value = terminal_value
+
+
+def is_winning_move(state: BoardState, move: tuple[int, int, str]) -> bool:
+    # Captures the enemy master or takes the master to the enemy temple
+    from_idx, to_idx, _ = move
+    board = state.mailbox_board
+    return board[to_idx] in ("M" if state.is_p1_turn else "m") or (
+        to_idx == _GOAL_TEMPLES[state.is_p1_turn] and board[from_idx] in "mM")
+
+
+def choose_playout_move(state: BoardState, moves: list[tuple[int, int, str]], rng: random.Random,
+                        policy: str) -> tuple[int, int, str]:
+    # "random" plays uniformly; "heuristic" always takes a win and otherwise prefers captures half the time
+    if policy == "random":
+        return rng.choice(moves)
+    board = state.mailbox_board
+    captures = []
+    for move in moves:
+        if is_winning_move(state, move):
+            return move
+        if board[move[1]] != ".":
+            captures.append(move)
+    if captures and rng.random() < 0.5:
+        return rng.choice(captures)
+    return rng.choice(moves)
+
+
+def playout(state: BoardState, rng: random.Random, policy: str = "heuristic", depth: int = PLAYOUT_DEPTH) -> float:
+    """
+    Play up to depth plies from state (which is restored afterwards) and return the expected score for the player
+    to move in state: 1 or 0 for a decided game, otherwise the evaluation of the final position as a win probability
+    """
+    made = []
+    result = None
+    for _ in range(depth):
+        moves = get_all_valid_moves(state)
+        if not moves:
+            result = 0.5
+            break
+        move = choose_playout_move(state, moves, rng, policy)
+        made.append((move, make_move(state, move)))
+        if get_winner(state) is not None:
+            # The player who just moved won, so the player to move now lost
+            result = 0.0
+            break
+    if result is None:
+        result = 1 / (1 + math.exp(-evaluate_incremental(state) / EVALUATION_SCALE))
+    for move, undo in reversed(made):
+        unmake_move(state, move, undo)
+    # Flip back to the point of view of the player to move at the start
+    return result if len(made) % 2 == 0 else 1 - result
+
+
+def _leaf_parallel_worker(sens: list[str], seed: int, policy: str, depth: int) -> list[float]:
+    # Leaf-parallel worker: one playout from each position
+    rng = random.Random(seed)
+    return [playout(parse_sen(sen), rng, policy, depth) for sen in sens]
+
+
+_worker_searcher = None
+
+
+def _root_parallel_worker(sen: str, seed: int, time_budget: float | None, playouts: int | None, policy: str,
+                          depth: int, exploration: float) -> tuple[dict[tuple[int, int, str], tuple[int, float]], int]:
+    # Root-parallel worker: search an independent tree (kept between calls, for tree reuse) and report the root
+    # statistics as {move: (visits, wins)} plus the playouts run
+    global _worker_searcher
+    if _worker_searcher is None:
+        _worker_searcher = MCTSSearcher(exploration=exploration, playout_depth=depth, policy=policy, seed=seed)
+    _worker_searcher.search(parse_sen(sen), time_budget, playouts)
+    root = _worker_searcher.root
+    return {child.move: (child.visits, child.wins) for child in root.children}, _worker_searcher.playouts
+
+
+class MCTSSearcher:
+    """
+    Monte Carlo tree search with UCT selection and short playouts scored by the heuristic evaluation.
+    The tree is kept between searches: when the next position is found among the root's children or grandchildren
+    (our move, then the opponent's reply), that subtree becomes the new root.
+    With workers > 1, mode="root" runs an independent tree per process and sums the root visit counts;
+    mode="leaf" keeps one tree in this process and, using virtual loss to spread the selections, sends batches of
+    leaves to the workers for their playouts.
+    """
+
+    def __init__(self, workers: int = 1, mode: str = "root", exploration: float = EXPLORATION,
+                 playout_depth: int = PLAYOUT_DEPTH, policy: str = "heuristic", seed: int = None):
+        if mode not in ("root", "leaf"):
+            raise ValueError(f"Unknown parallel MCTS mode '{mode}'")
+        if policy not in ("random", "heuristic"):
+            raise ValueError(f"Unknown playout policy '{policy}'")
+        self.workers = workers or os.cpu_count() or 1
+        self.mode = mode
+        self.exploration = exploration
+        self.playout_depth = playout_depth
+        self.policy = policy
+        self.rng = random.Random(seed)
+        self.root: Node | None = None
+
+        # Statistics for the last search
+        self.playouts = 0
+        self.elapsed = 0.0
+        self.reused_visits = 0
+
+        pool_size = self.workers - 1 if mode == "root" else self.workers
+        self.executor = ProcessPoolExecutor(pool_size) if self.workers > 1 else None
+
+    @property
+    def playouts_per_second(self) -> float:
+        return self.playouts / self.elapsed if self.elapsed else 0.0
+
+    def search(self, state: BoardState, time_budget: float = None, playouts: int = None) -> tuple[int, int, str]:
+        # Search until time_budget seconds or playouts playouts (DEFAULT_PLAYOUTS when neither is given)
+        if time_budget is None and playouts is None:
+            playouts = DEFAULT_PLAYOUTS
+        start_time = time.perf_counter()
+        deadline = start_time + time_budget if time_budget is not None else None
+        self._set_root(state)
+        self.playouts = 0
+
+        if self.executor is not None and self.mode == "root":
+            move = self._root_parallel_search(state, time_budget, playouts, deadline)
+        else:
+            state = copy_board_state(state)
+            # At least one iteration, so the root always has a child to play
+            while not self.playouts or not self._done(deadline, playouts):
+                if self.executor is not None:
+                    self._leaf_parallel_batch(state, playouts)
+                else:
+                    self._iterate(state)
+            move = self._best_move(self._root_statistics())
+        self.elapsed = time.perf_counter() - start_time
+        return move
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _done(self, deadline: float | None, playouts: int | None) -> bool:
+        if playouts is not None and self.playouts >= playouts:
+            return True
+        return deadline is not None and time.perf_counter() >= deadline
+
+    def _set_root(self, state: BoardState):
+        # Reuse the subtree for state if it is one or two plies below the current root
+        self.reused_visits = 0
+        if self.root is not None:
+            candidates = [self.root] + self.root.children + [grandchild for child in self.root.children
+                                                             for grandchild in child.children]
+            for node in candidates:
+                if node.key == state.zobrist_key and node.terminal_value is None:
+                    node.parent = None
+                    node.move = None
+                    self.root = node
+                    self.reused_visits = node.visits
+                    return
+        self.root = Node(None, None, state.zobrist_key)
+
+    def _select_leaf(self, state: BoardState) -> tuple[Node, list]:
+        """
+        Walk from the root to a leaf, making the moves on state and expanding one new child, and add a virtual loss
+        to every node on the way. Returns the leaf and the (move, undo) path to unmake
+        """
+        node = self.root
+        node.virtual_losses += VIRTUAL_LOSS
+        path = []
+        while node.terminal_value is None:
+            if node.untried_moves is None:
+                node.untried_moves = get_all_valid_moves(state)
+                self.rng.shuffle(node.untried_moves)
+                if not node.untried_moves and not node.children:
+                    # The player to move is stuck, which is scored as a draw
+                    node.terminal_value = 0.5
+                    break
+            if node.untried_moves:
+                move = node.untried_moves.pop()
+                path.append((move, make_move(state, move)))
+                child = Node(move, node, state.zobrist_key, 1.0 if get_winner(state) is not None else None)
+                node.children.append(child)
+                child.virtual_losses += VIRTUAL_LOSS
+                return child, path
+            node = self._select_child(node)
+            node.virtual_losses += VIRTUAL_LOSS
+            path.append((node.move, make_move(state, node.move)))
+        return node, path
+
+    def _select_child(self, node: Node) -> Node:
+        # UCT, counting virtual losses as visits with no wins
+        log_visits = math.log(max(1, node.visits + node.virtual_losses))
+        best_child = None
+        best_value = -math.inf
+        for child in node.children:
+            if child.terminal_value == 1.0:
+                # A winning move is always the best choice
+                return child
+            visits = child.visits + child.virtual_losses
+            value = child.wins / visits + self.exploration * math.sqrt(log_visits / visits)
+            if value > best_value:
+                best_child, best_value = child, value
+        return best_child
+
+    @staticmethod
+    def _backup(leaf: Node, value: float):
+        # value is for the player who moved into leaf; it alternates going up the tree
+        node = leaf
+        while node is not None:
+            node.visits += 1
+            node.wins += value
+            node.virtual_losses -= VIRTUAL_LOSS
+            value = 1 - value
+            node = node.parent
+
+    def _iterate(self, state: BoardState):
+        leaf, path = self._select_leaf(state)
+        if leaf.terminal_value is not None:
+            value = leaf.terminal_value
+        else:
+            value = 1 - playout(state, self.rng, self.policy, self.playout_depth)
+        for move, undo in reversed(path):
+            unmake_move(state, move, undo)
+        self._backup(leaf, value)
+        self.playouts += 1
+
+    def _leaf_parallel_batch(self, state: BoardState, playouts: int | None):
+        # Select a batch of leaves (virtual loss keeps them apart), run their playouts in the workers, back them up
+        batch_size = self.workers * LEAVES_PER_WORKER
+        if playouts is not None:
+            batch_size = min(batch_size, playouts - self.playouts)
+        pending = []
+        for _ in range(batch_size):
+            leaf, path = self._select_leaf(state)
+            if leaf.terminal_value is not None:
+                self._backup(leaf, leaf.terminal_value)
+                self.playouts += 1
+            else:
+                pending.append((leaf, to_sen(state)))
+            for move, undo in reversed(path):
+                unmake_move(state, move, undo)
+
+        chunks = [pending[i::self.workers] for i in range(self.workers)]
+        seeds = [self.rng.getrandbits(32) for _ in chunks]
+        results = self.executor.map(_leaf_parallel_worker, [[sen for _, sen in chunk] for chunk in chunks], seeds,
+                                    [self.policy] * len(chunks), [self.playout_depth] * len(chunks))
+        for chunk, values in zip(chunks, results):
+            for (leaf, _), value in zip(chunk, values):
+                self._backup(leaf, 1 - value)
+                self.playouts += 1
+
+    def _root_parallel_search(self, state: BoardState, time_budget: float | None, playouts: int | None,
+                              deadline: float | None) -> tuple[int, int, str]:
+        # Every process searches its own tree for the whole budget; the root statistics are summed
+        sen = to_sen(state)
+        share = -(-playouts // self.workers) if playouts is not None else None
+        helpers = [self.executor.submit(_root_parallel_worker, sen, self.rng.getrandbits(32), time_budget, share,
+                                        self.policy, self.playout_depth, self.exploration)
+                   for _ in range(self.workers - 1)]
+        local_state = copy_board_state(state)
+        while not self.playouts or not self._done(deadline, share):
+            self._iterate(local_state)
+
+        statistics = self._root_statistics()
+        for helper in helpers:
+            helper_statistics, helper_playouts = helper.result()
+            self.playouts += helper_playouts
+            for move, (visits, wins) in helper_statistics.items():
+                total_visits, total_wins = statistics.get(move, (0, 0.0))
+                statistics[move] = (total_visits + visits, total_wins + wins)
+        return self._best_move(statistics)
+
+    def _root_statistics(self) -> dict[tuple[int, int, str], tuple[int, float]]:
+        return {child.move: (child.visits, child.wins) for child in self.root.children}
+
+    def _best_move(self, statistics: dict[tuple[int, int, str], tuple[int, float]]) -> tuple[int, int, str]:
+        # An immediate win if there is one, otherwise the most visited move
+        for child in self.root.children:
+            if child.terminal_value == 1.0:
+                return child.move
+        return max(statistics, key=lambda move: statistics[move][0])
+
+
+def benchmark_mcts(positions: list[str], time_budget: float = 1.0, workers: int = 1, mode: str = "root",
+                   policy: str = "heuristic"):
+    # Print the chosen move and playouts per second for each position
+    with MCTSSearcher(workers, mode, policy=policy, seed=0) as searcher:
+        for sen in positions:
+            move = searcher.search(parse_sen(sen), time_budget)
+            print(f"{sen:<34} move {move}  {searcher.playouts} playouts "
+                  f"({searcher.playouts_per_second:.0f}/s, {searcher.reused_visits} reused)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the MCTS engine")
+    parser.add_argument("sens", nargs="*", default=BENCHMARK_POSITIONS)
+    parser.add_argument("--time", type=float, default=1.0, help="Seconds per position")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--mode", choices=("root", "leaf"), default="root")
+    parser.add_argument("--policy", choices=("random", "heuristic"), default="heuristic")
+    args = parser.parse_args()
+    benchmark_mcts(args.sens, args.time, args.workers, args.mode, args.policy)
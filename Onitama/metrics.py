@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+import time
+
+# Histogram buckets: 2 ** SUB_BUCKET_BITS buckets per power of two nanoseconds, so percentiles are within about 6%
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# Finished games whose counters are kept for export
+MAX_FINISHED_GAMES = 1000
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    # Log-bucketed durations in nanoseconds: constant time to record and constant memory however many samples
+
+    __slots__ = ("counts", "count", "total_ns", "max_ns")
+
+    def __init__(self):
+        self.counts: dict[int, int] = {}
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, ns: int):
+        if ns < SUB_BUCKETS:
+            bucket = max(ns, 0)
+        else:
+            shift = ns.bit_length() - SUB_BUCKET_BITS - 1
+            bucket = (shift + 1) * SUB_BUCKETS + (ns >> shift) - SUB_BUCKETS
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    @staticmethod
+    def bucket_midpoint(bucket: int) -> float:
+        if bucket < SUB_BUCKETS:
+            return float(bucket)
+        shift = bucket // SUB_BUCKETS - 1
+        mantissa = bucket % SUB_BUCKETS + SUB_BUCKETS
+        return (mantissa + 0.5) * (1 << shift)
+
+    def percentile(self, fraction: float) -> float:
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= target:
+                return min(self.bucket_midpoint(bucket), self.max_ns)
+        return float(self.max_ns)
+
+    def summary(self) -> dict[str, float]:
+        # Milliseconds
+        summary = {"count": self.count, "mean_ms": self.total_ns / self.count / 1e6 if self.count else 0.0}
+        for fraction in QUANTILES:
+            summary[f"p{round(fraction * 100)}_ms"] = self.percentile(fraction) / 1e6
+        summary["max_ms"] = self.max_ns / 1e6
+        return summary
+
+
+class Metrics:
+    """
+    Stage timings and counters. Disabled instances do no work beyond one attribute check per call, so code can be
+    instrumented unconditionally. Stages are timed by chaining:
+
+        timer = metrics.start()
+        ...
+        timer = metrics.observe("parse", timer)
+        ...
+        metrics.observe("send", timer)
+
+    Counters are kept in aggregate and, when given a game id, per game; finish_game moves a game's counters to the
+    bounded list of finished games
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.histograms: dict[str, Histogram] = {}
+        self.counters: dict[str, int] = {}
+        self.game_counters: dict[int, dict[str, int]] = {}
+        self.finished_games: collections.deque = collections.deque(maxlen=MAX_FINISHED_GAMES)
+        self.started = time.time()
+
+    def start(self) -> int:
+        return time.perf_counter_ns() if self.enabled else 0
+
+    def observe(self, stage: str, start: int) -> int:
+        # Record the time since start for stage and return the current time, to start the next stage from
+        if not start:
+            return 0
+        now = time.perf_counter_ns()
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.record(now - start)
+        return now
+
+    def record(self, stage: str, seconds: float):
+        # For durations measured elsewhere
+        if self.enabled:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.record(int(seconds * 1e9))
+
+    def count(self, name: str, game_id: int = None, amount: int = 1):
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + amount
+        if game_id is not None:
+            game = self.game_counters.get(game_id)
+            if game is None:
+                game = self.game_counters[game_id] = {}
+            game[name] = game.get(name, 0) + amount
+
+    def finish_game(self, game_id: int, **fields):
+        if not self.enabled:
+            return
+        counters = self.game_counters.pop(game_id, {})
+        self.finished_games.append({"game_id": game_id, **counters, **fields})
+
+    def snapshot(self) -> dict:
+        return {
+            "uptime_s": time.time() - self.started,
+            "stages": {stage: histogram.summary() for stage, histogram in sorted(self.histograms.items())},
+            "counters": dict(sorted(self.counters.items())),
+            "live_games": {str(game_id): counters for game_id, counters in self.game_counters.items()},
+            "finished_games": list(self.finished_games),
+        }
+
+    def write(self, path: str):
+        # Written to a temporary file first, so readers never see a partial file
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as metrics_file:
+            json.dump(self.snapshot(), metrics_file, indent=2)
+        os.replace(temporary_path, path)
+
+    def prometheus(self, prefix: str = "onitama") -> str:
+        # Prometheus text format: a summary per stage (in seconds) and a counter per name
+        lines = [f"# TYPE {prefix}_stage_seconds summary"]
+        for stage, histogram in sorted(self.histograms.items()):
+            for fraction in QUANTILES:
+                lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{fraction}"}} '
+                             f"{histogram.percentile(fraction) / 1e9:.9f}")
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.total_ns / 1e9:.9f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    async def handle_scrape(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Minimal HTTP: any GET gets the Prometheus text, /json gets the snapshot
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            path = request.split()[1].decode() if len(request.split()) > 1 else "/"
+            if path == "/json":
+                body, content_type = json.dumps(self.snapshot()).encode(), "application/json"
+            else:
+                body, content_type = self.prometheus().encode(), "text/plain; version=0.0.4"
+            writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def export(self, path: str = None, port: int = None, host: str = "localhost", interval: float = 5.0):
+        # Serve scrapes on port and/or rewrite the metrics file every interval seconds, until cancelled
+        server = await asyncio.start_server(self.handle_scrape, host, port) if port is not None else None
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                if path is not None:
+                    self.write(path)
+        finally:
+            if server is not None:
+                server.close()
+            if path is not None:
+                self.write(path)
+
+
+def print_metrics(path: str):
+    # Summarise a metrics file
+    with open(path) as metrics_file:
+        snapshot = json.load(metrics_file)
+    print(f"{'stage':<16} {'count':>9} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  (ms)")
+    for stage, summary in snapshot["stages"].items():
+        print(f"{stage:<16} {summary['count']:>9} {summary['mean_ms']:>9.3f} {summary['p50_ms']:>9.3f} "
+              f"{summary['p95_ms']:>9.3f} {summary['p99_ms']:>9.3f} {summary['max_ms']:>9.3f}")
+    for name, value in snapshot["counters"].items():
+        print(f"{name:<16} {value:>9}")
+
+
+def benchmark_overhead(calls: int = 1000000):
+    # Cost of one start/observe pair, disabled and enabled
+    for enabled in (False, True):
+        metrics = Metrics(enabled)
+        start_time = time.perf_counter()
+        for _ in range(calls):
+            metrics.observe("stage", metrics.start())
+        elapsed = time.perf_counter() - start_time
+        print(f"{'enabled' if enabled else 'disabled'}: {elapsed / calls * 1e9:.0f}ns per timed stage")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect Onitama metrics files")
+    parser.add_argument("path", nargs="?", help="Metrics file written with --metrics-file")
+    parser.add_argument("--overhead", action="store_true", help="Measure the instrumentation overhead")
+    args = parser.parse_args()
+    if args.overhead:
+        benchmark_overhead()
+    if args.path:
+        print_metrics(args.path)
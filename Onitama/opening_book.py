@@ -0,0 +1,176 @@
+import argparse
+import array
+import bisect
+import itertools
+import os
+import random
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from Onitama.bitboard import CARD_INDEX, CARD_NAMES
+from Onitama.bot_tools import SearchContext, depth_limited_alpha_beta_id_minimax, get_all_valid_moves
+from Onitama.game_tools import BoardState, CARD_MOVES, LOGICAL_TO_MAILBOX, MAILBOX_TO_LOGICAL, apply_move, \
+    canonicalize, is_victory, parse_sen, peek_canonical_key, to_sen, transform_move
+
+# File layout: header (magic, entry count), then the sorted uint64 canonical keys, then one uint16 move per key
+BOOK_MAGIC = b"ONIBOOK2"
+HEADER = struct.Struct("<8sI")
+
+
+def encode_book_move(move: tuple[int, int, str]) -> int:
+    # 5 bits per logical square and 4 bits for the card
+    from_idx, to_idx, card = move
+    return (MAILBOX_TO_LOGICAL[from_idx] << 9) | (MAILBOX_TO_LOGICAL[to_idx] << 4) | CARD_INDEX[card]
+
+
+def decode_book_move(value: int) -> tuple[int, int, str]:
+    return LOGICAL_TO_MAILBOX[value >> 9], LOGICAL_TO_MAILBOX[(value >> 4) & 31], CARD_NAMES[value & 15]
+
+
+class OpeningBook:
+    """
+    Best moves for opening positions, keyed by canonical key (see game_tools.canonical_key), so mirrored and
+    colour-swapped deals share one entry
+    """
+
+    def __init__(self, keys: array.array = None, moves: array.array = None):
+        self.keys = keys if keys is not None else array.array("Q")
+        self.moves = moves if moves is not None else array.array("H")
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def probe(self, board_state: BoardState) -> tuple[int, int, str] | None:
+        key, symmetry = peek_canonical_key(board_state)
+        index = bisect.bisect_left(self.keys, key)
+        if index == len(self.keys) or self.keys[index] != key:
+            return None
+        move = transform_move(decode_book_move(self.moves[index]), symmetry)
+        # Guard against key collisions
+        return move if move in get_all_valid_moves(board_state) else None
+
+    @classmethod
+    def from_entries(cls, entries: dict[int, int]) -> "OpeningBook":
+        keys = sorted(entries)
+        return cls(array.array("Q", keys), array.array("H", (entries[key] for key in keys)))
+
+    @classmethod
+    def load(cls, path: str) -> "OpeningBook":
+        with open(path, "rb") as book_file:
+            magic, count = HEADER.unpack(book_file.read(HEADER.size))
+            if magic != BOOK_MAGIC:
+                raise ValueError(f"{path} is not an opening book")
+            keys = array.array("Q")
+            keys.fromfile(book_file, count)
+            moves = array.array("H")
+            moves.fromfile(book_file, count)
+        return cls(keys, moves)
+
+    def save(self, path: str):
+        with open(path, "wb") as book_file:
+            book_file.write(HEADER.pack(BOOK_MAGIC, len(self.keys)))
+            self.keys.tofile(book_file)
+            self.moves.tofile(book_file)
+
+
+def start_positions(deals: int = None, seed: int = 0) -> list[BoardState]:
+    # Canonical starting positions for every deal and starting player (or a random sample of deals)
+    if deals is None:
+        candidates = ((p1_cards, p2_cards, center, is_p1_turn)
+                      for cards in itertools.permutations(CARD_MOVES, 5) if cards[0] < cards[1] and cards[2] < cards[3]
+                      for p1_cards, p2_cards, center in [(cards[:2], cards[2:4], cards[4])]
+                      for is_p1_turn in (True, False))
+    else:
+        rng = random.Random(seed)
+        candidates = []
+        for _ in range(deals):
+            cards = rng.sample(list(CARD_MOVES), 5)
+            candidates.append((cards[:2], cards[2:4], cards[4], rng.choice((True, False))))
+
+    positions = {}
+    for p1_cards, p2_cards, center, is_p1_turn in candidates:
+        canonical, _ = canonicalize(BoardState(None, is_p1_turn, list(p1_cards), list(p2_cards), center))
+        positions.setdefault(canonical.zobrist_key, canonical)
+    return list(positions.values())
+
+
+def check_probe(deals: int = 200, seed: int = 0) -> int:
+    # Book the first legal move of random deals (from either side's view), then check probe finds each one without
+    # storing symmetry keys on the probed state, which would slow down searching it after a miss
+    rng = random.Random(seed)
+    states = []
+    for _ in range(deals):
+        cards = rng.sample(list(CARD_MOVES), 5)
+        states.append(BoardState(None, rng.choice((True, False)), cards[:2], cards[2:4], cards[4]))
+    entries = {}
+    for state in states:
+        key, symmetry = peek_canonical_key(state)
+        entries[key] = encode_book_move(transform_move(get_all_valid_moves(state)[0], symmetry))
+    book = OpeningBook.from_entries(entries)
+    for state in states:
+        move = book.probe(state)
+        assert move in get_all_valid_moves(state), f"Book move {move} is not legal in {to_sen(state)}"
+        assert state.symmetry_keys is None, f"probe stored symmetry keys on {to_sen(state)}"
+    return len(states)
+
+
+def _search_book_position(sen: str, depth: int) -> int:
+    move = depth_limited_alpha_beta_id_minimax(parse_sen(sen), SearchContext(), depth)
+    return encode_book_move(move)
+
+
+def generate_book(path: str, depth: int = 6, plies: int = 1, deals: int = None, seed: int = 0,
+                  workers: int = None) -> OpeningBook:
+    """
+    Search every start position to depth and store the best move. With plies > 1, the book move is played and
+    every reply is expanded to the next level, so the book covers the first plies moves of the book side
+    against any opponent
+    """
+    entries = {}
+    level = start_positions(deals, seed)
+    start_time = time.perf_counter()
+
+    with ProcessPoolExecutor(workers or os.cpu_count()) as executor:
+        for ply in range(plies):
+            sens = [to_sen(position) for position in level]
+            moves = list(executor.map(_search_book_position, sens, itertools.repeat(depth),
+                                      chunksize=max(1, len(sens) // (4 * (workers or os.cpu_count())))))
+            next_level = {}
+            for position, move in zip(level, moves):
+                entries[position.zobrist_key] = move
+                after_book_move = apply_move(position, decode_book_move(move))
+                if ply + 1 == plies or is_victory(after_book_move)[0]:
+                    continue
+                for reply in get_all_valid_moves(after_book_move):
+                    child = apply_move(after_book_move, reply)
+                    if is_victory(child)[0]:
+                        continue
+                    canonical, _ = canonicalize(child)
+                    if canonical.zobrist_key not in entries:
+                        next_level.setdefault(canonical.zobrist_key, canonical)
+            print(f"[BOOK] ply {ply + 1}: {len(level)} positions searched, {len(entries)} entries "
+                  f"({time.perf_counter() - start_time:.0f}s)")
+            level = list(next_level.values())
+
+    book = OpeningBook.from_entries(entries)
+    book.save(path)
+    return book
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate an Onitama opening book")
+    parser.add_argument("path", nargs="?")
+    parser.add_argument("--depth", type=int, default=6, help="Search depth for each book move")
+    parser.add_argument("--plies", type=int, default=1, help="Book moves per game for the book side")
+    parser.add_argument("--deals", type=int, default=None, help="Sample this many deals instead of all of them")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--check", action="store_true", help="Check probing against a small generated book instead")
+    args = parser.parse_args()
+    if args.check:
+        print("Book probes are correct and leave the position unchanged on", check_probe(), "positions")
+    elif args.path is None:
+        parser.error("a book path is needed unless --check is given")
+    else:
+        generate_book(args.path, args.depth, args.plies, args.deals, args.seed, args.workers)
@@ -0,0 +1,391 @@
+import argparse
+import math
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+from Onitama.benchmark import BENCHMARK_POSITIONS
+from Onitama.bitboard import CARD_INDEX, CARD_NAMES
+from Onitama.bot_tools import MAX_PLY, WIN_BOUND, SearchContext, SearchTimeout, TranspositionEntry, \
+    depth_limited_alpha_beta_id_minimax, get_all_valid_moves, negamax, order_moves, store_transposition_table
+from Onitama.game_tools import BoardState, LOGICAL_TO_MAILBOX, MAILBOX_TO_LOGICAL, apply_move, parse_sen
+
+# Shared table entries are two unsigned 64-bit words: (key ^ data, data)
+_SCORE_OFFSET = 1 << 23
+
+
+def _pack_move(move: tuple[int, int, str] | None) -> int:
+    if move is None:
+        return 0
+    from_idx, to_idx, card = move
+    return 1 | MAILBOX_TO_LOGICAL[from_idx] << 1 | MAILBOX_TO_LOGICAL[to_idx] << 6 | CARD_INDEX[card] << 11
+
+
+def _unpack_move(packed: int) -> tuple[int, int, str] | None:
+    if not packed & 1:
+        return None
+    return LOGICAL_TO_MAILBOX[packed >> 1 & 31], LOGICAL_TO_MAILBOX[packed >> 6 & 31], CARD_NAMES[packed >> 11 & 15]
+
+
+def _pack_entry(depth: int, score: float, bound: int, best_move: tuple[int, int, str] | None, generation: int) -> int:
+    return ((int(score) + _SCORE_OFFSET) | depth << 24 | bound << 32 | (generation & 255) << 34
+            | _pack_move(best_move) << 42)
+
+
+class SharedTranspositionTable:
+    """
+    Lockless transposition table in shared memory, with the same interface as TranspositionTable.
+    Each slot stores (key ^ data, data), so a slot torn by two processes writing at once fails the key check
+    and is treated as a miss instead of returning a corrupted entry.
+    """
+
+    def __init__(self, size_bits: int = 20, name: str = None):
+        self.size_bits = size_bits
+        self.size = 1 << size_bits
+        self.index_mask = self.size - 1
+        self.owner = name is None
+        if self.owner:
+            # One extra word at the end holds the search generation
+            self.memory = shared_memory.SharedMemory(create=True, size=self.size * 16 + 8)
+            self.memory.buf[:] = bytes(len(self.memory.buf))
+        else:
+            # Pool workers share the owner's resource tracker, and only the owner unlinks the segment
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.slots = self.memory.buf.cast("Q")
+        self.generation_slot = self.size * 2
+
+        # Counters are per process
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+        self.replacements = 0
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    @property
+    def generation(self) -> int:
+        return self.slots[self.generation_slot]
+
+    def _read(self, index: int) -> tuple[int, int] | None:
+        checked_key = self.slots[index * 2]
+        data = self.slots[index * 2 + 1]
+        if not data:
+            return None
+        return checked_key ^ data, data
+
+    def probe(self, key: int) -> TranspositionEntry | None:
+        slot = self._read(key & self.index_mask)
+        if slot is None:
+            self.misses += 1
+            return None
+        stored_key, data = slot
+        if stored_key != key:
+            self.collisions += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return TranspositionEntry(key, data >> 24 & 255, (data & 0xFFFFFF) - _SCORE_OFFSET, data >> 32 & 3,
+                                  _unpack_move(data >> 42), data >> 34 & 255)
+
+    def store(self, key: int, depth: int, score: float, bound: int, best_move: tuple[int, int, str] | None):
+        if not math.isfinite(score):
+            return
+        index = key & self.index_mask
+        slot = self._read(index)
+        if slot is not None:
+            stored_key, data = slot
+            current = (data >> 34 & 255) == (self.generation & 255)
+            if stored_key == key:
+                if depth < (data >> 24 & 255) and current:
+                    return
+                if best_move is None:
+                    best_move = _unpack_move(data >> 42)
+            elif depth < (data >> 24 & 255) and current:
+                return
+            else:
+                self.replacements += 1
+        self.stores += 1
+        data = _pack_entry(depth, score, bound, best_move, self.generation)
+        self.slots[index * 2] = key ^ data
+        self.slots[index * 2 + 1] = data
+
+    def new_search(self):
+        # Helpers search on behalf of the owner, so only the owner starts a new generation
+        if self.owner:
+            self.slots[self.generation_slot] += 1
+
+    def clear(self):
+        self.memory.buf[:] = bytes(len(self.memory.buf))
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.hits = self.misses = self.collisions = self.stores = self.replacements = 0
+
+    def stats(self) -> dict[str, float]:
+        probes = self.hits + self.misses
+        used = sum(1 for i in range(self.size) if self.slots[i * 2 + 1])
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "collisions": self.collisions,
+            "stores": self.stores,
+            "replacements": self.replacements,
+            "hit_rate": self.hits / probes if probes else 0.0,
+            "fill_rate": used / self.size,
+        }
+
+    def close(self):
+        self.slots.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+# Per-process search state for pool workers
+_worker_context: SearchContext | None = None
+
+
+def _init_worker(table_name: str, size_bits: int, stop_event):
+    global _worker_context
+    _worker_context = SearchContext(SharedTranspositionTable(size_bits, table_name), stop_event=stop_event)
+
+
+def _search_root_move(state: BoardState, move: tuple[int, int, str], alpha: float, beta: float, depth: int,
+                      deadline: float | None) -> tuple[float | None, int]:
+    # Score one root move; returns (None, nodes) if the search ran out of time. The deadline is a perf_counter time,
+    # which is the same monotonic clock in every process, so time spent queued for a worker counts against it
+    context = _worker_context
+    context.nodes = 0
+    context.stopped = False
+    context.deadline = deadline
+    if deadline is not None and time.perf_counter() >= deadline:
+        return None, 0
+    try:
+        score = -negamax(apply_move(state, move), -beta, -alpha, depth - 1, context, 1)
+    except SearchTimeout:
+        return None, context.nodes
+    return score, context.nodes
+
+
+def _lazy_smp_helper(state: BoardState, target_depth: int, worker_id: int, time_budget: float | None) -> int:
+    # Search the same position as the main searcher, only to fill the shared table; returns nodes searched
+    context = _worker_context
+    context.new_search()
+    context.deadline = time.perf_counter() + time_budget if time_budget is not None else None
+
+    # Perturb move ordering so helpers explore different parts of the tree
+    rng = random.Random(worker_id)
+    for move in get_all_valid_moves(state):
+        context.history[move] = rng.randrange(64)
+    depth_limited_alpha_beta_id_minimax(state, context, min(MAX_PLY - 1, target_depth + worker_id % 2))
+    return context.nodes
+
+
+class ParallelSearcher:
+    """
+    Multi-process search over a shared transposition table.
+    mode="lazy_smp": the main process searches while workers - 1 helpers search the same root and fill the table.
+    mode="root_split": the first root move is searched in the main process, the rest are split across workers
+    with a null window and re-searched if they beat it. Until the first move's score is known, workers use the
+    previous depth's score as the bound, and only moves that bound doesn't settle are searched again.
+    A node_budget counts the main process's nodes in lazy_smp mode, and every process's in root_split mode.
+    """
+
+    def __init__(self, workers: int = None, mode: str = "lazy_smp", size_bits: int = 20):
+        if mode not in ("lazy_smp", "root_split"):
+            raise ValueError(f"Unknown parallel search mode '{mode}'")
+        self.workers = workers or os.cpu_count() or 1
+        self.mode = mode
+        self.transposition_table = SharedTranspositionTable(size_bits)
+        self.stop_event = multiprocessing.Event()
+        self.context = SearchContext(self.transposition_table)
+        self.helper_nodes = 0
+
+        pool_size = self.workers - 1 if mode == "lazy_smp" else self.workers
+        self.executor = None
+        if pool_size > 0:
+            self.executor = ProcessPoolExecutor(pool_size, initializer=_init_worker,
+                                                initargs=(self.transposition_table.name, size_bits, self.stop_event))
+
+    @property
+    def nodes(self) -> int:
+        return self.context.nodes + self.helper_nodes
+
+    def search(self, state: BoardState, target_depth: int = 4, time_budget: float = None,
+               node_budget: int = None) -> tuple[int, int, str]:
+        self.helper_nodes = 0
+        self.stop_event.clear()
+        if self.mode == "lazy_smp":
+            return self._lazy_smp_search(state, target_depth, time_budget, node_budget)
+        return self._root_split_search(state, target_depth, time_budget, node_budget)
+
+    def _lazy_smp_search(self, state: BoardState, target_depth: int, time_budget: float | None,
+                         node_budget: int | None):
+        helpers = []
+        if self.executor is not None:
+            helpers = [self.executor.submit(_lazy_smp_helper, state, target_depth, worker_id, time_budget)
+                       for worker_id in range(1, self.workers)]
+
+        self.context.deadline = time.perf_counter() + time_budget if time_budget is not None else None
+        self.context.node_limit = node_budget
+        try:
+            best_move = depth_limited_alpha_beta_id_minimax(state, self.context, target_depth)
+        finally:
+            self.context.deadline = None
+            self.context.node_limit = None
+            self.stop_event.set()
+            self.helper_nodes = sum(helper.result() for helper in helpers)
+        return best_move
+
+    def _stop_workers(self, futures: list):
+        # Drop the queued root moves and stop the running ones, waiting for them so none outlive the search
+        for future in futures:
+            future.cancel()
+        self.stop_event.set()
+        for future in futures:
+            if not future.cancelled():
+                self.helper_nodes += future.result()[1]
+
+    def _collect_root_scores(self, futures: list, node_budget: int | None, deadline: float | None) -> list[float]:
+        # Wait for the workers' scores until the deadline, stopping the rest on a timeout or once the node budget is
+        # spent. The iteration is then abandoned, keeping the last completed depth's move
+        pending = set(futures)
+        while pending:
+            timeout = max(deadline - time.perf_counter(), 0.0) if deadline is not None else None
+            done, pending = wait(pending, timeout, return_when=FIRST_COMPLETED)
+            out_of_time = not done
+            for future in done:
+                score, nodes = future.result()
+                self.helper_nodes += nodes
+                if score is None or (node_budget is not None and self.nodes >= node_budget):
+                    out_of_time = True
+            if out_of_time:
+                self._stop_workers(list(pending))
+                raise SearchTimeout()
+        return [future.result()[0] for future in futures]
+
+    def _root_split_search(self, state: BoardState, target_depth: int, time_budget: float | None,
+                           node_budget: int | None):
+        context = self.context
+        context.new_search()
+        deadline = time.perf_counter() + time_budget if time_budget is not None else None
+        context.deadline = deadline
+        context.node_limit = node_budget
+        start_time = time.perf_counter()
+        root_moves = get_all_valid_moves(state)
+        best_move = root_moves[0]
+        previous_score = None
+
+        try:
+            for depth in range(1, target_depth + 1):
+                nodes_before = self.nodes
+                order_moves(state, root_moves, 0, best_move, context)
+                remaining = root_moves[1:]
+
+                # While the expected best move is searched here, the workers test the rest against the previous
+                # depth's score (when it isn't a decided one), which the first move's score is usually close to
+                speculative = previous_score is not None and abs(previous_score) < WIN_BOUND
+                futures = []
+                if speculative:
+                    futures = [self.executor.submit(_search_root_move, state, move, previous_score,
+                                                    previous_score + 1, depth, deadline) for move in remaining]
+
+                try:
+                    alpha = -negamax(apply_move(state, root_moves[0]), -math.inf, math.inf, depth - 1, context, 1)
+                except SearchTimeout:
+                    self._stop_workers(futures)
+                    raise
+                depth_best = root_moves[0]
+
+                # Scores are fail-soft: at or below the bound they are upper bounds, above it lower bounds. Moves
+                # whose speculative score doesn't decide whether they beat alpha get a null window around alpha
+                unsettled = remaining
+                fail_highs = []
+                if speculative:
+                    unsettled = []
+                    for move, score in zip(remaining, self._collect_root_scores(futures, node_budget, deadline)):
+                        if score <= previous_score and score <= alpha:
+                            continue
+                        if score > previous_score and score > alpha:
+                            fail_highs.append(move)
+                        else:
+                            unsettled.append(move)
+
+                # Prove the rest are no better with a null window, in parallel
+                futures = [self.executor.submit(_search_root_move, state, move, alpha, alpha + 1, depth, deadline)
+                           for move in unsettled]
+                for move, score in zip(unsettled, self._collect_root_scores(futures, node_budget, deadline)):
+                    if score > alpha:
+                        fail_highs.append(move)
+
+                # Re-search moves that beat the bound with a full window
+                for move in fail_highs:
+                    score = -negamax(apply_move(state, move), -math.inf, -alpha, depth - 1, context, 1)
+                    if score > alpha:
+                        alpha = score
+                        depth_best = move
+
+                best_move = depth_best
+                previous_score = alpha
+                context.best_score = alpha
+                context.completed_depth = depth
+                context.nodes_by_depth[depth] = self.nodes - nodes_before
+                context.time_by_depth[depth] = time.perf_counter() - start_time
+                store_transposition_table(state, -math.inf, math.inf, depth, alpha, best_move, context)
+                if abs(alpha) >= WIN_BOUND:
+                    break
+        except SearchTimeout:
+            pass
+        finally:
+            context.deadline = None
+            context.node_limit = None
+        return best_move
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.transposition_table.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def scaling_report(positions: list[str], target_depth: int, worker_counts: list[int], mode: str = "lazy_smp"):
+    # Print nodes/sec and average time to reach each depth for each worker count
+    print(f"Mode: {mode}, depth {target_depth}, {len(positions)} positions")
+    print(f"{'workers':>7} {'nodes':>10} {'seconds':>8} {'nps':>9}  time to depth")
+    for workers in worker_counts:
+        total_nodes = 0
+        total_time = 0.0
+        time_to_depth = {}
+        with ParallelSearcher(workers, mode) as searcher:
+            for sen in positions:
+                state = parse_sen(sen)
+                searcher.transposition_table.clear()
+                start_time = time.perf_counter()
+                searcher.search(state, target_depth)
+                total_time += time.perf_counter() - start_time
+                total_nodes += searcher.nodes
+                for depth, seconds in searcher.context.time_by_depth.items():
+                    time_to_depth[depth] = time_to_depth.get(depth, 0.0) + seconds
+
+        depths = " ".join(f"d{depth}={seconds / len(positions):.3f}s" for depth, seconds in time_to_depth.items())
+        print(f"{workers:>7} {total_nodes:>10} {total_time:>8.2f} {total_nodes / total_time:>9.0f}  {depths}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parallel Onitama search scaling report")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--mode", choices=("lazy_smp", "root_split"), default="lazy_smp")
+    args = parser.parse_args()
+    scaling_report(BENCHMARK_POSITIONS, args.depth, args.workers, args.mode)
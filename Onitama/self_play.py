@@ -0,0 +1,114 @@
+import argparse
+import gzip
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from Onitama.bot_tools import get_all_valid_moves
+from Onitama.game_records import RecordWriter, parse_logical_move
+from Onitama.game_tools import MAILBOX_TO_LOGICAL, apply_move, to_sen
+from Onitama.tournament import Engine, EngineConfig, adjudicate, deal_board
+
+
+def play_self_play_game(config: EngineConfig, seed: int, random_plies: int = 4, max_plies: int = 200) -> dict:
+    """
+    Play one game of the engine against itself. The first random_plies moves are random legal moves so that
+    games from the same deal diverge. Every ply records [sen, move, depth, score, nodes] (depth 0 for random moves).
+    """
+    board = deal_board(seed)
+    rng = random.Random(seed)
+    engine = Engine(config)
+    plies = []
+    seen = {}
+
+    try:
+        while True:
+            result = adjudicate(board, seen, len(plies), max_plies)
+            if result is not None:
+                p1_score, reason = result
+                break
+
+            sen = to_sen(board)
+            if len(plies) < random_plies:
+                move = rng.choice(get_all_valid_moves(board))
+                depth, score, nodes = 0, None, 0
+            else:
+                move = engine.choose_move(board)
+                context = engine.context
+                nodes = context.nodes + context.quiescence_nodes
+                depth, score = context.completed_depth, context.best_score
+            board = apply_move(board, move)
+            from_idx, to_idx, card = move
+            plies.append([sen, f"{MAILBOX_TO_LOGICAL[from_idx]} {MAILBOX_TO_LOGICAL[to_idx]} {card}",
+                          depth, score, nodes])
+    finally:
+        engine.close()
+
+    return {"seed": seed, "engine": config.name, "plies": plies, "p1_score": p1_score, "reason": reason}
+
+
+def _play_batch(config: EngineConfig, seeds: list[int], random_plies: int, max_plies: int) -> list[dict]:
+    # Workers play a whole batch per task, so process overhead is paid once per batch rather than per game
+    return [play_self_play_game(config, seed, random_plies, max_plies) for seed in seeds]
+
+
+def run_self_play(config: EngineConfig, games: int, output_path: str, seed: int = 0, workers: int = None,
+                  batch_size: int = 16, random_plies: int = 4, max_plies: int = 200,
+                  records_path: str = None) -> dict[str, float]:
+    # Games are written to a gzipped JSON lines log (one game per line) as soon as their batch finishes,
+    # and optionally to a binary record file (see game_records)
+    rng = random.Random(seed)
+    seeds = [rng.getrandbits(32) for _ in range(games)]
+    batches = [seeds[start:start + batch_size] for start in range(0, games, batch_size)]
+    results = {1.0: 0, 0.5: 0, 0.0: 0}
+    total_plies = 0
+    written = 0
+    start_time = time.perf_counter()
+    records = RecordWriter(records_path) if records_path else None
+
+    with gzip.open(output_path, "wt") as output, ProcessPoolExecutor(workers or os.cpu_count()) as executor:
+        futures = [executor.submit(_play_batch, config, batch, random_plies, max_plies) for batch in batches]
+        for future in as_completed(futures):
+            for game in future.result():
+                output.write(json.dumps(game, separators=(",", ":")) + "\n")
+                results[game["p1_score"]] += 1
+                total_plies += len(game["plies"])
+                if records:
+                    records.write_game(deal_board(game["seed"]), [parse_logical_move(ply[1]) for ply in game["plies"]],
+                                       game["p1_score"])
+            written += len(future.result())
+            elapsed = time.perf_counter() - start_time
+            print(f"[SELF-PLAY] {written}/{games} games ({written / elapsed:.1f} games/s)")
+
+    if records:
+        records.close()
+    elapsed = time.perf_counter() - start_time
+    print(f"P1 wins: {results[1.0]}  P2 wins: {results[0.0]}  draws: {results[0.5]}  "
+          f"average length: {total_plies / max(games, 1):.1f} plies  {elapsed:.1f}s")
+    return {"games": games, "plies": total_plies, "seconds": elapsed, "games_per_second": games / elapsed}
+
+
+def read_self_play_log(path: str):
+    # Yield games one at a time, without loading the whole log
+    with gzip.open(path, "rt") as log:
+        for line in log:
+            yield json.loads(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-process Onitama self-play")
+    parser.add_argument("--engine", default="selfplay:depth=4",
+                        help="Engine spec 'name:depth=4,time=0.1,quiescence=1'")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--output", default="self_play.jsonl.gz")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=16, help="Games per worker task")
+    parser.add_argument("--random-plies", type=int, default=4, help="Random opening moves for variety")
+    parser.add_argument("--max-plies", type=int, default=200)
+    parser.add_argument("--records", default=None, help="Also append games to this binary record file")
+    args = parser.parse_args()
+    run_self_play(EngineConfig.parse(args.engine), args.games, args.output, args.seed, args.workers,
+                  args.batch_size, args.random_plies, args.max_plies, args.records)
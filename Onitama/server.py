@@ -1,8 +1,10 @@
+import argparse
 import socket
 import threading
 import time
 
 from Onitama.game_tools import BoardState, to_sen, parse_sen, apply_move, is_victory, LOGICAL_TO_MAILBOX
+from Onitama.metrics import Metrics
 
 HOST = 'localhost'
 PORT = 65432
@@ -11,6 +13,9 @@ clients = {}       # 'P1' -> socket, 'P2' -> socket
 roles = {}         # socket -> 'P1' or 'P2'
 current_board = None
 lock = threading.Lock()
+# Enabled by start_server when a metrics file is given
+metrics = Metrics()
+metrics_path = None
 
 def handle_client(conn, role):
     global current_board
@@ -41,9 +46,12 @@ def handle_client(conn, role):
         del clients[role]
         del roles[conn]
     conn.close()
+    if metrics_path is not None:
+        metrics.write(metrics_path)
 
 def process_bot_move(conn, role, msg):
     global current_board
+    timer = metrics.start()
     try:
         current_turn = "P1" if current_board.is_p1_turn else "P2"
         if role != current_turn:
@@ -59,15 +67,20 @@ def process_bot_move(conn, role, msg):
 
         from_idx = LOGICAL_TO_MAILBOX[logical_from]
         to_idx = LOGICAL_TO_MAILBOX[logical_to]
+        timer = metrics.observe("parse", timer)
 
         with lock:
             current_board = apply_move(current_board, (from_idx, to_idx, card))
+            timer = metrics.observe("apply_move", timer)
             sen = to_sen(current_board)
+            timer = metrics.observe("to_sen", timer)
+            metrics.count("moves")
 
             print(current_board)
 
             # Check win condition
             won, reason = is_victory(current_board)
+            timer = metrics.observe("victory_check", timer)
             if won:
                 for sock in clients.values():
                     try:
@@ -75,20 +88,28 @@ def process_bot_move(conn, role, msg):
                     except:
                         pass  # One of them might have already disconnected
                 print(f"[GAME OVER] {reason}")
+                metrics.count("games_finished")
+                if metrics_path is not None:
+                    metrics.write(metrics_path)
                 return
 
             # Notify the next player to move
             next_turn = "P1" if current_board.is_p1_turn else "P2"
             next_sock = clients[next_turn]
             next_sock.sendall(f"GAME_UPDATE {sen}\n".encode())
+            metrics.observe("send", timer)
 
     except Exception as e:
+        metrics.count("invalid_moves")
         conn.sendall(f"INVALID_MOVE {str(e)}\n".encode())
         print(f"[INVALID] {role} sent: {msg} — {e}")
 
-def start_server():
-    global current_board
+def start_server(metrics_file=None):
+    global current_board, metrics, metrics_path
     current_board = BoardState()
+    if metrics_file is not None:
+        metrics = Metrics(enabled=True)
+        metrics_path = metrics_file
 
     print(f"[SERVER] Starting on {HOST}:{PORT}")
 
@@ -125,4 +146,7 @@ def start_server():
         clients[turn_player].sendall(f"GAME_UPDATE {sen}\n".encode())
 
 if __name__ == "__main__":
-    start_server()
+    parser = argparse.ArgumentParser(description="Onitama server for a single game between two bots")
+    parser.add_argument("--metrics-file", default=None, help="Write stage timings and counters here when the game ends")
+    args = parser.parse_args()
+    start_server(args.metrics_file)
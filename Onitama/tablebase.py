@@ -0,0 +1,448 @@
+import argparse
+import array
+import itertools
+import mmap
+import os
+import random
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from Onitama.bitboard import BitBoardState, CARD_INDEX, CARD_NAMES, CARD_TARGET_MASKS, P1, P2, P1_TEMPLE, \
+    P2_TEMPLE, to_board_state
+from Onitama.bot_tools import get_all_valid_moves
+from Onitama.game_tools import BoardState, apply_move, get_winner, to_sen
+
+# Retrograde endgame tablebases over a fixed set of 5 cards. A table holds every position with both masters, a P1
+# students and b P2 students. Each entry is a uint16: 0 for a draw (or an unreachable/finished position), an odd number
+# d when the side to move wins in d plies and an even number d when it loses in d plies. Tables are generated in order
+# of student count, since captures lead into smaller tables, and each finished table is written to its own file so an
+# interrupted run can resume
+TABLEBASE_MAGIC = b"ONITB001"
+# Magic, the 5 card ids in order, P1 students, P2 students, one pad byte (keeps the values 2-byte aligned)
+HEADER = struct.Struct("<8s5BBBx")
+
+# Below the search's win scores, so a win found by search is still preferred
+TABLEBASE_WIN_SCORE = 50000
+MAX_STUDENTS = 4
+# The most students the command line generates; see table_size for why
+MAX_GENERATED_STUDENTS = 3
+
+SQUARES = 25
+CANNOT_LOSE = 0xFFFF
+
+# COMBINATIONS[n] lists the masks of every set of n squares, COMBINATION_RANK[n] maps a mask to its position
+COMBINATIONS = [[sum(1 << square for square in squares) for squares in itertools.combinations(range(SQUARES), n)]
+                for n in range(MAX_STUDENTS + 1)]
+COMBINATION_RANK = [{mask: rank for rank, mask in enumerate(masks)} for masks in COMBINATIONS]
+
+# SOURCE_MASKS[card][side][square] -> squares from which card moves a piece of side onto square
+SOURCE_MASKS = tuple(tuple(tuple(sum(1 << source for source in range(SQUARES) if targets[source] >> square & 1)
+                                 for square in range(SQUARES))
+                           for targets in per_side)
+                     for per_side in CARD_TARGET_MASKS)
+
+# The square each side's master must reach to win by occupation
+TEMPLE_TARGET = (P2_TEMPLE, P1_TEMPLE)
+
+
+def squares_of(mask: int):
+    while mask:
+        bit = mask & -mask
+        mask ^= bit
+        yield bit.bit_length() - 1
+
+
+class CardSet:
+    # Card distributions for one set of 5 cards, and how playing a card moves between them
+
+    def __init__(self, cards):
+        self.cards = tuple(sorted(CARD_INDEX[card] if isinstance(card, str) else card for card in cards))
+        if len(set(self.cards)) != 5:
+            raise ValueError("A tablebase needs 5 different cards")
+        self.distributions = []
+        for p1_hand in itertools.combinations(self.cards, 2):
+            rest = [card for card in self.cards if card not in p1_hand]
+            for p2_hand in itertools.combinations(rest, 2):
+                center = next(card for card in rest if card not in p2_hand)
+                self.distributions.append((p1_hand, p2_hand, center))
+        self.distribution_index = {distribution: i for i, distribution in enumerate(self.distributions)}
+
+        # after_play[distribution][side] -> [(card played, next distribution)]
+        # before_play[distribution][side] -> distributions side could have played from to reach this one
+        self.after_play = []
+        self.before_play = [[[], []] for _ in self.distributions]
+        for i, (p1_hand, p2_hand, center) in enumerate(self.distributions):
+            per_side = []
+            for side, hand in ((P1, p1_hand), (P2, p2_hand)):
+                plays = []
+                for card in hand:
+                    new_hand = tuple(sorted((center, *(other for other in hand if other != card))))
+                    hands = (new_hand, p2_hand) if side == P1 else (p1_hand, new_hand)
+                    next_distribution = self.distribution_index[(*hands, card)]
+                    plays.append((card, next_distribution))
+                    self.before_play[next_distribution][side].append(i)
+                per_side.append(plays)
+            self.after_play.append(per_side)
+
+    @property
+    def name(self) -> str:
+        return "-".join(CARD_NAMES[card] for card in self.cards)
+
+    def distribution_of(self, board_state: BoardState) -> int:
+        return self.distribution_index[(tuple(sorted(CARD_INDEX[card] for card in board_state.p1_cards)),
+                                        tuple(sorted(CARD_INDEX[card] for card in board_state.p2_cards)),
+                                        CARD_INDEX[board_state.center_card])]
+
+
+def table_size(p1_students: int, p2_students: int) -> int:
+    # Every placement is indexed, including impossible ones (overlapping pieces, finished games), which keeps the
+    # index simple to compute but makes tables large: the largest table with 3 students (2 against 1) has 281M
+    # entries, a 562MB file and about 2GB of memory while generating (7 bytes per entry), and with 4 students (2
+    # against 2) 3.4G entries, 6.75GB on disk and about 24GB to generate
+    return SQUARES * SQUARES * len(COMBINATIONS[p1_students]) * len(COMBINATIONS[p2_students]) * 30 * 2
+
+
+def table_index(p1_students: int, p2_students: int, p1_master: int, p2_master: int, p1_mask: int, p2_mask: int,
+                distribution: int, side: int) -> int:
+    # Masters are squares, students are masks
+    index = p1_master * SQUARES + p2_master
+    index = index * len(COMBINATIONS[p1_students]) + COMBINATION_RANK[p1_students][p1_mask]
+    index = index * len(COMBINATIONS[p2_students]) + COMBINATION_RANK[p2_students][p2_mask]
+    return (index * 30 + distribution) * 2 + side
+
+
+def decode_index(p1_students: int, p2_students: int, index: int) -> tuple[int, int, int, int, int, int]:
+    index, side = divmod(index, 2)
+    index, distribution = divmod(index, 30)
+    index, p2_rank = divmod(index, len(COMBINATIONS[p2_students]))
+    index, p1_rank = divmod(index, len(COMBINATIONS[p1_students]))
+    p1_master, p2_master = divmod(index, SQUARES)
+    return (p1_master, p2_master, COMBINATIONS[p1_students][p1_rank], COMBINATIONS[p2_students][p2_rank],
+            distribution, side)
+
+
+def table_path(directory: str, card_set: CardSet, p1_students: int, p2_students: int) -> str:
+    return os.path.join(directory, f"{card_set.name}_{p1_students}{p2_students}.tb")
+
+
+def open_table(path: str) -> memoryview:
+    # Map a table file and return its values as a uint16 memoryview
+    with open(path, "rb") as table_file:
+        buffer = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:8] != TABLEBASE_MAGIC:
+        raise ValueError(f"{path} is not a tablebase file")
+    return memoryview(buffer)[HEADER.size:].cast("H")
+
+
+def _initialise_chunk(directory: str, cards: tuple[int, ...], p1_students: int, p2_students: int,
+                      p1_master: int) -> tuple[int, bytes, bytes, bytes]:
+    """
+    First pass over every position with the P1 master on p1_master: count the moves that stay in this table and
+    resolve the rest (immediate wins, and captures into the smaller tables, which are already finished)
+    """
+    card_set = CardSet(cards)
+    smaller = {}
+    for counts in ((p1_students - 1, p2_students), (p1_students, p2_students - 1)):
+        if min(counts) >= 0:
+            smaller[counts] = open_table(table_path(directory, card_set, *counts))
+
+    chunk = table_size(p1_students, p2_students) // SQUARES
+    offset = p1_master * chunk
+    win_at = array.array("H", bytes(2 * chunk))
+    remaining = array.array("B", bytes(chunk))
+    loss_floor = array.array("H", [CANNOT_LOSE]) * chunk
+
+    p1_master_bit = 1 << p1_master
+    for p2_master in range(SQUARES):
+        # Positions where a master already stands on the enemy temple are over, and stay 0
+        if p2_master == p1_master or p2_master == P1_TEMPLE or p1_master == P2_TEMPLE:
+            continue
+        p2_master_bit = 1 << p2_master
+        for p1_mask in COMBINATIONS[p1_students]:
+            if p1_mask & (p1_master_bit | p2_master_bit):
+                continue
+            for p2_mask in COMBINATIONS[p2_students]:
+                if p2_mask & (p1_master_bit | p2_master_bit | p1_mask):
+                    continue
+                base = table_index(p1_students, p2_students, p1_master, p2_master, p1_mask, p2_mask, 0, 0) - offset
+                for distribution in range(30):
+                    for side in (P1, P2):
+                        i = base + distribution * 2 + side
+                        win, count, floor = _initial_state(card_set, smaller, p1_students, p2_students, p1_master,
+                                                           p2_master, p1_mask, p2_mask, distribution, side)
+                        win_at[i] = win
+                        remaining[i] = count
+                        loss_floor[i] = floor
+    return p1_master, win_at.tobytes(), remaining.tobytes(), loss_floor.tobytes()
+
+
+def _initial_state(card_set: CardSet, smaller: dict, p1_students: int, p2_students: int, p1_master: int,
+                   p2_master: int, p1_mask: int, p2_mask: int, distribution: int, side: int) -> tuple[int, int, int]:
+    # Returns (earliest known win distance or 0, moves staying in this table, latest known loss distance or
+    # CANNOT_LOSE when some move is known to reach a draw or better)
+    if side == P1:
+        own_master, own_mask, enemy_master, enemy_mask = p1_master, p1_mask, p2_master, p2_mask
+    else:
+        own_master, own_mask, enemy_master, enemy_mask = p2_master, p2_mask, p1_master, p1_mask
+    own = own_mask | 1 << own_master
+    temple = TEMPLE_TARGET[side]
+
+    win = 0
+    count = 0
+    floor = 0
+    has_moves = False
+    for card, next_distribution in card_set.after_play[distribution][side]:
+        targets_by_square = CARD_TARGET_MASKS[card][side]
+        for square in squares_of(own):
+            for target in squares_of(targets_by_square[square] & ~own):
+                has_moves = True
+                if target == enemy_master or (square == own_master and target == temple):
+                    return 1, 0, CANNOT_LOSE
+                target_bit = 1 << target
+                if not enemy_mask & target_bit:
+                    count += 1
+                    continue
+
+                # Capture a student: look the result up in the smaller table
+                new_master = target if square == own_master else own_master
+                new_own_mask = own_mask if square == own_master else own_mask ^ (1 << square) ^ target_bit
+                new_enemy_mask = enemy_mask ^ target_bit
+                if side == P1:
+                    counts = (p1_students, p2_students - 1)
+                    child = table_index(*counts, new_master, enemy_master, new_own_mask, new_enemy_mask,
+                                        next_distribution, P2)
+                else:
+                    counts = (p1_students - 1, p2_students)
+                    child = table_index(*counts, enemy_master, new_master, new_enemy_mask, new_own_mask,
+                                        next_distribution, P1)
+                value = smaller[counts][child]
+                if value == 0:
+                    floor = CANNOT_LOSE
+                elif value % 2 == 0:
+                    # The opponent loses: a win for us
+                    win = value + 1 if not win else min(win, value + 1)
+                    floor = CANNOT_LOSE
+                elif floor != CANNOT_LOSE:
+                    floor = max(floor, value)
+
+    if not has_moves:
+        # Stuck: treated as a draw, like the tournament runner does
+        return 0, 0, CANNOT_LOSE
+    return win, count, floor
+
+
+def _predecessors(card_set: CardSet, p1_students: int, p2_students: int, index: int):
+    # Positions in this table with a non-capturing move that leads to index
+    p1_master, p2_master, p1_mask, p2_mask, distribution, side = decode_index(p1_students, p2_students, index)
+    mover = 1 - side
+    card = card_set.distributions[distribution][2]
+    occupied = p1_mask | p2_mask | 1 << p1_master | 1 << p2_master
+    if mover == P1:
+        mover_master, mover_mask = p1_master, p1_mask
+    else:
+        mover_master, mover_mask = p2_master, p2_mask
+    sources_by_square = SOURCE_MASKS[card][mover]
+    previous_distributions = card_set.before_play[distribution][mover]
+
+    for square in squares_of(mover_mask | 1 << mover_master):
+        for source in squares_of(sources_by_square[square] & ~occupied):
+            if square == mover_master:
+                # A master standing on the enemy temple would already have won
+                if source == TEMPLE_TARGET[mover]:
+                    continue
+                master, mask = source, mover_mask
+            else:
+                master, mask = mover_master, mover_mask ^ (1 << square) ^ (1 << source)
+            for previous in previous_distributions:
+                if mover == P1:
+                    yield table_index(p1_students, p2_students, master, p2_master, mask, p2_mask, previous, P1)
+                else:
+                    yield table_index(p1_students, p2_students, p1_master, master, p1_mask, mask, previous, P2)
+
+
+def generate_table(directory: str, card_set: CardSet, p1_students: int, p2_students: int,
+                   executor: ProcessPoolExecutor) -> str:
+    size = table_size(p1_students, p2_students)
+    chunk = size // SQUARES
+    win_at = array.array("H", bytes(2 * size))
+    remaining = array.array("B", bytes(size))
+    loss_floor = array.array("H", bytes(2 * size))
+
+    futures = [executor.submit(_initialise_chunk, directory, card_set.cards, p1_students, p2_students, p1_master)
+               for p1_master in range(SQUARES)]
+    for future in futures:
+        p1_master, win_bytes, remaining_bytes, floor_bytes = future.result()
+        start = p1_master * chunk
+        win_at[start:start + chunk] = array.array("H", win_bytes)
+        remaining[start:start + chunk] = array.array("B", remaining_bytes)
+        loss_floor[start:start + chunk] = array.array("H", floor_bytes)
+
+    # Buckets of positions by the distance they would be resolved at
+    buckets = {}
+    for i in range(size):
+        if win_at[i]:
+            buckets.setdefault(win_at[i], []).append(i)
+        elif not remaining[i] and loss_floor[i] != CANNOT_LOSE:
+            buckets.setdefault(loss_floor[i] + 1, []).append(i)
+
+    # Retrograde pass: resolve positions in order of distance, updating their predecessors
+    values = array.array("H", bytes(2 * size))
+    distance = 1
+    while distance <= max(buckets, default=0):
+        for i in buckets.pop(distance, ()):
+            if values[i]:
+                continue
+            values[i] = distance
+            for predecessor in _predecessors(card_set, p1_students, p2_students, i):
+                if values[predecessor]:
+                    continue
+                if distance % 2 == 0:
+                    # The predecessor can move into a lost position
+                    buckets.setdefault(distance + 1, []).append(predecessor)
+                elif not win_at[predecessor]:
+                    # (positions already known to win can't lose, and don't all have their moves counted)
+                    remaining[predecessor] -= 1
+                    if loss_floor[predecessor] != CANNOT_LOSE:
+                        loss_floor[predecessor] = max(loss_floor[predecessor], distance)
+                        if not remaining[predecessor]:
+                            buckets.setdefault(loss_floor[predecessor] + 1, []).append(predecessor)
+        distance += 1
+
+    path = table_path(directory, card_set, p1_students, p2_students)
+    # Write then rename, so a partly written table is never mistaken for a finished one
+    with open(path + ".tmp", "wb") as table_file:
+        table_file.write(HEADER.pack(TABLEBASE_MAGIC, *card_set.cards, p1_students, p2_students))
+        values.tofile(table_file)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def generate_tablebases(directory: str, cards: list[str], max_students: int = 1, workers: int = None):
+    # Every table with at most max_students students in total, skipping tables that are already on disk
+    if max_students > MAX_STUDENTS:
+        raise ValueError(f"At most {MAX_STUDENTS} students are supported")
+    os.makedirs(directory, exist_ok=True)
+    card_set = CardSet(cards)
+    with ProcessPoolExecutor(workers or os.cpu_count()) as executor:
+        for students in range(max_students + 1):
+            for p1_students in range(min(students, MAX_STUDENTS) + 1):
+                p2_students = students - p1_students
+                path = table_path(directory, card_set, p1_students, p2_students)
+                if os.path.exists(path):
+                    print(f"[TABLEBASE] {path} already generated")
+                    continue
+                start_time = time.perf_counter()
+                generate_table(directory, card_set, p1_students, p2_students, executor)
+                values = open_table(path)
+                counts = [0, 0, 0]
+                for value in values:
+                    counts[0 if not value else 1 if value % 2 else 2] += 1
+                print(f"[TABLEBASE] {path}: {len(values)} entries, {counts[1]} wins, {counts[2]} losses, "
+                      f"{counts[0]} draws or unreachable ({time.perf_counter() - start_time:.1f}s)")
+
+
+class Tablebase:
+    """
+    Probe the tables in a directory. Tables are memory-mapped the first time a position needs them, and
+    positions with more students than max_students are rejected before anything else is looked at
+    """
+
+    def __init__(self, directory: str, max_students: int = MAX_STUDENTS):
+        self.directory = directory
+        self.max_students = max_students
+        self.card_sets = {}
+        self.tables = {}
+        self.hits = 0
+
+    def table_for(self, board_state: BoardState, p1_students: int, p2_students: int):
+        cards = tuple(sorted(CARD_INDEX[card] for card in (*board_state.p1_cards, *board_state.p2_cards,
+                                                            board_state.center_card)))
+        key = (cards, p1_students, p2_students)
+        if key not in self.tables:
+            card_set = self.card_sets.setdefault(cards, CardSet(cards))
+            path = table_path(self.directory, card_set, p1_students, p2_students)
+            self.tables[key] = (card_set, open_table(path)) if os.path.exists(path) else None
+        return self.tables[key]
+
+    def probe_value(self, board_state: BoardState) -> int | None:
+        # Raw table value for a position that isn't over yet, or None if it isn't covered
+        p1_mask, p1_master, p2_mask, p2_master = board_state.piece_masks
+        p1_students = p1_mask.bit_count()
+        p2_students = p2_mask.bit_count()
+        if p1_students + p2_students > self.max_students or not p1_master or not p2_master:
+            return None
+        table = self.table_for(board_state, p1_students, p2_students)
+        if table is None:
+            return None
+        card_set, values = table
+        self.hits += 1
+        return values[table_index(p1_students, p2_students, p1_master.bit_length() - 1,
+                                  p2_master.bit_length() - 1, p1_mask, p2_mask, card_set.distribution_of(board_state),
+                                  P1 if board_state.is_p1_turn else P2)]
+
+    def probe(self, board_state: BoardState) -> int | None:
+        # Score for the player to move, on the same scale as the search
+        value = self.probe_value(board_state)
+        if value is None:
+            return None
+        if value == 0:
+            return 0
+        return TABLEBASE_WIN_SCORE - value if value % 2 else -(TABLEBASE_WIN_SCORE - value)
+
+
+def verify_tablebase(directory: str, cards: list[str], p1_students: int, p2_students: int, samples: int = 1000,
+                     seed: int = 0) -> bool:
+    # Check sampled positions against a one-ply search over their children's table values
+    rng = random.Random(seed)
+    tablebase = Tablebase(directory)
+    card_set = CardSet(cards)
+    size = table_size(p1_students, p2_students)
+    checked = 0
+    while checked < samples:
+        p1_master, p2_master, p1_mask, p2_mask, distribution, side = decode_index(p1_students, p2_students,
+                                                                                  rng.randrange(size))
+        if (1 << p1_master | 1 << p2_master) & (p1_mask | p2_mask) or p1_mask & p2_mask or p1_master == p2_master \
+                or p2_master == P1_TEMPLE or p1_master == P2_TEMPLE:
+            continue
+        p1_hand, p2_hand, center = card_set.distributions[distribution]
+        state = to_board_state(BitBoardState((p1_mask, p2_mask), (1 << p1_master, 1 << p2_master), side == P1,
+                                             p1_hand, p2_hand, center))
+        checked += 1
+
+        wins = []
+        losses = []
+        drawn = False
+        for move in get_all_valid_moves(state):
+            child = apply_move(state, move)
+            value = 0 if get_winner(child) is not None else tablebase.probe_value(child)
+            if get_winner(child) is not None or (value and value % 2 == 0):
+                wins.append(value + 1)
+            elif value:
+                losses.append(value + 1)
+            else:
+                drawn = True
+        expected = min(wins) if wins else 0 if drawn or not losses else max(losses)
+
+        actual = tablebase.probe_value(state)
+        if actual != expected:
+            print(f"[MISMATCH] {to_sen(state)}: table {actual}, expected {expected}")
+            return False
+    print(f"[TABLEBASE] {checked} sampled positions agree with their children")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate Onitama endgame tablebases")
+    parser.add_argument("directory")
+    parser.add_argument("cards", nargs=5, help="The 5 cards in play")
+    parser.add_argument("--students", type=int, default=1, choices=range(MAX_GENERATED_STUDENTS + 1),
+                        help="Maximum students on the board (both sides); 3 takes about 2GB of memory")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--verify", type=int, default=0, help="Check this many sampled positions per table")
+    args = parser.parse_args()
+    generate_tablebases(args.directory, args.cards, args.students, args.workers)
+    if args.verify:
+        for total in range(args.students + 1):
+            for p1_count in range(total + 1):
+                verify_tablebase(args.directory, args.cards, p1_count, total - p1_count, args.verify)
@@ -0,0 +1,334 @@
+import argparse
+import dataclasses
+import functools
+import itertools
+import json
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from Onitama.bot_tools import SearchContext, depth_limited_alpha_beta_id_minimax, timed_alpha_beta_id_minimax, \
+    get_all_valid_moves
+from Onitama.game_tools import BoardState, CARD_MOVES, LOGICAL_TO_MAILBOX, MAILBOX_TO_LOGICAL, apply_move, \
+    is_victory, to_sen
+from Onitama.mcts import MCTSSearcher
+from Onitama.opening_book import OpeningBook
+from Onitama.tablebase import Tablebase
+
+
+@dataclasses.dataclass(frozen=True)
+class EngineConfig:
+    name: str
+    depth: int = 4
+    time_budget: float | None = None
+    use_quiescence: bool = True
+    book: str | None = None
+    tablebase: str | None = None
+    # "alphabeta" or "mcts"; MCTS searches playouts playouts per move unless it has a time budget, over
+    # mcts_workers processes in MCTSSearcher's "root" or "leaf" (virtual loss) mode
+    engine: str = "alphabeta"
+    playouts: int | None = None
+    mcts_mode: str = "root"
+    mcts_workers: int = 1
+
+    @classmethod
+    def parse(cls, spec: str) -> "EngineConfig":
+        # "name:depth=5,time=0.2,quiescence=0,book=book.bin,tablebase=tables/" or
+        # "name:engine=mcts,playouts=2000,mode=leaf,workers=4"
+        name, _, options = spec.partition(":")
+        config = {"name": name}
+        for option in filter(None, options.split(",")):
+            key, _, value = option.partition("=")
+            if key == "depth":
+                config["depth"] = int(value)
+            elif key == "time":
+                config["time_budget"] = float(value)
+            elif key == "quiescence":
+                config["use_quiescence"] = value not in ("0", "false", "False")
+            elif key == "book":
+                config["book"] = value
+            elif key == "tablebase":
+                config["tablebase"] = value
+            elif key == "engine":
+                if value not in ("alphabeta", "mcts"):
+                    raise ValueError(f"Unknown engine '{value}' in '{spec}'")
+                config["engine"] = value
+            elif key == "playouts":
+                config["playouts"] = int(value)
+            elif key == "mode":
+                if value not in ("root", "leaf"):
+                    raise ValueError(f"Unknown MCTS mode '{value}' in '{spec}'")
+                config["mcts_mode"] = value
+            elif key == "workers":
+                config["mcts_workers"] = int(value)
+            else:
+                raise ValueError(f"Unknown engine option '{key}' in '{spec}'")
+        return cls(**config)
+
+
+@functools.lru_cache
+def load_book(path: str) -> OpeningBook:
+    # Each worker process loads a book once, not once per game
+    return OpeningBook.load(path)
+
+
+@functools.lru_cache
+def load_tablebase(directory: str) -> Tablebase:
+    return Tablebase(directory)
+
+
+class Engine:
+    def __init__(self, config: EngineConfig, seed: int = None):
+        self.config = config
+        # One context per game, so the transposition table carries over between moves
+        self.context = SearchContext(use_quiescence=config.use_quiescence,
+                                     tablebase=load_tablebase(config.tablebase) if config.tablebase else None)
+        self.book = load_book(config.book) if config.book else None
+        # Seeded per game and side, so tournaments with MCTS engines replay from the tournament seed
+        self.mcts = MCTSSearcher(config.mcts_workers, config.mcts_mode, seed=seed) if config.engine == "mcts" else None
+
+    def choose_move(self, board_state: BoardState) -> tuple[int, int, str]:
+        if self.book is not None:
+            move = self.book.probe(board_state)
+            if move is not None:
+                # Clear the previous search's statistics, since nothing was searched
+                self.context.new_search()
+                return move
+        if self.mcts is not None:
+            return self.mcts.search(board_state, self.config.time_budget, self.config.playouts)
+        if self.config.time_budget is not None:
+            return timed_alpha_beta_id_minimax(board_state, self.config.time_budget, context=self.context)
+        return depth_limited_alpha_beta_id_minimax(board_state, self.context, self.config.depth)
+
+    def close(self):
+        if self.mcts is not None:
+            self.mcts.close()
+
+
+@dataclasses.dataclass
+class GameRecord:
+    seed: int
+    p1: str
+    p2: str
+    start_sen: str
+    moves: list[str]
+    # Score for P1: 1, 0.5 or 0
+    p1_score: float
+    reason: str
+
+
+def deal_board(seed: int) -> BoardState:
+    # The card deal and starting player are the only random parts of a game
+    rng = random.Random(seed)
+    game_deck = rng.sample(list(CARD_MOVES.keys()), 5)
+    return BoardState(None, rng.choice((True, False)), game_deck[:2], game_deck[2:4], game_deck[4])
+
+
+def adjudicate(board: BoardState, seen: dict[int, int], plies: int, max_plies: int) -> tuple[float, str] | None:
+    # Returns (score for P1, reason) once the game is over, counting this visit to the position in seen
+    won, reason = is_victory(board)
+    if won:
+        return (1.0 if reason.startswith("Player 1") else 0.0), reason
+    # Shuffling pieces back and forth would otherwise never end
+    seen[board.zobrist_key] = seen.get(board.zobrist_key, 0) + 1
+    if seen[board.zobrist_key] >= 3:
+        return 0.5, "Draw by repetition"
+    if plies >= max_plies:
+        return 0.5, f"Draw after {max_plies} plies"
+    if not get_all_valid_moves(board):
+        return 0.5, "Draw, no legal moves"
+    return None
+
+
+def play_game(p1: EngineConfig, p2: EngineConfig, seed: int, max_plies: int = 200) -> GameRecord:
+    board = deal_board(seed)
+    start_sen = to_sen(board)
+    engines = {True: Engine(p1, seed * 2), False: Engine(p2, seed * 2 + 1)}
+    moves = []
+    seen = {}
+
+    try:
+        while True:
+            result = adjudicate(board, seen, len(moves), max_plies)
+            if result is not None:
+                p1_score, reason = result
+                break
+
+            move = engines[board.is_p1_turn].choose_move(board)
+            board = apply_move(board, move)
+            from_idx, to_idx, card = move
+            moves.append(f"{MAILBOX_TO_LOGICAL[from_idx]} {MAILBOX_TO_LOGICAL[to_idx]} {card}")
+    finally:
+        for engine in engines.values():
+            engine.close()
+
+    return GameRecord(seed, p1.name, p2.name, start_sen, moves, p1_score, reason)
+
+
+def _play_pairing(engine_a: EngineConfig, engine_b: EngineConfig, seed: int, max_plies: int) -> list[GameRecord]:
+    # Both colours on the same deal, so neither engine benefits from a lucky hand or first move
+    return [play_game(engine_a, engine_b, seed, max_plies), play_game(engine_b, engine_a, seed, max_plies)]
+
+
+def round_robin_pairings(engines: list[EngineConfig], rounds: int, rng: random.Random):
+    for _ in range(rounds):
+        yield [(a, b, rng.getrandbits(32)) for a, b in itertools.combinations(engines, 2)]
+
+
+def swiss_pairings(engines: list[EngineConfig], rounds: int, rng: random.Random, records: list[GameRecord]):
+    # Pair engines with similar scores, avoiding rematches where possible; the last engine sits out on odd counts
+    for _ in range(rounds):
+        scores = score_table(records, engines)
+        played = {(record.p1, record.p2) for record in records}
+        order = sorted(engines, key=lambda engine: (-scores[engine.name][0], rng.random()))
+
+        pairings = []
+        unpaired = order.copy()
+        while len(unpaired) >= 2:
+            first = unpaired.pop(0)
+            opponent = next((other for other in unpaired if (first.name, other.name) not in played), unpaired[0])
+            unpaired.remove(opponent)
+            pairings.append((first, opponent, rng.getrandbits(32)))
+        yield pairings
+
+
+def score_table(records: list[GameRecord], engines: list[EngineConfig]) -> dict[str, tuple[float, int]]:
+    # name -> (points, games)
+    table = {engine.name: [0.0, 0] for engine in engines}
+    for record in records:
+        table[record.p1][0] += record.p1_score
+        table[record.p2][0] += 1 - record.p1_score
+        table[record.p1][1] += 1
+        table[record.p2][1] += 1
+    return {name: (points, games) for name, (points, games) in table.items()}
+
+
+def estimate_elo(records: list[GameRecord], names: list[str], iterations: int = 200) -> dict[str, float]:
+    # Bradley-Terry maximum likelihood fit (MM algorithm), draws as half wins, with one virtual draw per pair
+    # so engines with perfect scores still get finite ratings. Ratings are centred on 0.
+    wins = {name: 0.0 for name in names}
+    games = {pair: 0.0 for pair in itertools.combinations(sorted(names), 2)}
+    for a, b in games:
+        games[a, b] += 1
+        wins[a] += 0.5
+        wins[b] += 0.5
+    for record in records:
+        wins[record.p1] += record.p1_score
+        wins[record.p2] += 1 - record.p1_score
+        games[tuple(sorted((record.p1, record.p2)))] += 1
+
+    strength = {name: 1.0 for name in names}
+    for _ in range(iterations):
+        updated = {}
+        for name in names:
+            denominator = sum(count / (strength[a] + strength[b]) for (a, b), count in games.items() if name in (a, b))
+            updated[name] = wins[name] / denominator if denominator else strength[name]
+        mean_log = sum(math.log(value) for value in updated.values()) / len(updated)
+        strength = {name: value / math.exp(mean_log) for name, value in updated.items()}
+
+    return {name: 400 * math.log10(value) for name, value in strength.items()}
+
+
+def elo_confidence_intervals(records: list[GameRecord], names: list[str], seed: int, samples: int = 200,
+                             confidence: float = 0.95) -> dict[str, tuple[float, float]]:
+    # Bootstrap over games
+    rng = random.Random(seed)
+    estimates = {name: [] for name in names}
+    for _ in range(samples):
+        resampled = [rng.choice(records) for _ in records]
+        for name, elo in estimate_elo(resampled, names, iterations=50).items():
+            estimates[name].append(elo)
+
+    tail = (1 - confidence) / 2
+    intervals = {}
+    for name, values in estimates.items():
+        values.sort()
+        intervals[name] = (values[int(tail * (samples - 1))], values[int((1 - tail) * (samples - 1))])
+    return intervals
+
+
+def run_tournament(engines: list[EngineConfig], tournament_format: str = "round_robin", rounds: int = 1,
+                   seed: int = 0, workers: int = None, max_plies: int = 200,
+                   output_path: str = None) -> list[GameRecord]:
+    if len({engine.name for engine in engines}) != len(engines):
+        raise ValueError("Engine names must be unique")
+    rng = random.Random(seed)
+    records = []
+    output = open(output_path, "w") if output_path else None
+
+    with ProcessPoolExecutor(workers or os.cpu_count()) as executor:
+        if tournament_format == "round_robin":
+            schedule = round_robin_pairings(engines, rounds, rng)
+        elif tournament_format == "swiss":
+            schedule = swiss_pairings(engines, rounds, rng, records)
+        else:
+            raise ValueError(f"Unknown tournament format '{tournament_format}'")
+
+        # Games within a round run in parallel; Swiss needs each round's results before pairing the next
+        for round_number, pairings in enumerate(schedule, 1):
+            futures = [executor.submit(_play_pairing, a, b, game_seed, max_plies) for a, b, game_seed in pairings]
+            for future in futures:
+                for record in future.result():
+                    records.append(record)
+                    if output:
+                        output.write(json.dumps(dataclasses.asdict(record)) + "\n")
+            print(f"[ROUND {round_number}] {len(pairings) * 2} games played")
+
+    if output:
+        output.close()
+    print_standings(records, engines, seed)
+    return records
+
+
+def print_standings(records: list[GameRecord], engines: list[EngineConfig], seed: int = 0):
+    names = [engine.name for engine in engines]
+    scores = score_table(records, engines)
+    elo = estimate_elo(records, names)
+    intervals = elo_confidence_intervals(records, names, seed)
+    print(f"{'engine':<16} {'games':>5} {'score':>6} {'elo':>7}  95% interval")
+    for name in sorted(names, key=lambda engine_name: -elo[engine_name]):
+        points, games = scores[name]
+        low, high = intervals[name]
+        print(f"{name:<16} {games:>5} {points:>6.1f} {elo[name]:>7.0f}  [{low:.0f}, {high:.0f}]")
+
+
+def replay_game(p1: EngineConfig, p2: EngineConfig, seed: int, max_plies: int = 200) -> GameRecord:
+    # Replay a game from its seed, printing every position (only reproducible for engines without a time budget)
+    record = play_game(p1, p2, seed, max_plies)
+    board = deal_board(seed)
+    print(board)
+    for move in record.moves:
+        logical_from, logical_to, card = move.split()
+        board = apply_move(board, (LOGICAL_TO_MAILBOX[int(logical_from)], LOGICAL_TO_MAILBOX[int(logical_to)], card))
+        print(f"\n{move}\n{board}")
+    print(record.reason)
+    return record
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Onitama bot tournaments")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Play a tournament")
+    run_parser.add_argument("--engine", action="append", required=True,
+                            help="Engine spec 'name:depth=4,time=0.1,quiescence=1,book=book.bin' (repeat per engine)")
+    run_parser.add_argument("--format", choices=("round_robin", "swiss"), default="round_robin")
+    run_parser.add_argument("--rounds", type=int, default=1)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--workers", type=int, default=None)
+    run_parser.add_argument("--max-plies", type=int, default=200)
+    run_parser.add_argument("--output", default=None, help="Write game records as JSON lines")
+
+    replay_parser = subparsers.add_parser("replay", help="Replay one game from its seed")
+    replay_parser.add_argument("--p1", required=True)
+    replay_parser.add_argument("--p2", required=True)
+    replay_parser.add_argument("--seed", type=int, required=True)
+    replay_parser.add_argument("--max-plies", type=int, default=200)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run_tournament([EngineConfig.parse(spec) for spec in args.engine], args.format, args.rounds, args.seed,
+                       args.workers, args.max_plies, args.output)
+    else:
+        replay_game(EngineConfig.parse(args.p1), EngineConfig.parse(args.p2), args.seed, args.max_plies)
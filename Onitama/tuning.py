@@ -0,0 +1,125 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from Onitama.batch_eval import DEFAULT_WEIGHTS, FEATURE_NAMES, RECORD_DTYPE, batch_features, encode_records
+from Onitama.bot_tools import EVAL_WEIGHTS_PATH
+from Onitama.game_records import NO_MOVE, RECORD_SIZE, RESULT_UNKNOWN, RecordReader
+
+# Positions are featurised in chunks to bound the memory used by batch_features
+FEATURE_CHUNK = 200000
+
+
+def load_training_data(paths: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Read game records into (features, targets): the batch_features of every position with a known result and a move
+    played from it, and the score of the side to move in that game (1 for a win, 0.5 for a draw, 0 for a loss)
+    """
+    features = []
+    targets = []
+    for path in paths:
+        with RecordReader(path) as reader:
+            for start in range(0, len(reader), FEATURE_CHUNK):
+                chunk = reader.buffer[start * RECORD_SIZE:(start + FEATURE_CHUNK) * RECORD_SIZE]
+                planes, cards, is_p1_turn = encode_records(chunk)
+                records = np.frombuffer(chunk, dtype=RECORD_DTYPE)
+                results = records["result"]
+                keep = (results != RESULT_UNKNOWN) & (records["move"][:, 0] != NO_MOVE)
+                # Results are 0, 1, 2 for a P2 win, draw and P1 win
+                p1_scores = results[keep] / 2
+                targets.append(np.where(is_p1_turn[keep], p1_scores, 1 - p1_scores))
+                features.append(batch_features(planes[keep], cards[keep], is_p1_turn[keep]))
+    if not features:
+        return np.empty((0, len(FEATURE_NAMES))), np.empty(0)
+    return np.concatenate(features).astype(np.float64), np.concatenate(targets)
+
+
+def prediction_error(features: np.ndarray, targets: np.ndarray, weights: np.ndarray, scale: float) -> float:
+    # Mean squared error of the win probability predicted from the evaluation
+    predictions = 1 / (1 + np.exp(-scale * (features @ weights)))
+    return float(np.mean((predictions - targets) ** 2))
+
+
+def fit_scale(features: np.ndarray, targets: np.ndarray, weights: np.ndarray, low: float = 1e-6,
+              high: float = 1.0, iterations: int = 60) -> float:
+    # The sigmoid scale that maps evaluations to win probabilities best, by golden-section search over its logarithm
+    ratio = (5 ** 0.5 - 1) / 2
+    low, high = np.log(low), np.log(high)
+    for _ in range(iterations):
+        left = high - ratio * (high - low)
+        right = low + ratio * (high - low)
+        if (prediction_error(features, targets, weights, np.exp(left))
+                < prediction_error(features, targets, weights, np.exp(right))):
+            high = right
+        else:
+            low = left
+    return float(np.exp((low + high) / 2))
+
+
+def tune_weights(features: np.ndarray, targets: np.ndarray, weights: np.ndarray, scale: float,
+                 iterations: int = 500, learning_rate: float = 1.0, verbose: bool = True) -> np.ndarray:
+    """
+    Minimise the prediction error over the weights with Adam, keeping the scale fixed so the weights stay in the
+    current evaluation units. The gradient for every weight is computed at once as a matrix product of the features
+    with the per-position error terms
+    """
+    weights = weights.astype(np.float64).copy()
+    first_moment = np.zeros_like(weights)
+    second_moment = np.zeros_like(weights)
+    beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+    scaled_features = features * scale
+
+    for step in range(1, iterations + 1):
+        predictions = 1 / (1 + np.exp(-(scaled_features @ weights)))
+        residuals = (predictions - targets) * predictions * (1 - predictions)
+        gradient = (2 / len(targets)) * (scaled_features.T @ residuals)
+
+        first_moment = beta1 * first_moment + (1 - beta1) * gradient
+        second_moment = beta2 * second_moment + (1 - beta2) * gradient ** 2
+        corrected_first = first_moment / (1 - beta1 ** step)
+        corrected_second = second_moment / (1 - beta2 ** step)
+        weights -= learning_rate * corrected_first / (np.sqrt(corrected_second) + epsilon)
+
+        if verbose and (step % 100 == 0 or step == iterations):
+            error = float(np.mean((predictions - targets) ** 2))
+            print(f"[TUNE] step {step}: error {error:.6f}, weights {np.round(weights).astype(int).tolist()}")
+    return weights
+
+
+def save_weights(path: str, weights: np.ndarray):
+    # Rounded to integers, since the evaluators work in whole points
+    with open(path, "w") as weights_file:
+        json.dump({name: int(round(value)) for name, value in zip(FEATURE_NAMES, weights)}, weights_file, indent=4)
+        weights_file.write("\n")
+
+
+def run_tuning(record_paths: list[str], output_path: str = EVAL_WEIGHTS_PATH, iterations: int = 500,
+               learning_rate: float = 1.0) -> dict[str, int]:
+    start_time = time.perf_counter()
+    features, targets = load_training_data(record_paths)
+    if not len(targets):
+        raise ValueError("No positions with a known result in the records")
+    print(f"[TUNE] {len(targets)} positions loaded in {time.perf_counter() - start_time:.1f}s")
+
+    scale = fit_scale(features, targets, DEFAULT_WEIGHTS)
+    print(f"[TUNE] scale {scale:.6f}, error with current weights "
+          f"{prediction_error(features, targets, DEFAULT_WEIGHTS, scale):.6f}")
+    weights = np.round(tune_weights(features, targets, DEFAULT_WEIGHTS, scale, iterations, learning_rate))
+    print(f"[TUNE] error with tuned weights {prediction_error(features, targets, weights, scale):.6f} "
+          f"({time.perf_counter() - start_time:.1f}s)")
+
+    save_weights(output_path, weights)
+    print(f"[TUNE] weights written to {output_path}")
+    return {name: int(value) for name, value in zip(FEATURE_NAMES, weights)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit evaluation weights to game results (Texel tuning)")
+    parser.add_argument("records", nargs="+", help="Game record files from game_records.py or self_play.py")
+    parser.add_argument("--output", default=EVAL_WEIGHTS_PATH, help="Weight file to write")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--learning-rate", type=float, default=1.0, help="Adam step size, in evaluation points")
+    args = parser.parse_args()
+    run_tuning(args.records, args.output, args.iterations, args.learning_rate)